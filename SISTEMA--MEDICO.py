@@ -1,64 +1,3920 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, font
-import pandas as pd
-from datetime import datetime
+from tkinter import ttk, messagebox, font, filedialog
+from datetime import datetime, timedelta
 import os
+import sys
+import asyncio
 import hashlib
+import hmac
 import json
+import bisect
+import collections
+import contextlib
+import cProfile
+import functools
+import heapq
+import importlib
+import itertools
+import operator
+import pickle
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class ModuloPerezoso:
+    """Importa un módulo recién la primera vez que se usa.
+    
+    pandas (y openpyxl a través de él) tarda varios segundos en importarse;
+    así la ventana de login aparece antes y la importación se hace después,
+    en segundo plano.
+    """
+    
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+        self._lock = threading.Lock()
+    
+    def cargar(self):
+        """Importar el módulo si todavía no se importó"""
+        if self._modulo is None:
+            with self._lock:
+                if self._modulo is None:
+                    self._modulo = importlib.import_module(self._nombre)
+        return self._modulo
+    
+    def __getattr__(self, atributo):
+        return getattr(self.cargar(), atributo)
+
+
+pd = ModuloPerezoso("pandas")
+np = ModuloPerezoso("numpy")
+
+COLUMNAS_CITAS = ["ID", "Paciente", "Doctor", "Fecha", "Hora", "Duracion", "Motivo", "Estado", "Version"]
+COLUMNAS_TABLA = ["Paciente", "Doctor", "Fecha", "Hora", "Motivo", "Estado"]
+ESTADOS_CITA = ["Agendada", "Reprogramada", "Atendida", "No asistió"]
+
+# Agenda: duración por defecto (minutos) y horario de atención
+DURACION_CITA = 30
+HORARIO_ATENCION = (8 * 60, 18 * 60)
+
+# Cada cuánto (ms) se buscan cambios hechos desde otras estaciones
+INTERVALO_VIGILANCIA = 2000
+
+# API HTTP local (solo con --api): puerto y duración de cada sesión (segundos)
+PUERTO_API = 8765
+DURACION_SESION_API = 8 * 60 * 60
+
+# Importación y exportación masiva: filas por lote y filas por hoja de Excel
+TAMANO_LOTE = 50_000
+FILAS_HOJA_EXCEL = 1_048_576
+
+# Contraseñas: iteraciones de PBKDF2 y bloqueo tras intentos fallidos (segundos)
+ITERACIONES_PBKDF2 = 600_000
+MAXIMO_INTENTOS = 5
+ESPERA_BLOQUEO = 30
+ESPERA_BLOQUEO_MAXIMA = 15 * 60
+
+# Recordatorios: minutos de anticipación de cada aviso, notificador (None
+# para no enviarlos desde esta estación) y espera máxima del hilo (segundos)
+ANTICIPACION_RECORDATORIOS = {"dia_anterior": 24 * 60, "hora_anterior": 60}
+NOTIFICADOR_RECORDATORIOS = "bandeja"
+INTERVALO_RECORDATORIOS = 60
+
+# Operaciones que cada usuario puede deshacer
+LIMITE_DESHACER = 100
+
+# Usuarios que pueden abrir el panel de rendimiento (Ctrl+Shift+P)
+USUARIOS_ADMIN = {"admin"}
+
+
+FORMATOS_HORA = ("%H:%M", "%I:%M %p", "%H:%M:%S")
+
+
+@functools.lru_cache(maxsize=4096)
+def hora_a_minutos(hora):
+    """Convertir una hora (14:30 o 2:30 PM) a minutos desde medianoche, o None.
+    
+    Los valores posibles son pocos y se repiten mucho, así que el resultado
+    se guarda en caché y cada texto distinto se interpreta una sola vez.
+    """
+    texto = hora.strip().upper()
+    for formato in FORMATOS_HORA:
+        try:
+            t = datetime.strptime(texto, formato)
+            return t.hour * 60 + t.minute
+        except ValueError:
+            pass
+    return None
+
+
+def minutos_a_hora(minutos):
+    """Formatear minutos desde medianoche como HH:MM"""
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+def columna_minutos(horas):
+    """Minutos desde medianoche de una columna de horas (-1 si no es válida).
+    
+    Solo se interpreta cada hora distinta (hay pocas) y el resultado se
+    reparte a todas las filas con indexación de NumPy.
+    """
+    codigos, valores = pd.factorize(horas.astype(str))
+    minutos = np.array([m if m is not None else -1 for m in map(hora_a_minutos, valores)] + [-1])
+    return minutos[codigos]
+
+
+def normalizar_hora(hora):
+    """Hora en formato HH:MM de 24 horas; si no se reconoce, se deja igual"""
+    if not isinstance(hora, str):
+        return hora
+    minutos = hora_a_minutos(hora)
+    return hora if minutos is None else minutos_a_hora(minutos)
+
+
+def nuevo_id():
+    """Generar un identificador único y persistente para una cita"""
+    return uuid.uuid4().hex
+
+
+def normalizar_citas(df):
+    """Asegurar columnas, asignar ID y llevar las horas a HH:MM.
+    
+    Devuelve el DataFrame normalizado y si hubo que migrar datos (libros
+    creados antes de que existieran los ID o con horas como "2:30 PM"),
+    para que el almacenamiento los reescriba una sola vez.
+    """
+    df = df.reindex(columns=COLUMNAS_CITAS)
+    df["Doctor"] = df["Doctor"].fillna("")
+    df["Duracion"] = df["Duracion"].fillna(DURACION_CITA).astype(int)
+    df["Version"] = df["Version"].fillna(1).astype(int)
+    
+    horas = df["Hora"].astype(object)
+    normalizadas = horas.map(normalizar_hora)
+    horas_migradas = bool((normalizadas != horas).any())
+    df["Hora"] = normalizadas
+    
+    sin_id = df["ID"].isna()
+    if sin_id.any():
+        df["ID"] = df["ID"].astype(object)
+        df.loc[sin_id, "ID"] = [nuevo_id() for _ in range(int(sin_id.sum()))]
+    return df, bool(sin_id.any()) or horas_migradas
+
+
+class Metricas:
+    """Tiempos y contadores de los caminos críticos, para diagnosticar en el lugar.
+    
+    Cada medición conserva sus últimas duraciones (percentiles móviles) y un
+    registro acotado de eventos que se exporta en el formato de trazas de
+    Chrome (chrome://tracing, Perfetto). Medir cuesta dos lecturas del reloj
+    y un append, así que queda siempre activo. El perfil con cProfile es
+    opcional y solo cubre el hilo que lo inicia (el de la interfaz).
+    """
+    
+    def __init__(self, ventana=1000, maximo_eventos=20000):
+        self.ventana = ventana
+        self.duraciones = {}
+        self.totales = {}
+        self.contadores = {}
+        self.eventos = collections.deque(maxlen=maximo_eventos)
+        self.hilos = {}
+        self.origen = time.perf_counter()
+        self.perfil = None
+        self.lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def medir(self, nombre):
+        """Medir la duración de un bloque"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(nombre, inicio, time.perf_counter() - inicio)
+    
+    def registrar(self, nombre, inicio, duracion):
+        """Anotar una duración (segundos) que empezó en `inicio` (perf_counter)"""
+        hilo = threading.current_thread()
+        with self.lock:
+            ventana = self.duraciones.get(nombre)
+            if ventana is None:
+                ventana = self.duraciones[nombre] = collections.deque(maxlen=self.ventana)
+            ventana.append(duracion)
+            self.totales[nombre] = self.totales.get(nombre, 0) + 1
+            self.eventos.append((nombre, inicio, duracion, hilo.ident))
+            self.hilos[hilo.ident] = hilo.name
+    
+    def contar(self, nombre, cantidad=1):
+        """Sumar a un contador"""
+        with self.lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+    
+    def percentiles(self, nombre, cuantiles=(50, 90, 99)):
+        """Percentiles y máximo (ms) de las últimas duraciones de una medición"""
+        with self.lock:
+            duraciones = sorted(self.duraciones.get(nombre, ()))
+        if not duraciones:
+            return {}
+        resultado = {f"p{cuantil}": duraciones[min(len(duraciones) - 1, len(duraciones) * cuantil // 100)] * 1000
+                     for cuantil in cuantiles}
+        resultado["max"] = duraciones[-1] * 1000
+        return resultado
+    
+    def resumen(self):
+        """Total y percentiles de cada medición, y los contadores"""
+        with self.lock:
+            totales = dict(self.totales)
+            contadores = dict(self.contadores)
+        return {"mediciones": {nombre: {"total": total, **self.percentiles(nombre)}
+                               for nombre, total in sorted(totales.items())},
+                "contadores": dict(sorted(contadores.items()))}
+    
+    def reiniciar(self):
+        """Descartar mediciones, contadores y eventos"""
+        with self.lock:
+            self.duraciones.clear()
+            self.totales.clear()
+            self.contadores.clear()
+            self.eventos.clear()
+    
+    def exportar_trazas(self, destino):
+        """Guardar los eventos en el formato de trazas de Chrome, con el resumen"""
+        with self.lock:
+            eventos = list(self.eventos)
+            hilos = dict(self.hilos)
+        pid = os.getpid()
+        trazas = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": nombre}}
+                  for tid, nombre in hilos.items()]
+        trazas += [{"name": nombre, "ph": "X", "pid": pid, "tid": tid,
+                    "ts": round((inicio - self.origen) * 1e6, 1), "dur": round(duracion * 1e6, 1)}
+                   for nombre, inicio, duracion, tid in eventos]
+        with open(destino, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": trazas, "displayTimeUnit": "ms", "otherData": self.resumen()},
+                      f, ensure_ascii=False)
+    
+    def perfilando(self):
+        """Si hay un perfil de cProfile en curso"""
+        return self.perfil is not None
+    
+    def iniciar_perfil(self):
+        """Empezar a perfilar con cProfile el hilo que llama"""
+        if self.perfil is None:
+            self.perfil = cProfile.Profile()
+            self.perfil.enable()
+    
+    def detener_perfil(self, destino=None):
+        """Detener el perfil y guardarlo (se abre con pstats o snakeviz)"""
+        perfil, self.perfil = self.perfil, None
+        if perfil is None:
+            return None
+        perfil.disable()
+        if destino:
+            perfil.dump_stats(destino)
+        return perfil
+
+
+METRICAS = Metricas()
+
+
+def medido(nombre):
+    """Decorador: medir con METRICAS cada llamada a la función"""
+    def decorar(funcion):
+        @functools.wraps(funcion)
+        def medida(*args, **kwargs):
+            with METRICAS.medir(nombre):
+                return funcion(*args, **kwargs)
+        return medida
+    return decorar
+
+
+class RegistroCitas:
+    """Citas en memoria indexadas por ID.
+    
+    El diccionario ID -> cita permite agregar, actualizar y eliminar en O(1)
+    sin copiar el DataFrame. El DataFrame completo se arma solo cuando se
+    necesita (exportar, compactar) y queda en caché hasta el próximo cambio.
+    Los cambios se hacen desde la interfaz y el DataFrame puede pedirse desde
+    el hilo de E/S, por eso ambos pasan por el mismo lock.
+    """
+    
+    def __init__(self, df=None):
+        self.citas = {}
+        self._df = None
+        self.version = 0
+        self.lock = threading.RLock()
+        if df is not None:
+            self.cargar(df)
+    
+    def cargar(self, df):
+        """Reemplazar el contenido con las filas de un DataFrame"""
+        citas = {cita["ID"]: cita for cita in df.to_dict("records")}
+        with self.lock:
+            self.citas = citas
+            self._df = df
+            self.version += 1
+    
+    def copia(self):
+        """Otro registro con las mismas citas (los registros no se mutan)"""
+        copia = RegistroCitas()
+        with self.lock:
+            copia.citas = dict(self.citas)
+            copia._df = self._df
+        return copia
+    
+    def __len__(self):
+        return len(self.citas)
+    
+    def __contains__(self, id_cita):
+        return id_cita in self.citas
+    
+    def ids(self):
+        """IDs en orden de inserción"""
+        return list(self.citas)
+    
+    def obtener(self, id_cita):
+        """Cita con ese ID"""
+        return self.citas[id_cita]
+    
+    def agregar(self, cita):
+        """Agregar una cita nueva"""
+        with self.lock:
+            self.citas[cita["ID"]] = cita
+            self.invalidar()
+    
+    def agregar_varias(self, citas):
+        """Agregar muchas citas nuevas de una vez"""
+        with self.lock:
+            self.citas.update((cita["ID"], cita) for cita in citas)
+            self.invalidar()
+    
+    def actualizar(self, id_cita, cambios):
+        """Modificar campos de una cita (se reemplaza el registro, no se muta)"""
+        with self.lock:
+            self.citas[id_cita] = {**self.citas[id_cita], **cambios}
+            self.invalidar()
+    
+    def eliminar(self, id_cita):
+        """Quitar una cita y devolverla"""
+        with self.lock:
+            self.invalidar()
+            return self.citas.pop(id_cita)
+    
+    def invalidar(self):
+        """Descartar el DataFrame en caché tras un cambio"""
+        self._df = None
+        self.version += 1
+    
+    @property
+    def df(self):
+        """DataFrame con todas las citas (solo lectura)"""
+        with self.lock:
+            if self._df is not None:
+                return self._df
+            citas = list(self.citas.values())
+            version = self.version
+        # Armar el DataFrame fuera del lock para no frenar a la interfaz
+        df = pd.DataFrame(citas, columns=COLUMNAS_CITAS)
+        with self.lock:
+            if self.version == version:
+                self._df = df
+        return df
+
+
+def aplicar_operacion(registro, operacion, datos):
+    """Aplicar una operación registrada sobre el registro de citas"""
+    if operacion == "agregar":
+        registro.agregar(datos["cita"])
+    elif operacion == "importar":
+        registro.agregar_varias(datos["citas"])
+    elif operacion == "actualizar" and datos["id"] in registro:
+        registro.actualizar(datos["id"], datos["cambios"])
+    elif operacion == "eliminar" and datos["id"] in registro:
+        registro.eliminar(datos["id"])
+
+
+def ids_operacion(operacion, datos):
+    """IDs de las citas que toca una operación"""
+    if operacion == "agregar":
+        return [datos["cita"]["ID"]]
+    if operacion == "importar":
+        return [cita["ID"] for cita in datos["citas"]]
+    return [datos["id"]]
+
+
+def valores_iguales(a, b):
+    """Comparar dos valores de una cita (dos vacíos cuentan como iguales)"""
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return a == b
+
+
+class ConflictoCita(Exception):
+    """Otra estación cambió la cita y la operación no se puede fusionar.
+    
+    `cambios` trae el estado vigente de las citas afectadas ({ID: cita o
+    None}) para que la interfaz descarte su versión, o None si hay que
+    recargar todo.
+    """
+    
+    def __init__(self, mensaje, cambios=None):
+        super().__init__(mensaje)
+        self.cambios = cambios
+
+
+def validar_operacion(actual, operacion, datos):
+    """Revisar una operación contra la versión vigente de la cita.
+    
+    Si la versión que vio el usuario ya no es la vigente, los cambios se
+    fusionan campo por campo: solo hay conflicto si otra estación cambió un
+    mismo campo a un valor distinto. Devuelve los datos a registrar (con la
+    versión nueva) o None si no queda nada por hacer.
+    """
+    if operacion in ("agregar", "importar"):
+        return datos
+    
+    if operacion == "eliminar":
+        if actual is None:
+            # Otra estación ya la eliminó
+            return None
+        if "version" in datos and actual["Version"] != datos["version"]:
+            raise ConflictoCita("La cita fue modificada en otra estación. "
+                                "Revise los datos antes de eliminarla.")
+        return datos
+    
+    if actual is None:
+        raise ConflictoCita("La cita fue eliminada en otra estación.")
+    cambios = dict(datos["cambios"])
+    if "version" in datos and actual["Version"] != datos["version"]:
+        base = datos.get("base", {})
+        for campo, valor in cambios.items():
+            if (campo in base and not valores_iguales(actual.get(campo), base[campo])
+                    and not valores_iguales(actual.get(campo), valor)):
+                raise ConflictoCita(f"Otra estación cambió el campo {campo} de esta cita.")
+    cambios["Version"] = int(actual["Version"]) + 1
+    return {**datos, "cambios": cambios}
+
+
+CAMPOS_HORARIO = ("Doctor", "Fecha", "Hora", "Duracion")
+
+
+def citas_a_ubicar(operacion, datos, actual):
+    """Citas que una operación agrega o cambia de horario, tal como quedarían"""
+    if operacion == "agregar":
+        return [datos["cita"]]
+    if operacion == "importar":
+        return list(datos["citas"]) if datos.get("verificar_horarios", True) else []
+    if operacion == "actualizar" and actual is not None and any(campo in datos["cambios"] for campo in CAMPOS_HORARIO):
+        return [{**actual, **datos["cambios"]}]
+    return []
+
+
+def verificar_choques(agenda, citas, obtener):
+    """Lanzar ConflictoCita si alguna cita se cruza con otra ya guardada del mismo doctor.
+    
+    Se llama con el bloqueo compartido tomado y la agenda al día con lo que
+    anexaron las demás estaciones, así dos estaciones no pueden ocupar el
+    mismo horario aunque cada una lo viera libre.
+    """
+    for cita in citas:
+        inicio = hora_a_minutos(str(cita["Hora"]))
+        if inicio is None:
+            continue
+        ocupado_por = agenda.conflicto(cita["Doctor"], str(cita["Fecha"]), inicio,
+                                       int(cita["Duracion"] or DURACION_CITA), ignorar=cita["ID"])
+        if ocupado_por is not None:
+            ocupada = obtener(ocupado_por)
+            raise ConflictoCita(f"Otra estación ya ocupó ese horario: cita de {ocupada['Paciente']} "
+                                f"el {ocupada['Fecha']} a las {ocupada['Hora']}.")
+
+
+class BloqueoArchivo:
+    """Bloqueo exclusivo entre procesos sobre un archivo auxiliar.
+    
+    Usa fcntl en Linux/macOS y msvcrt en Windows. Dentro de un mismo hilo es
+    reentrante; otros hilos del proceso esperan igual que otras estaciones.
+    """
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.archivo = None
+        self.nivel = 0
+        self.hilos = threading.RLock()
+    
+    def adquirir(self, esperar=True):
+        """Tomar el bloqueo; sin esperar devuelve False si otro lo tiene"""
+        if not self.hilos.acquire(blocking=esperar):
+            return False
+        if self.nivel == 0:
+            archivo = open(self.ruta, 'a+b')
+            try:
+                tomado = self.bloquear(archivo, esperar)
+            except BaseException:
+                tomado = False
+                raise
+            finally:
+                if not tomado:
+                    archivo.close()
+                    self.hilos.release()
+            if not tomado:
+                return False
+            self.archivo = archivo
+        self.nivel += 1
+        return True
+    
+    def bloquear(self, archivo, esperar):
+        """Bloquear el archivo en el sistema operativo"""
+        if fcntl is not None:
+            try:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | (0 if esperar else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            return True
+        archivo.seek(0)
+        while True:
+            try:
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not esperar:
+                    return False
+                time.sleep(0.05)
+    
+    def liberar(self):
+        """Soltar el bloqueo tomado con adquirir"""
+        self.nivel -= 1
+        if self.nivel == 0:
+            if fcntl is not None:
+                fcntl.flock(self.archivo.fileno(), fcntl.LOCK_UN)
+            else:
+                self.archivo.seek(0)
+                msvcrt.locking(self.archivo.fileno(), msvcrt.LK_UNLCK, 1)
+            self.archivo.close()
+            self.archivo = None
+        self.hilos.release()
+    
+    def __enter__(self):
+        self.adquirir()
+        return self
+    
+    def __exit__(self, *excepcion):
+        self.liberar()
+
+
+class AgendaCitas:
+    """Índice de horarios ocupados por doctor y fecha.
+    
+    Cada día de cada doctor guarda una lista ordenada de intervalos
+    (inicio, fin, ID) en minutos desde medianoche. Detectar choques y buscar
+    huecos libres es una búsqueda binaria sobre ese día, sin importar cuántos
+    años de historial haya.
+    
+    Un día puede tener intervalos que se cruzan (importaciones sin
+    verificar horarios, libros anteriores), así que junto a cada lista se
+    guarda el mayor fin hasta cada posición: hacia atrás solo se revisan los
+    intervalos mientras alguno anterior todavía termine después del horario.
+    """
+    
+    def __init__(self, duracion=DURACION_CITA, horario=HORARIO_ATENCION):
+        self.duracion = duracion
+        self.apertura, self.cierre = horario
+        self.dias = {}
+        self.finales = {}
+        self.ubicaciones = {}
+    
+    def intervalo(self, cita):
+        """Clave del día e intervalo (inicio, fin, ID) de una cita, o None"""
+        inicio = hora_a_minutos(str(cita["Hora"]))
+        if inicio is None:
+            return None
+        duracion = int(cita.get("Duracion") or self.duracion)
+        return (cita.get("Doctor") or "", str(cita["Fecha"])), (inicio, inicio + duracion, cita["ID"])
+    
+    def cargar(self, citas):
+        """Construir el índice completo a partir de las citas"""
+        self.dias = {}
+        self.finales = {}
+        self.ubicaciones = {}
+        for cita in citas:
+            ubicacion = self.intervalo(cita)
+            if ubicacion is None:
+                continue
+            clave, intervalo = ubicacion
+            self.dias.setdefault(clave, []).append(intervalo)
+            self.ubicaciones[cita["ID"]] = ubicacion
+        for clave, intervalos in self.dias.items():
+            intervalos.sort()
+            self.recalcular_finales(clave, 0)
+    
+    def recalcular_finales(self, clave, desde):
+        """Rehacer el mayor fin acumulado de un día a partir de una posición"""
+        finales = self.finales.setdefault(clave, [])
+        del finales[desde:]
+        maximo = finales[-1] if finales else 0
+        for _, fin, _ in self.dias[clave][desde:]:
+            maximo = max(maximo, fin)
+            finales.append(maximo)
+    
+    def agregar(self, cita):
+        """Ocupar el horario de una cita"""
+        ubicacion = self.intervalo(cita)
+        if ubicacion is not None:
+            clave, intervalo = ubicacion
+            intervalos = self.dias.setdefault(clave, [])
+            posicion = bisect.bisect_left(intervalos, intervalo)
+            intervalos.insert(posicion, intervalo)
+            self.recalcular_finales(clave, posicion)
+            self.ubicaciones[cita["ID"]] = ubicacion
+    
+    def quitar(self, id_cita):
+        """Liberar el horario de una cita"""
+        ubicacion = self.ubicaciones.pop(id_cita, None)
+        if ubicacion is not None:
+            clave, intervalo = ubicacion
+            intervalos = self.dias[clave]
+            posicion = bisect.bisect_left(intervalos, intervalo)
+            del intervalos[posicion]
+            self.recalcular_finales(clave, posicion)
+    
+    def anteriores(self, clave, i, inicio, ignorar=None):
+        """Intervalos antes de la posición i que terminan después de `inicio`"""
+        intervalos = self.dias.get(clave, [])
+        finales = self.finales.get(clave, [])
+        i -= 1
+        while i >= 0 and finales[i] > inicio:
+            if intervalos[i][1] > inicio and intervalos[i][2] != ignorar:
+                yield intervalos[i]
+            i -= 1
+    
+    def mover(self, cita):
+        """Actualizar el horario de una cita reprogramada"""
+        self.quitar(cita["ID"])
+        self.agregar(cita)
+    
+    def conflicto(self, doctor, fecha, inicio, duracion=None, ignorar=None):
+        """ID de la cita que se cruza con el horario pedido, o None"""
+        clave = (doctor or "", fecha)
+        fin = inicio + (duracion or self.duracion)
+        # Entre los que empiezan antes de que termine el pedido, alguno que termine después de su inicio
+        i = bisect.bisect_left(self.dias.get(clave, []), (fin,))
+        for _, _, id_ocupado in self.anteriores(clave, i, inicio, ignorar):
+            return id_ocupado
+        return None
+    
+    def siguientes_libres(self, doctor, fecha, n=5, duracion=None, desde=None, ignorar=None):
+        """Primeros n horarios libres (en minutos) del día para ese doctor"""
+        clave = (doctor or "", fecha)
+        intervalos = self.dias.get(clave, [])
+        duracion = duracion or self.duracion
+        actual = max(self.apertura, desde or 0)
+        
+        # Lo que empezó antes puede seguir ocupando el horario (aunque no sea el último)
+        i = bisect.bisect_left(intervalos, (actual,))
+        actual = max([actual] + [fin for _, fin, _ in self.anteriores(clave, i, actual, ignorar)])
+        
+        libres = []
+        while len(libres) < n and actual + duracion <= self.cierre:
+            if i < len(intervalos) and intervalos[i][2] == ignorar:
+                i += 1
+                continue
+            siguiente = intervalos[i][0] if i < len(intervalos) else self.cierre
+            if actual + duracion <= siguiente:
+                libres.append(actual)
+                actual += duracion
+            else:
+                actual = max(actual, intervalos[i][1])
+                i += 1
+        return libres
+
+
+def tramos_hora(inicio, duracion):
+    """Minutos que ocupa un intervalo en cada hora del día: [(hora, minutos), ...]"""
+    tramos = []
+    fin = inicio + duracion
+    while inicio < fin:
+        hora = inicio // 60
+        corte = min(fin, (hora + 1) * 60)
+        tramos.append((hora, corte - inicio))
+        inicio = corte
+    return tramos
+
+
+class EstadisticasCitas:
+    """Agregados por día y doctor: citas por estado y minutos ocupados por hora.
+    
+    Se arman una vez al cargar (con value_counts/groupby) y después cada
+    operación suma o resta una sola cita, así los tableros se leen de estos
+    contadores sin recorrer las citas.
+    
+        dias[fecha][doctor] = {"estados": Counter, "horas": Counter}
+    """
+    
+    def __init__(self, horario=HORARIO_ATENCION):
+        self.apertura, self.cierre = horario
+        self.dias = {}
+    
+    def resumen(self, fecha, doctor):
+        """Contadores de un doctor en un día (se crean si no existen)"""
+        doctores = self.dias.setdefault(fecha, {})
+        if doctor not in doctores:
+            doctores[doctor] = {"estados": collections.Counter(), "horas": collections.Counter()}
+        return doctores[doctor]
+    
+    def cargar(self, df):
+        """Calcular todos los agregados a partir de un DataFrame de citas"""
+        self.dias = {}
+        if df.empty:
+            return
+        claves = pd.DataFrame({"Fecha": df["Fecha"].astype(str),
+                               "Doctor": df["Doctor"].fillna("").astype(str)})
+        estados = claves.assign(Estado=df["Estado"].fillna("").astype(str)).value_counts()
+        for (fecha, doctor, estado), cantidad in estados.items():
+            self.resumen(fecha, doctor)["estados"][estado] = int(cantidad)
+        
+        # Minutos por hora: cada cita se reparte entre las horas que toca
+        inicio = columna_minutos(df["Hora"])
+        duracion = pd.to_numeric(df["Duracion"], errors="coerce").fillna(DURACION_CITA).to_numpy(dtype=np.int64)
+        validas = inicio >= 0
+        claves, inicio, fin = claves[validas], inicio[validas], (inicio + duracion)[validas]
+        partes = []
+        for salto in range(int((duracion.max(initial=0) + 59) // 60) + 1):
+            hora = inicio // 60 + salto
+            minutos = np.minimum(fin, (hora + 1) * 60) - np.maximum(inicio, hora * 60)
+            usadas = minutos > 0
+            if usadas.any():
+                partes.append(claves[usadas].assign(hora=hora[usadas], minutos=minutos[usadas]))
+        if partes:
+            horas = pd.concat(partes).groupby(["Fecha", "Doctor", "hora"])["minutos"].sum()
+            for (fecha, doctor, hora), minutos in horas.items():
+                self.resumen(fecha, doctor)["horas"][int(hora)] = int(minutos)
+    
+    def agregar(self, cita, signo=1):
+        """Sumar una cita a los agregados (signo -1 para restarla)"""
+        fecha, doctor = str(cita["Fecha"]), cita.get("Doctor") or ""
+        resumen = self.resumen(fecha, doctor)
+        resumen["estados"][cita["Estado"]] += signo
+        inicio = hora_a_minutos(str(cita["Hora"]))
+        if inicio is not None:
+            for hora, minutos in tramos_hora(inicio, int(cita.get("Duracion") or DURACION_CITA)):
+                resumen["horas"][hora] += signo * minutos
+        if signo < 0:
+            # Descartar contadores en cero para que los días vacíos desaparezcan
+            resumen["estados"] = +resumen["estados"]
+            resumen["horas"] = +resumen["horas"]
+            if not resumen["estados"]:
+                del self.dias[fecha][doctor]
+                if not self.dias[fecha]:
+                    del self.dias[fecha]
+    
+    def quitar(self, cita):
+        """Restar una cita de los agregados"""
+        self.agregar(cita, -1)
+    
+    def mover(self, anterior, cita):
+        """Reflejar una cita modificada"""
+        self.quitar(anterior)
+        self.agregar(cita)
+    
+    def dia(self, fecha):
+        """{doctor: resumen} de un día"""
+        return self.dias.get(fecha, {})
+    
+    def dias_doctor(self, doctor, desde="", hasta="9999-99-99"):
+        """{fecha: resumen} de un doctor entre dos fechas YYYY-MM-DD"""
+        return {fecha: doctores[doctor] for fecha, doctores in self.dias.items()
+                if desde <= fecha <= hasta and doctor in doctores}
+    
+    def indicadores(self, resumen, agendas=1):
+        """Totales, tasa de ausencias y ocupación (0 a 1) por hora de un resumen.
+        
+        `agendas` es cuántas agendas (doctor y día) se sumaron en el resumen.
+        """
+        estados = resumen["estados"]
+        atendidas, ausentes = estados["Atendida"], estados["No asistió"]
+        return {
+            "total": sum(estados.values()),
+            "estados": dict(estados),
+            "ausencias": ausentes / (atendidas + ausentes) if atendidas + ausentes else None,
+            "ocupacion": {hora: resumen["horas"][hora] / (60 * agendas)
+                          for hora in range(self.apertura // 60, (self.cierre + 59) // 60)},
+            "ocupacion_dia": sum(resumen["horas"].values()) / ((self.cierre - self.apertura) * agendas),
+        }
+
+
+def juntar_resumenes(resumenes):
+    """Sumar varios resúmenes del mismo día y doctor (vigentes y archivados)"""
+    total = {"estados": collections.Counter(), "horas": collections.Counter()}
+    for resumen in resumenes:
+        total["estados"].update(resumen["estados"])
+        total["horas"].update(resumen["horas"])
+    return total
+
+
+def carpeta_cache():
+    """Carpeta local del usuario para las cachés (nunca la carpeta compartida)"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    carpeta = os.path.join(base, "sistema_medico")
+    os.makedirs(carpeta, mode=0o700, exist_ok=True)
+    return carpeta
+
+
+class CacheLibro:
+    """Copia binaria (pickle) de un libro Excel ya interpretado.
+    
+    Se usa solo si el libro no cambió: se comparan fecha de modificación,
+    tamaño y hash SHA-256 guardados junto a la copia. Leer el pickle es
+    mucho más rápido que volver a interpretar el xlsx con openpyxl.
+    
+    Cargar un pickle puede ejecutar código, así que la copia vive en la
+    carpeta local del usuario y no junto al libro, que suele estar en una
+    carpeta compartida donde otros podrían reemplazarla.
+    """
+    
+    def __init__(self, archivo, carpeta=None):
+        self.archivo = archivo
+        clave = hashlib.sha256(os.path.abspath(archivo).encode("utf-8")).hexdigest()[:32]
+        self.archivo_cache = os.path.join(carpeta or carpeta_cache(), f"{clave}.pkl")
+    
+    def firma(self):
+        """Fecha de modificación, tamaño y hash del libro"""
+        estado = os.stat(self.archivo)
+        sha = hashlib.sha256()
+        with open(self.archivo, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b""):
+                sha.update(bloque)
+        return {"mtime": estado.st_mtime_ns, "tamano": estado.st_size, "sha256": sha.hexdigest()}
+    
+    def leer(self):
+        """Hojas guardadas en la caché, o None si falta o está vencida"""
+        try:
+            with open(self.archivo_cache, 'rb') as f:
+                firma = pickle.load(f)
+                estado = os.stat(self.archivo)
+                if (firma["mtime"], firma["tamano"]) != (estado.st_mtime_ns, estado.st_size):
+                    return None
+                if firma != self.firma():
+                    return None
+                return pickle.load(f)
+        except Exception:
+            # Caché ausente, corrupta o de otra versión: se relee el libro
+            return None
+    
+    def guardar(self, hojas):
+        """Escribir la caché para el contenido actual del libro"""
+        temporal = self.archivo_cache + ".tmp"
+        with open(temporal, 'wb') as f:
+            pickle.dump(self.firma(), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(hojas, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, self.archivo_cache)
+    
+    def leer_excel(self):
+        """Todas las hojas del libro, desde la caché si sigue vigente"""
+        hojas = self.leer()
+        if hojas is None:
+            METRICAS.contar("cache.fallos")
+            with METRICAS.medir("carga.excel"):
+                hojas = pd.read_excel(self.archivo, sheet_name=None)
+            self.guardar(hojas)
+        else:
+            METRICAS.contar("cache.aciertos")
+        return hojas
+
+
+def fecha_pasada(fecha, hoy=None):
+    """Si una fecha YYYY-MM-DD es anterior a hoy"""
+    fecha = str(fecha)
+    return len(fecha) == 10 and fecha[4] == "-" and fecha < (hoy or datetime.now().strftime("%Y-%m-%d"))
+
+
+def mascara_pasadas(df, hoy=None):
+    """Máscara de las citas de días anteriores a hoy (las que se archivan)"""
+    fechas = df["Fecha"].astype(str)
+    hoy = hoy or datetime.now().strftime("%Y-%m-%d")
+    return (fechas.str.match(r"\d{4}-\d{2}-\d{2}$") & (fechas < hoy)).to_numpy(dtype=bool)
+
+
+class ArchivoCitas:
+    """Citas de días pasados repartidas en un libro por mes.
+    
+    Los libros quedan en una carpeta junto al de citas
+    (citas_medicas.archivo/2024-03.xlsx), cada uno con su caché binaria:
+    buscar en un mes del historial no obliga a leer los demás, y el libro de
+    citas vigente solo tiene las de hoy en adelante.
+    """
+    
+    HOJA = "Citas"
+    
+    def __init__(self, archivo):
+        self.carpeta = os.path.splitext(archivo)[0] + ".archivo"
+    
+    def ruta(self, mes):
+        """Libro de un mes (YYYY-MM)"""
+        return os.path.join(self.carpeta, f"{mes}.xlsx")
+    
+    def meses(self):
+        """{mes: marca de modificación} de los meses archivados"""
+        try:
+            nombres = sorted(os.listdir(self.carpeta))
+        except FileNotFoundError:
+            return {}
+        return {nombre[:7]: os.stat(os.path.join(self.carpeta, nombre)).st_mtime_ns
+                for nombre in nombres if len(nombre) == 12 and nombre.endswith(".xlsx")}
+    
+    def leer(self, mes):
+        """Citas archivadas de un mes"""
+        hojas = CacheLibro(self.ruta(mes)).leer_excel()
+        return normalizar_citas(hojas.get(self.HOJA, next(iter(hojas.values()))))[0]
+    
+    def agregar(self, df):
+        """Sumar citas al libro de su mes; solo se reescriben los meses tocados"""
+        os.makedirs(self.carpeta, exist_ok=True)
+        for mes, grupo in df.groupby(df["Fecha"].astype(str).str[:7]):
+            ruta = self.ruta(mes)
+            if os.path.exists(ruta):
+                grupo = pd.concat([self.leer(mes), grupo]).drop_duplicates("ID", keep="last")
+            grupo = grupo.sort_values(["Fecha", "Hora"], kind="stable").reset_index(drop=True)
+            temporal = os.path.join(self.carpeta, f"{mes}.tmp-{os.getpid()}.xlsx")
+            grupo.to_excel(temporal, sheet_name=self.HOJA, index=False)
+            os.replace(temporal, ruta)
+            CacheLibro(ruta).guardar({self.HOJA: grupo})
+
+
+class AlmacenamientoExcel:
+    """Almacenamiento original: reescribe el libro completo en cada cambio.
+    
+    Pensado para una sola estación; para compartir las citas entre varias
+    se usa "diario" o "sqlite". Las citas de días pasados se pasan al
+    archivo mensual al cargar, así el libro solo crece con la agenda vigente.
+    """
+    
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self.cache = CacheLibro(archivo)
+        self.historial = ArchivoCitas(archivo)
+    
+    def inicializar(self):
+        """Crear el libro de citas si no existe"""
+        if not os.path.exists(self.archivo):
+            self.exportar(pd.DataFrame(columns=COLUMNAS_CITAS))
+    
+    def cargar(self):
+        """Leer las citas de hoy en adelante (las pasadas se archivan)"""
+        df, migrado = normalizar_citas(next(iter(self.cache.leer_excel().values())))
+        pasadas = mascara_pasadas(df)
+        if pasadas.any():
+            self.historial.agregar(df[pasadas])
+            df = df[~pasadas].reset_index(drop=True)
+            migrado = True
+        if migrado:
+            self.exportar(df)
+        return RegistroCitas(df)
+    
+    def registrar(self, registro, operacion, **datos):
+        """Persistir una operación ya aplicada sobre el registro.
+        
+        Devuelve {ID: cita o None} con el estado vigente de las citas que
+        cambiaron desde otras estaciones; aquí nunca hay otras.
+        """
+        self.exportar(registro.df)
+        return {}
+    
+    def cambios_remotos(self):
+        """Citas cambiadas por otras estaciones ({ID: cita o None}, o None para recargar)"""
+        return {}
+    
+    def exportar(self, df, destino=None):
+        """Escribir las citas en un libro Excel"""
+        df.to_excel(destino or self.archivo, index=False)
+    
+    def meses_archivados(self):
+        """{mes: marca} de los meses con citas archivadas (la marca cambia si el mes cambia)"""
+        return self.historial.meses()
+    
+    def leer_archivo(self, mes):
+        """Citas archivadas de un mes (YYYY-MM)"""
+        return self.historial.leer(mes)
+    
+    def clave_coalescencia(self, operacion):
+        """Clave para fusionar guardados seguidos, o None si cada uno cuenta.
+        
+        Reescribir el libro completo solo necesita el estado más reciente,
+        así que varios guardados pendientes se reducen a uno.
+        """
+        return "reescribir_libro"
+    
+    def sincronizar(self):
+        """Forzar a disco las escrituras pendientes"""
+        pass
+    
+    def cerrar(self):
+        """Liberar recursos del almacenamiento"""
+        pass
+
+
+class AlmacenamientoDiario(AlmacenamientoExcel):
+    """Libro Excel como instantánea más un diario de operaciones solo-anexar.
+    
+    Cada cambio agrega una línea JSON al diario, por lo que el costo de guardar
+    no depende del tamaño de la tabla. Cuando el diario crece, la instantánea
+    se reescribe (compacta) en un hilo aparte.
+    
+    Varias estaciones pueden compartir los archivos: el diario se escribe bajo
+    un bloqueo entre procesos y, antes de anexar, cada estación lee lo que
+    las demás agregaron. Así la versión de cada cita está al día al validar
+    la operación y los cambios ajenos llegan a la interfaz de a una cita.
+    
+    La compactación además pasa las citas de días anteriores al archivo
+    mensual, así la instantánea y la carga solo cubren la agenda vigente.
+    """
+    
+    HOJA_CITAS = "Citas"
+    HOJA_DIARIO = "_diario"
+    
+    def clave_coalescencia(self, operacion):
+        """Cada operación del diario se conserva"""
+        return None
+    
+    def __init__(self, archivo, umbral_compactacion=500):
+        super().__init__(archivo)
+        base, extension = os.path.splitext(archivo)
+        self.archivo_diario = base + ".diario"
+        self.archivo_rotado = base + ".diario.compactando"
+        self.archivo_temporal = f"{base}.compactando-{os.getpid()}{extension}"
+        self.bloqueo = BloqueoArchivo(base + ".lock")
+        self.bloqueo_compactacion = BloqueoArchivo(base + ".compactacion.lock")
+        self.umbral_compactacion = umbral_compactacion
+        # Estado vigente según el diario; comparte las citas con la interfaz.
+        # La agenda del estado sirve para rechazar horarios ocupados por otra estación
+        self.estado = RegistroCitas()
+        self.agenda = AgendaCitas()
+        self.secuencia = 0
+        self.registros_pendientes = 0
+        # Hasta dónde se leyó el diario (posición en bytes e inodo del archivo)
+        self.posicion = 0
+        self.inodo = None
+        self.recarga_pendiente = False
+        self.fsync_pendiente = False
+        self.lock = threading.RLock()
+        self.hilo_compactacion = None
+    
+    def inicializar(self):
+        """Crear instantánea vacía si no existe"""
+        with self.lock, self.bloqueo:
+            if not os.path.exists(self.archivo):
+                self.reemplazar_instantanea(pd.DataFrame(columns=COLUMNAS_CITAS), 0)
+    
+    def cargar(self):
+        """Leer la instantánea, reproducir el diario y devolver las citas"""
+        self.esperar_compactacion()
+        with self.lock, self.bloqueo:
+            self.cargar_estado()
+            self.recarga_pendiente = False
+            registro = self.estado.copia()
+        
+        # Las citas pasadas que sigan en la instantánea se archivan en segundo
+        # plano; la interfaz ya trabaja sin ellas
+        hoy = datetime.now().strftime("%Y-%m-%d")
+        pasadas = [id_cita for id_cita, cita in registro.citas.items() if fecha_pasada(cita["Fecha"], hoy)]
+        if pasadas:
+            for id_cita in pasadas:
+                del registro.citas[id_cita]
+            registro.invalidar()
+            self.compactar()
+        return registro
+    
+    def cargar_estado(self):
+        """Reconstruir el estado desde cero (con el bloqueo tomado)"""
+        hojas = dict(self.cache.leer_excel())
+        meta = hojas.pop(self.HOJA_DIARIO, None)
+        df = hojas.get(self.HOJA_CITAS, next(iter(hojas.values())))
+        secuencia_instantanea = int(meta["secuencia"].iloc[0]) if meta is not None and len(meta) else 0
+        
+        df, migrado = normalizar_citas(df)
+        if migrado:
+            # Persistir los ID asignados antes de que el diario los referencie
+            self.reemplazar_instantanea(df, secuencia_instantanea)
+        
+        self.estado = RegistroCitas(df)
+        self.agenda.cargar(self.estado.citas.values())
+        self.secuencia = secuencia_instantanea
+        self.registros_pendientes = 0
+        for entrada in self.leer_diario(self.archivo_rotado)[0]:
+            self.aplicar_entrada(entrada)
+        self.inodo = self.inodo_diario()
+        entradas, self.posicion = self.leer_diario(self.archivo_diario)
+        for entrada in entradas:
+            self.aplicar_entrada(entrada)
+    
+    def inodo_diario(self):
+        """Identificador del archivo de diario actual (se crea si falta)"""
+        try:
+            return os.stat(self.archivo_diario).st_ino
+        except FileNotFoundError:
+            open(self.archivo_diario, 'ab').close()
+            return os.stat(self.archivo_diario).st_ino
+    
+    def leer_diario(self, archivo, posicion=0):
+        """Registros completos de un diario desde una posición, y la posición final"""
+        try:
+            with open(archivo, 'rb') as f:
+                f.seek(posicion)
+                contenido = f.read()
+        except FileNotFoundError:
+            return [], posicion
+        entradas = []
+        for linea in contenido.splitlines(keepends=True):
+            if not linea.endswith(b"\n"):
+                # Línea a medio escribir: se vuelve a leer la próxima vez
+                break
+            posicion += len(linea)
+            try:
+                entradas.append(json.loads(linea))
+            except ValueError:
+                # Resto de una línea cortada por un cierre abrupto
+                pass
+        return entradas, posicion
+    
+    def aplicar_entrada(self, entrada):
+        """Aplicar al estado un registro del diario; devuelve los ID afectados"""
+        if entrada["seq"] <= self.secuencia:
+            return []
+        self.secuencia = entrada["seq"]
+        aplicar_operacion(self.estado, entrada["op"], entrada["datos"])
+        ids = ids_operacion(entrada["op"], entrada["datos"])
+        for id_cita in ids:
+            cita = self.estado.citas.get(id_cita)
+            if cita is None:
+                self.agenda.quitar(id_cita)
+            else:
+                self.agenda.mover(cita)
+        # Una importación cuenta por todas sus citas para decidir la compactación
+        self.registros_pendientes += len(ids)
+        return ids
+    
+    def leer_nuevas(self):
+        """Aplicar lo que otras estaciones anexaron desde la última lectura.
+        
+        Devuelve {ID: cita vigente o None} de las citas afectadas. Si otra
+        estación compactó el diario antes de que se leyera, se recarga todo
+        y se marca la recarga pendiente para avisar a la interfaz.
+        """
+        inodo = self.inodo_diario()
+        entradas = []
+        if inodo != self.inodo:
+            # Otra estación rotó el diario: terminar de leer el archivo rotado
+            try:
+                rotado = os.stat(self.archivo_rotado).st_ino
+            except FileNotFoundError:
+                rotado = None
+            if rotado != self.inodo:
+                self.cargar_estado()
+                self.recarga_pendiente = True
+                return {}
+            entradas, _ = self.leer_diario(self.archivo_rotado, self.posicion)
+            self.registros_pendientes = 0
+            self.inodo, self.posicion = inodo, 0
+        nuevas, self.posicion = self.leer_diario(self.archivo_diario, self.posicion)
+        ids = set()
+        for entrada in entradas + nuevas:
+            ids.update(self.aplicar_entrada(entrada))
+        return {id_cita: self.estado.citas.get(id_cita) for id_cita in ids}
+    
+    def tomar_cambios(self, cambios):
+        """Cambios a entregar a la interfaz, o None si debe recargar todo"""
+        if self.recarga_pendiente:
+            self.recarga_pendiente = False
+            return None
+        return cambios
+    
+    def cambios_remotos(self):
+        """Citas cambiadas por otras estaciones ({ID: cita o None}, o None para recargar)"""
+        with self.lock:
+            try:
+                estado = os.stat(self.archivo_diario)
+                if estado.st_ino == self.inodo and estado.st_size == self.posicion:
+                    return self.tomar_cambios({})
+            except FileNotFoundError:
+                pass
+            with self.bloqueo:
+                return self.tomar_cambios(self.leer_nuevas())
+    
+    def registrar(self, registro, operacion, **datos):
+        """Validar la operación contra el diario compartido y anexarla.
+        
+        Devuelve el estado vigente de las citas que cambiaron (las de otras
+        estaciones y la propia) o lanza ConflictoCita.
+        """
+        ids = ids_operacion(operacion, datos)
+        with self.lock, self.bloqueo:
+            cambios = self.leer_nuevas()
+            actual = self.estado.citas.get(ids[0])
+            try:
+                datos = validar_operacion(actual, operacion, datos)
+                if datos is not None:
+                    verificar_choques(self.agenda, citas_a_ubicar(operacion, datos, actual),
+                                      self.estado.citas.get)
+            except ConflictoCita as error:
+                cambios.update((id_cita, self.estado.citas.get(id_cita)) for id_cita in ids)
+                error.cambios = self.tomar_cambios(cambios)
+                raise
+            if datos is not None:
+                self.anexar(operacion, datos)
+            cambios.update((id_cita, self.estado.citas.get(id_cita)) for id_cita in ids)
+            cambios = self.tomar_cambios(cambios)
+        
+        if self.registros_pendientes >= self.umbral_compactacion:
+            self.compactar()
+        return cambios
+    
+    def anexar(self, operacion, datos):
+        """Escribir un registro al final del diario y aplicarlo al estado"""
+        entrada = {"seq": self.secuencia + 1, "op": operacion, "datos": datos,
+                   "ts": datetime.now().isoformat(timespec="seconds")}
+        linea = (json.dumps(entrada, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with open(self.archivo_diario, 'ab') as diario:
+            if diario.tell() > self.posicion:
+                # Cerrar la línea incompleta que dejó un cierre abrupto
+                linea = b"\n" + linea
+            diario.write(linea)
+            self.posicion = diario.tell()
+        self.aplicar_entrada(entrada)
+        self.fsync_pendiente = True
+    
+    def sincronizar(self):
+        """Forzar a disco lo escrito en el diario (una vez por tanda de cambios)"""
+        with self.lock:
+            if self.fsync_pendiente:
+                with open(self.archivo_diario, 'ab') as diario:
+                    os.fsync(diario.fileno())
+                self.fsync_pendiente = False
+    
+    def compactar(self, esperar=False):
+        """Reescribir la instantánea en segundo plano y vaciar el diario"""
+        if self.hilo_compactacion is None or not self.hilo_compactacion.is_alive():
+            self.hilo_compactacion = threading.Thread(
+                target=self.ejecutar_compactacion, name="compactacion-citas")
+            self.hilo_compactacion.start()
+        if esperar:
+            self.hilo_compactacion.join()
+    
+    @medido("diario.compactacion")
+    def ejecutar_compactacion(self):
+        """Rotar el diario, escribir la instantánea nueva y descartar lo ya incluido"""
+        # Solo una estación compacta a la vez; las demás siguen anexando
+        if not self.bloqueo_compactacion.adquirir(esperar=False):
+            return
+        try:
+            with self.lock, self.bloqueo:
+                self.leer_nuevas()
+                self.rotar_diario()
+                secuencia = self.secuencia
+                # Las citas no se modifican después de creadas
+                citas = list(self.estado.citas.values())
+            
+            df = pd.DataFrame(citas, columns=COLUMNAS_CITAS)
+            pasadas = mascara_pasadas(df)
+            if pasadas.any():
+                # Primero el archivo: si se corta aquí, la instantánea vieja aún las tiene
+                self.historial.agregar(df[pasadas])
+                df = df[~pasadas].reset_index(drop=True)
+            self.escribir_instantanea(df, secuencia, self.archivo_temporal)
+            with self.lock, self.bloqueo:
+                os.replace(self.archivo_temporal, self.archivo)
+                if os.path.exists(self.archivo_rotado):
+                    os.remove(self.archivo_rotado)
+                # Las archivadas salen del estado, salvo que alguien las haya cambiado
+                for posicion in np.flatnonzero(pasadas):
+                    cita = citas[posicion]
+                    if self.estado.citas.get(cita["ID"]) is cita:
+                        self.estado.eliminar(cita["ID"])
+                        self.agenda.quitar(cita["ID"])
+            self.guardar_cache(df, secuencia)
+        finally:
+            self.bloqueo_compactacion.liberar()
+    
+    def rotar_diario(self):
+        """Pasar el diario a un archivo aparte; lo nuevo va a uno limpio"""
+        if os.path.exists(self.archivo_rotado):
+            # Resto de una compactación interrumpida: se le suma el diario actual
+            with open(self.archivo_diario, 'rb') as origen, \
+                    open(self.archivo_rotado, 'ab') as destino:
+                destino.write(origen.read())
+            os.remove(self.archivo_diario)
+        else:
+            os.replace(self.archivo_diario, self.archivo_rotado)
+        self.inodo = self.inodo_diario()
+        self.posicion = 0
+        self.registros_pendientes = 0
+    
+    def reemplazar_instantanea(self, df, secuencia):
+        """Escribir la instantánea de forma atómica y actualizar la caché"""
+        self.escribir_instantanea(df, secuencia, self.archivo_temporal)
+        os.replace(self.archivo_temporal, self.archivo)
+        self.guardar_cache(df, secuencia)
+    
+    def guardar_cache(self, df, secuencia):
+        """Dejar lista la caché para que el próximo inicio no relea el xlsx"""
+        self.cache.guardar({self.HOJA_CITAS: df,
+                            self.HOJA_DIARIO: pd.DataFrame({"secuencia": [secuencia]})})
+    
+    def escribir_instantanea(self, df, secuencia, destino):
+        """Escribir libro con las citas y la secuencia del diario que incluye"""
+        with pd.ExcelWriter(destino, engine="openpyxl") as writer:
+            df.to_excel(writer, sheet_name=self.HOJA_CITAS, index=False)
+            pd.DataFrame({"secuencia": [secuencia]}).to_excel(
+                writer, sheet_name=self.HOJA_DIARIO, index=False)
+    
+    def esperar_compactacion(self):
+        """Bloquear hasta que termine una compactación en curso"""
+        if self.hilo_compactacion is not None:
+            self.hilo_compactacion.join()
+    
+    def meses_archivados(self):
+        """{mes: marca} de los meses archivados, después de la compactación en curso.
+        
+        Al cargar, las citas pasadas salen del registro enseguida pero llegan
+        al archivo recién cuando termina la compactación; sin esperarla, un
+        historial o una exportación podrían no verlas en ningún lado.
+        """
+        self.esperar_compactacion()
+        return super().meses_archivados()
+    
+    def cerrar(self):
+        """Esperar compactación pendiente y forzar el diario a disco"""
+        self.esperar_compactacion()
+        self.sincronizar()
+
+
+class AlmacenamientoSQLite(AlmacenamientoExcel):
+    """Citas en una base SQLite compartida, con índices y modo WAL.
+    
+    Varias estaciones pueden abrir el mismo archivo .db; cada operación es
+    una sentencia indexada, sin reescribir la tabla. El libro Excel solo se
+    usa para la migración inicial y como destino de exportación.
+    
+    Unos triggers anotan en la tabla `cambios` el ID de cada cita tocada, así
+    cada estación lee solo lo que cambió desde su última consulta.
+    
+    Al cargar, las citas de días pasados se mueven a `citas_archivo`
+    (indexada por fecha, se lee de a un mes) y `meses_archivo` anota qué
+    meses cambiaron; la tabla `citas` queda con la agenda vigente.
+    """
+    
+    # Cambios que se conservan para estaciones que tardan en consultar
+    CAMBIOS_CONSERVADOS = 50000
+    # Cada cuántos cambios (de esta estación en adelante) se depura la tabla
+    CAMBIOS_ENTRE_PODAS = 1000
+    
+    def __init__(self, archivo, archivo_db=None):
+        super().__init__(archivo)
+        self.archivo_db = archivo_db or os.path.splitext(archivo)[0] + ".db"
+        self.conexion = None
+        self.ultimo_cambio = 0
+        self.ultimo_podado = 0
+        self.version_datos = None
+    
+    def conectar(self):
+        """Abrir la conexión y crear el esquema si hace falta"""
+        if self.conexion is None:
+            self.conexion = sqlite3.connect(self.archivo_db, timeout=10)
+            self.conexion.execute("PRAGMA journal_mode=WAL")
+            self.conexion.execute("PRAGMA synchronous=NORMAL")
+            self.conexion.executescript("""
+                CREATE TABLE IF NOT EXISTS citas (
+                    ID TEXT NOT NULL UNIQUE,
+                    Paciente TEXT NOT NULL,
+                    Doctor TEXT,
+                    Fecha TEXT NOT NULL,
+                    Hora TEXT NOT NULL,
+                    Duracion INTEGER,
+                    Motivo TEXT,
+                    Estado TEXT,
+                    Version INTEGER NOT NULL DEFAULT 1
+                );
+            """)
+            self.migrar_columnas()
+            self.conexion.executescript("""
+                CREATE INDEX IF NOT EXISTS idx_citas_fecha_hora ON citas (Fecha, Hora);
+                CREATE INDEX IF NOT EXISTS idx_citas_doctor_fecha ON citas (Doctor, Fecha);
+                CREATE INDEX IF NOT EXISTS idx_citas_paciente ON citas (Paciente);
+                CREATE INDEX IF NOT EXISTS idx_citas_estado ON citas (Estado);
+                
+                CREATE TABLE IF NOT EXISTS cambios (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ID TEXT NOT NULL
+                );
+                CREATE TRIGGER IF NOT EXISTS citas_insertada AFTER INSERT ON citas
+                BEGIN INSERT INTO cambios (ID) VALUES (NEW.ID); END;
+                CREATE TRIGGER IF NOT EXISTS citas_modificada AFTER UPDATE ON citas
+                BEGIN INSERT INTO cambios (ID) VALUES (NEW.ID); END;
+                CREATE TRIGGER IF NOT EXISTS citas_eliminada AFTER DELETE ON citas
+                BEGIN INSERT INTO cambios (ID) VALUES (OLD.ID); END;
+                
+                CREATE TABLE IF NOT EXISTS citas_archivo (
+                    ID TEXT PRIMARY KEY,
+                    Paciente TEXT,
+                    Doctor TEXT,
+                    Fecha TEXT,
+                    Hora TEXT,
+                    Duracion INTEGER,
+                    Motivo TEXT,
+                    Estado TEXT,
+                    Version INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_archivo_fecha ON citas_archivo (Fecha, Hora);
+                CREATE TABLE IF NOT EXISTS meses_archivo (
+                    mes TEXT PRIMARY KEY,
+                    marca INTEGER NOT NULL
+                );
+            """)
+        return self.conexion
+    
+    def migrar_columnas(self):
+        """Agregar a la tabla las columnas de citas que aún no tenga"""
+        existentes = {fila[1] for fila in self.conexion.execute("PRAGMA table_info(citas)")}
+        with self.conexion:
+            for columna in COLUMNAS_CITAS:
+                if columna not in existentes:
+                    self.conexion.execute(f"ALTER TABLE citas ADD COLUMN {columna}")
+            if "Version" not in existentes:
+                self.conexion.execute("UPDATE citas SET Version = 1")
+    
+    def inicializar(self):
+        """Crear la base y migrar el libro Excel existente una sola vez"""
+        nueva = not os.path.exists(self.archivo_db)
+        conexion = self.conectar()
+        if nueva and os.path.exists(self.archivo):
+            df, _ = normalizar_citas(pd.read_excel(self.archivo))
+            filas = [tuple(self.valor_sql(v) for v in fila) for fila in df.itertuples(index=False)]
+            with conexion:
+                conexion.executemany(self.sql_insertar(), filas)
+                # La carga inicial no es un cambio que otras estaciones deban leer
+                conexion.execute("DELETE FROM cambios")
+    
+    def sql_insertar(self):
+        """Sentencia INSERT con todas las columnas de citas"""
+        marcadores = ", ".join("?" for _ in COLUMNAS_CITAS)
+        return f"INSERT INTO citas ({', '.join(COLUMNAS_CITAS)}) VALUES ({marcadores})"
+    
+    def cargar(self):
+        """Leer las citas de hoy en adelante por el índice de fecha (las pasadas se archivan antes)"""
+        conexion = self.conectar()
+        self.archivar(conexion)
+        # Primero la marca de cambios: lo que llegue durante la lectura se relee después
+        self.version_datos = conexion.execute("PRAGMA data_version").fetchone()[0]
+        self.ultimo_cambio = self.maximo_cambio(conexion)
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLUMNAS_CITAS)} FROM citas INDEXED BY idx_citas_fecha_hora "
+            f"WHERE Fecha >= ? ORDER BY Fecha, Hora",
+            conexion, params=(datetime.now().strftime("%Y-%m-%d"),))
+        horas_originales = df["Hora"].astype(object)
+        df, migrado = normalizar_citas(df)
+        if migrado:
+            cambiadas = df[df["Hora"] != horas_originales]
+            with conexion:
+                conexion.executemany("UPDATE citas SET Hora = ? WHERE ID = ?",
+                                     cambiadas[["Hora", "ID"]].itertuples(index=False))
+        return RegistroCitas(df)
+    
+    def archivar(self, conexion):
+        """Mover a citas_archivo las citas de días anteriores a hoy"""
+        hoy = datetime.now().strftime("%Y-%m-%d")
+        condicion = "Fecha < ? AND Fecha GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+        columnas = ", ".join(COLUMNAS_CITAS)
+        with conexion:
+            conexion.execute("BEGIN IMMEDIATE")
+            if conexion.execute(f"SELECT 1 FROM citas WHERE {condicion} LIMIT 1", (hoy,)).fetchone() is None:
+                return
+            conexion.execute(f"INSERT INTO meses_archivo (mes, marca) "
+                             f"SELECT DISTINCT substr(Fecha, 1, 7), 1 FROM citas WHERE {condicion} "
+                             f"ON CONFLICT (mes) DO UPDATE SET marca = marca + 1", (hoy,))
+            conexion.execute(f"INSERT OR REPLACE INTO citas_archivo ({columnas}) "
+                             f"SELECT {columnas} FROM citas WHERE {condicion}", (hoy,))
+            conexion.execute(f"DELETE FROM citas WHERE {condicion}", (hoy,))
+    
+    def meses_archivados(self):
+        """{mes: marca} de los meses con citas archivadas"""
+        return dict(self.conectar().execute("SELECT mes, marca FROM meses_archivo ORDER BY mes"))
+    
+    def leer_archivo(self, mes):
+        """Citas archivadas de un mes (YYYY-MM), por el índice de fecha"""
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLUMNAS_CITAS)} FROM citas_archivo "
+            f"WHERE Fecha >= ? AND Fecha < ? ORDER BY Fecha, Hora",
+            self.conectar(), params=(f"{mes}-01", f"{mes}-99"))
+        return normalizar_citas(df)[0]
+    
+    def maximo_cambio(self, conexion):
+        """Número del último cambio anotado"""
+        return conexion.execute("SELECT COALESCE(MAX(seq), 0) FROM cambios").fetchone()[0]
+    
+    def leer_citas(self, conexion, ids):
+        """Citas vigentes con esos ID ({ID: cita o None si ya no existe})"""
+        ids = list(ids)
+        citas = dict.fromkeys(ids)
+        for inicio in range(0, len(ids), 500):
+            lote = ids[inicio:inicio + 500]
+            filas = conexion.execute(
+                f"SELECT {', '.join(COLUMNAS_CITAS)} FROM citas "
+                f"WHERE ID IN ({', '.join('?' for _ in lote)})", lote)
+            for fila in filas:
+                cita = dict(zip(COLUMNAS_CITAS, fila))
+                cita["Doctor"] = cita["Doctor"] or ""
+                cita["Duracion"] = int(cita["Duracion"] or DURACION_CITA)
+                citas[cita["ID"]] = cita
+        return citas
+    
+    def leer_cambios(self, conexion):
+        """Citas tocadas por otras estaciones desde la última lectura, o None para recargar"""
+        minimo = conexion.execute("SELECT MIN(seq) FROM cambios").fetchone()[0]
+        if minimo is not None and minimo > self.ultimo_cambio + 1:
+            # Se depuraron cambios que esta estación no llegó a leer
+            self.ultimo_cambio = self.maximo_cambio(conexion)
+            return None
+        filas = conexion.execute("SELECT seq, ID FROM cambios WHERE seq > ? ORDER BY seq",
+                                 (self.ultimo_cambio,)).fetchall()
+        if not filas:
+            return {}
+        self.ultimo_cambio = filas[-1][0]
+        return self.leer_citas(conexion, {id_cita for _, id_cita in filas})
+    
+    def cambios_remotos(self):
+        """Citas cambiadas por otras estaciones ({ID: cita o None}, o None para recargar)"""
+        conexion = self.conectar()
+        # data_version solo cambia cuando otra conexión confirma una transacción
+        version = conexion.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.version_datos:
+            return {}
+        self.version_datos = version
+        with conexion:
+            return self.leer_cambios(conexion)
+    
+    def valor_sql(self, valor):
+        """Convertir un valor de pandas a un tipo que acepte sqlite3"""
+        if valor is None or pd.isna(valor):
+            return None
+        if isinstance(valor, (int, float)):
+            return int(valor) if float(valor).is_integer() else float(valor)
+        return str(valor)
+    
+    def clave_coalescencia(self, operacion):
+        """Cada sentencia se aplica por separado"""
+        return None
+    
+    def registrar(self, registro, operacion, **datos):
+        """Validar y aplicar la operación en una transacción exclusiva.
+        
+        La transacción primero lee los cambios ajenos y la versión vigente
+        de la cita; devuelve el estado de las citas que cambiaron o lanza
+        ConflictoCita.
+        """
+        conexion = self.conectar()
+        ids = ids_operacion(operacion, datos)
+        with conexion:
+            conexion.execute("BEGIN IMMEDIATE")
+            cambios = self.leer_cambios(conexion)
+            actual = None if operacion == "importar" else self.leer_citas(conexion, ids)[ids[0]]
+            try:
+                datos = validar_operacion(actual, operacion, datos)
+                if datos is not None:
+                    citas = citas_a_ubicar(operacion, datos, actual)
+                    agenda, ocupadas = self.agenda_dias(conexion, citas)
+                    verificar_choques(agenda, citas, ocupadas.get)
+            except ConflictoCita as error:
+                error.cambios = None if cambios is None else {**cambios, **self.leer_citas(conexion, ids)}
+                raise
+            
+            if datos is not None:
+                self.ejecutar_operacion(conexion, operacion, datos)
+            
+            self.ultimo_cambio = self.maximo_cambio(conexion)
+            # Una importación avanza la secuencia de a muchos: se cuenta la distancia, no el múltiplo
+            if self.ultimo_cambio - self.ultimo_podado >= self.CAMBIOS_ENTRE_PODAS:
+                conexion.execute("DELETE FROM cambios WHERE seq <= ?",
+                                 (self.ultimo_cambio - self.CAMBIOS_CONSERVADOS,))
+                self.ultimo_podado = self.ultimo_cambio
+            if cambios is not None:
+                cambios.update(self.leer_citas(conexion, ids))
+        return cambios
+    
+    def agenda_dias(self, conexion, citas):
+        """Agenda con las citas guardadas en los días y doctores de esas citas.
+        
+        Cada día sale del índice por fecha, así que el costo depende de las
+        citas de ese día y no del tamaño de la tabla.
+        """
+        ocupadas = {}
+        for doctor, fecha in {(cita["Doctor"] or "", str(cita["Fecha"])) for cita in citas}:
+            filas = conexion.execute(
+                f"SELECT {', '.join(COLUMNAS_CITAS)} FROM citas WHERE Fecha = ? AND IFNULL(Doctor, '') = ?",
+                (fecha, doctor))
+            ocupadas.update((fila[0], dict(zip(COLUMNAS_CITAS, fila))) for fila in filas)
+        agenda = AgendaCitas()
+        agenda.cargar(ocupadas.values())
+        return agenda, ocupadas
+    
+    def ejecutar_operacion(self, conexion, operacion, datos):
+        """Aplicar la operación como una sola sentencia indexada (o un lote)"""
+        if operacion == "agregar":
+            cita = datos["cita"]
+            conexion.execute(self.sql_insertar(),
+                             [self.valor_sql(cita.get(col)) for col in COLUMNAS_CITAS])
+        elif operacion == "importar":
+            # Las citas importadas ya vienen validadas, con tipos de Python
+            conexion.executemany(self.sql_insertar(),
+                                 map(operator.itemgetter(*COLUMNAS_CITAS), datos["citas"]))
+        elif operacion == "actualizar":
+            cambios = datos["cambios"]
+            asignaciones = ", ".join(f"{col} = ?" for col in cambios)
+            conexion.execute(
+                f"UPDATE citas SET {asignaciones} WHERE ID = ?",
+                [self.valor_sql(v) for v in cambios.values()] + [datos["id"]])
+        elif operacion == "eliminar":
+            conexion.execute("DELETE FROM citas WHERE ID = ?", (datos["id"],))
+    
+    def cerrar(self):
+        """Cerrar la conexión a la base"""
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+
+
+ALMACENAMIENTOS = {
+    "excel": AlmacenamientoExcel,
+    "diario": AlmacenamientoDiario,
+    "sqlite": AlmacenamientoSQLite,
+}
+
+
+class AccesoBloqueado(Exception):
+    """Demasiados intentos fallidos; `segundos` es la espera restante"""
+    
+    def __init__(self, segundos):
+        super().__init__(f"Demasiados intentos fallidos. Espere {segundos} segundos.")
+        self.segundos = segundos
+
+
+class AlmacenUsuarios:
+    """Usuarios del sistema en memoria, con contraseñas derivadas por PBKDF2.
+    
+    usuarios.json se vuelve a leer solo si cambió su fecha de modificación o
+    su tamaño. Cada contraseña guarda su propia sal y número de iteraciones
+    ("pbkdf2_sha256$iteraciones$sal$hash"); los hash SHA-256 sin sal de
+    versiones anteriores se reemplazan la próxima vez que el usuario entra.
+    """
+    
+    ALGORITMO = "pbkdf2_sha256"
+    
+    def __init__(self, archivo, iteraciones=ITERACIONES_PBKDF2):
+        self.archivo = archivo
+        self.iteraciones = iteraciones
+        self.usuarios = {}
+        self.firma = None
+        self.fallos = {}
+        self.lock = threading.Lock()
+        self._relleno = None
+    
+    def inicializar(self, usuarios_default):
+        """Crear el archivo con los usuarios por defecto si no existe"""
+        if not os.path.exists(self.archivo):
+            self.guardar({usuario: {"password": self.hash_password(datos["password"]),
+                                    "nombre": datos["nombre"]}
+                          for usuario, datos in usuarios_default.items()})
+    
+    def leer(self):
+        """Tabla de usuarios, releyendo el archivo solo si cambió"""
+        with self.lock:
+            try:
+                estado = os.stat(self.archivo)
+            except OSError:
+                return {}
+            firma = (estado.st_mtime_ns, estado.st_size)
+            if firma != self.firma:
+                try:
+                    with open(self.archivo, 'r', encoding='utf-8') as f:
+                        self.usuarios = json.load(f)
+                except (OSError, ValueError):
+                    self.usuarios = {}
+                self.firma = firma
+            return self.usuarios
+    
+    def guardar(self, usuarios):
+        """Escribir la tabla de usuarios de forma atómica"""
+        temporal = self.archivo + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(usuarios, f, indent=4, ensure_ascii=False)
+        os.replace(temporal, self.archivo)
+        with self.lock:
+            self.usuarios = usuarios
+            estado = os.stat(self.archivo)
+            self.firma = (estado.st_mtime_ns, estado.st_size)
+    
+    def hash_password(self, password, sal=None, iteraciones=None):
+        """Derivar la contraseña con PBKDF2-SHA256 y una sal aleatoria"""
+        sal = sal or os.urandom(16).hex()
+        iteraciones = iteraciones or self.iteraciones
+        derivada = hashlib.pbkdf2_hmac("sha256", password.encode(), sal.encode(), iteraciones)
+        return f"{self.ALGORITMO}${iteraciones}${sal}${derivada.hex()}"
+    
+    def hash_relleno(self):
+        """Hash contra el que se compara un usuario inexistente, para que tarde lo mismo"""
+        if self._relleno is None:
+            self._relleno = self.hash_password(os.urandom(16).hex())
+        return self._relleno
+    
+    def comprobar(self, password, guardado):
+        """Comparar una contraseña con su hash guardado (nuevo o antiguo)"""
+        if guardado.startswith(self.ALGORITMO + "$"):
+            _, iteraciones, sal, _ = guardado.split("$")
+            calculado = self.hash_password(password, sal, int(iteraciones))
+        else:
+            # Formato antiguo: SHA-256 sin sal
+            calculado = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(calculado, guardado)
+    
+    def necesita_actualizar(self, guardado):
+        """Si el hash es del formato antiguo o usa menos iteraciones que las actuales"""
+        if not guardado.startswith(self.ALGORITMO + "$"):
+            return True
+        return int(guardado.split("$")[1]) < self.iteraciones
+    
+    def verificar(self, usuario, password):
+        """Nombre del usuario si la contraseña es correcta, o None.
+        
+        Lanza AccesoBloqueado si el usuario acumuló demasiados fallos.
+        """
+        self.revisar_bloqueo(usuario)
+        datos = self.leer().get(usuario)
+        correcta = self.comprobar(password, datos["password"] if datos else self.hash_relleno())
+        if not (datos and correcta):
+            self.registrar_fallo(usuario)
+            return None
+        
+        self.fallos.pop(usuario, None)
+        if self.necesita_actualizar(datos["password"]):
+            self.actualizar_password(usuario, password)
+        return datos["nombre"]
+    
+    def actualizar_password(self, usuario, password):
+        """Guardar la contraseña con el hash actual"""
+        usuarios = {**self.leer()}
+        usuarios[usuario] = {**usuarios[usuario], "password": self.hash_password(password)}
+        try:
+            self.guardar(usuarios)
+        except OSError:
+            # Sin permiso de escritura: se reintenta en el próximo inicio de sesión
+            pass
+    
+    def revisar_bloqueo(self, usuario):
+        """Lanzar AccesoBloqueado si el usuario debe esperar"""
+        _, hasta = self.fallos.get(usuario, (0, 0))
+        restante = hasta - time.monotonic()
+        if restante > 0:
+            raise AccesoBloqueado(int(restante) + 1)
+    
+    def registrar_fallo(self, usuario):
+        """Contar un intento fallido; desde el quinto la espera se duplica cada vez"""
+        cantidad, _ = self.fallos.get(usuario, (0, 0))
+        cantidad += 1
+        hasta = 0
+        if cantidad >= MAXIMO_INTENTOS:
+            espera = min(ESPERA_BLOQUEO * 2 ** (cantidad - MAXIMO_INTENTOS), ESPERA_BLOQUEO_MAXIMA)
+            hasta = time.monotonic() + espera
+        self.fallos[usuario] = (cantidad, hasta)
+
+
+# Nombres de columna aceptados al importar, además de los de COLUMNAS_CITAS
+ALIAS_COLUMNAS = {
+    "duración": "Duracion",
+    "duracion (min)": "Duracion",
+    "médico": "Doctor",
+    "medico": "Doctor",
+    "versión": "Version",
+}
+
+
+def leer_lotes(ruta, tamano_lote=TAMANO_LOTE):
+    """Leer un archivo de citas por partes: genera (número de fila, DataFrame).
+    
+    CSV, JSON Lines y Excel se leen sin cargar el archivo entero; un .json
+    con un arreglo se lee completo (json no permite leerlo por partes) y
+    luego se reparte en lotes igual que los demás.
+    """
+    extension = os.path.splitext(ruta)[1].lower()
+    # Fila de la primera cita, como la vería el usuario (la 1 es el encabezado)
+    fila = 2
+    if extension == ".csv":
+        lotes = pd.read_csv(ruta, dtype=str, keep_default_na=False, chunksize=tamano_lote,
+                            encoding="utf-8-sig")
+    elif extension in (".xlsx", ".xlsm"):
+        lotes = leer_lotes_excel(ruta, tamano_lote)
+    elif extension == ".jsonl":
+        lotes = pd.read_json(ruta, lines=True, dtype=False, chunksize=tamano_lote)
+        fila = 1
+    elif extension == ".json":
+        with open(ruta, 'r', encoding='utf-8') as f:
+            citas = json.load(f)
+        lotes = (pd.DataFrame(citas[i:i + tamano_lote]) for i in range(0, len(citas), tamano_lote))
+        fila = 1
+    else:
+        raise ErrorCita(f"Formato no soportado: {extension or ruta}. Use CSV, Excel o JSON.")
+    
+    for lote in lotes:
+        yield fila, lote
+        fila += len(lote)
+
+
+def leer_lotes_excel(ruta, tamano_lote):
+    """Filas de la primera hoja de un libro, de a lotes (openpyxl en modo lectura)"""
+    import openpyxl
+    libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = [str(valor) for valor in next(filas, ())]
+        lote = []
+        for valores in filas:
+            lote.append(valores)
+            if len(lote) == tamano_lote:
+                yield pd.DataFrame(lote, columns=encabezado)
+                lote = []
+        if lote:
+            yield pd.DataFrame(lote, columns=encabezado)
+    finally:
+        libro.close()
+
+
+def columna_texto(serie, formato=None):
+    """Columna como texto sin espacios; fechas y horas de Excel con el formato dado"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.strftime(formato or "%Y-%m-%d").fillna("")
+    if serie.dtype == object and formato is not None:
+        # Excel entrega fechas como datetime y horas como time
+        es_fecha = serie.map(lambda valor: hasattr(valor, "strftime"))
+        if es_fecha.any():
+            serie = serie.copy()
+            serie[es_fecha] = serie[es_fecha].map(lambda valor: valor.strftime(formato))
+    return serie.where(serie.notna(), "").astype(str).str.strip()
+
+
+def validar_lote(lote, fila_inicial):
+    """Validar y normalizar un lote de citas importadas con operaciones vectorizadas.
+    
+    Devuelve un DataFrame con las filas válidas (columnas de citas más
+    "_fila") y la lista de errores (fila, mensaje), uno por fila rechazada.
+    """
+    lote = lote.rename(columns=lambda columna: str(columna).strip())
+    lote = lote.rename(columns={columna: ALIAS_COLUMNAS.get(columna.lower(), columna) for columna in lote.columns})
+    lote = lote.rename(columns={columna.lower(): columna for columna in COLUMNAS_CITAS})
+    df = lote.reindex(columns=COLUMNAS_CITAS).reset_index(drop=True)
+    filas = np.arange(fila_inicial, fila_inicial + len(df))
+    
+    paciente = columna_texto(df["Paciente"])
+    fechas = pd.to_datetime(columna_texto(df["Fecha"], "%Y-%m-%d"), format="%Y-%m-%d", errors="coerce")
+    minutos = columna_minutos(columna_texto(df["Hora"], "%H:%M"))
+    duracion = pd.to_numeric(columna_texto(df["Duracion"]).replace("", str(DURACION_CITA)), errors="coerce")
+    estado = columna_texto(df["Estado"]).replace("", "Agendada")
+    
+    # El primer error de cada fila es el que se informa
+    errores = pd.Series("", index=df.index)
+    for mascara, mensaje in (
+            (paciente == "", "Falta el paciente"),
+            (fechas.isna(), "Fecha inválida (use YYYY-MM-DD)"),
+            (minutos < 0, "Hora inválida (use HH:MM o H:MM AM/PM)"),
+            (~(duracion > 0) | (duracion % 1 != 0), "Duración inválida"),
+            (~estado.isin(ESTADOS_CITA), "Estado desconocido")):
+        errores[np.asarray(mascara) & (errores == "").to_numpy()] = mensaje
+    validas = (errores == "").to_numpy()
+    
+    motivo = columna_texto(df["Motivo"]).replace("", "Consulta general")
+    minutos_validos = minutos[validas]
+    resultado = pd.DataFrame({
+        "ID": columna_texto(df["ID"])[validas],
+        "Paciente": paciente[validas],
+        "Doctor": columna_texto(df["Doctor"])[validas],
+        "Fecha": fechas[validas].dt.strftime("%Y-%m-%d"),
+        "Hora": [f"{m // 60:02d}:{m % 60:02d}" for m in minutos_validos],
+        "Duracion": duracion[validas].astype(int),
+        "Motivo": motivo[validas],
+        "Estado": estado[validas],
+        "Version": 1,
+        "_fila": filas[validas],
+    })
+    sin_id = (resultado["ID"] == "").to_numpy()
+    if sin_id.any():
+        # Mismo formato que nuevo_id, con una sola lectura de bytes aleatorios
+        aleatorio = os.urandom(16 * int(sin_id.sum()))
+        resultado.loc[sin_id, "ID"] = [uuid.UUID(bytes=aleatorio[i:i + 16], version=4).hex
+                                       for i in range(0, len(aleatorio), 16)]
+    return resultado, list(zip(filas[~validas].tolist(), errores[~validas].tolist()))
+
+
+def escribir_reporte_errores(ruta, errores):
+    """Guardar los errores de una importación junto al archivo importado"""
+    destino = os.path.splitext(ruta)[0] + ".errores.csv"
+    pd.DataFrame(errores, columns=["Fila", "Error"]).to_csv(destino, index=False, encoding="utf-8-sig")
+    return destino
+
+
+def cita_json(cita):
+    """Cita con los valores vacíos de pandas como None (para JSON)"""
+    return {campo: (None if not isinstance(valor, str) and pd.isna(valor) else valor)
+            for campo, valor in cita.items()}
+
+
+@medido("exportar")
+def exportar_por_partes(citas, destino, tamano_lote=TAMANO_LOTE):
+    """Escribir citas en CSV, JSON, JSON Lines o Excel sin armar una tabla completa.
+    
+    `citas` puede ser cualquier iterable, por ejemplo un generador que lee el
+    historial de a un mes. Solo hay un lote convertido en memoria a la vez.
+    En Excel se usa el modo de solo escritura de openpyxl y, si una hoja se
+    llena, se sigue en otra. El archivo se escribe aparte y reemplaza al
+    destino al terminar. Devuelve cuántas citas se escribieron.
+    """
+    extension = os.path.splitext(destino)[1].lower()
+    temporal = destino + ".tmp"
+    restantes = iter(citas)
+    total = 0
+    
+    def partir():
+        nonlocal total
+        while True:
+            lote = list(itertools.islice(restantes, tamano_lote))
+            if not lote:
+                return
+            total += len(lote)
+            yield lote
+    lotes = partir()
+    
+    if extension == ".csv":
+        with open(temporal, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write(",".join(COLUMNAS_CITAS) + "\n")
+            for lote in lotes:
+                pd.DataFrame(lote, columns=COLUMNAS_CITAS).to_csv(f, index=False, header=False)
+    elif extension in (".json", ".jsonl"):
+        lineas = extension == ".jsonl"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            separador = "" if lineas else "["
+            for lote in lotes:
+                for cita in lote:
+                    texto = json.dumps(cita_json(cita), ensure_ascii=False, default=str)
+                    f.write(texto + "\n" if lineas else separador + "\n" + texto)
+                    separador = ","
+            if not lineas:
+                f.write(("[" if separador == "[" else "") + "\n]\n")
+    elif extension in (".xlsx", ".xlsm"):
+        import openpyxl
+        libro = openpyxl.Workbook(write_only=True)
+        hoja, filas, numero = libro.create_sheet("Citas"), 1, 1
+        hoja.append(COLUMNAS_CITAS)
+        for lote in lotes:
+            for cita in lote:
+                if filas == FILAS_HOJA_EXCEL:
+                    numero += 1
+                    hoja, filas = libro.create_sheet(f"Citas {numero}"), 1
+                    hoja.append(COLUMNAS_CITAS)
+                hoja.append([cita_json(cita).get(columna) for columna in COLUMNAS_CITAS])
+                filas += 1
+        libro.save(temporal)
+    else:
+        raise ErrorCita(f"Formato no soportado: {extension or destino}. Use CSV, Excel o JSON.")
+    os.replace(temporal, destino)
+    return total
+
+
+class IndiceBusqueda:
+    """Columnas precalculadas para filtrar y ordenar citas de forma vectorizada.
+    
+    Texto en minúsculas, fechas como datetime64, horas en minutos y un rango
+    entero por columna para ordenar; cada consulta es una combinación de
+    máscaras de NumPy más un argsort, sin recorrer filas en Python.
+    """
+    
+    def __init__(self, registro):
+        self.registro = registro
+        self.version = registro.version
+        df = registro.df
+        
+        self.ids = df["ID"].to_numpy(dtype=object)
+        self.paciente = df["Paciente"].fillna("").astype(str).str.lower()
+        self.motivo = df["Motivo"].fillna("").astype(str).str.lower()
+        self.estado = df["Estado"].fillna("").astype(str).to_numpy(dtype=object)
+        self.fecha = pd.to_datetime(df["Fecha"], format="%Y-%m-%d", errors="coerce").to_numpy()
+        self.minutos = columna_minutos(df["Hora"])
+        
+        self.rangos = {
+            "Paciente": self.rango(self.paciente),
+            "Doctor": self.rango(df["Doctor"].fillna("").astype(str).str.lower()),
+            "Motivo": self.rango(self.motivo),
+            "Estado": self.rango(df["Estado"].fillna("").astype(str)),
+        }
+    
+    def rango(self, columna):
+        """Posición de cada valor en el orden alfabético (para argsort entero)"""
+        return pd.factorize(columna, sort=True)[0]
+    
+    def vigente(self, registro):
+        """Si el índice corresponde al estado actual del registro"""
+        return self.registro is registro and self.version == registro.version
+    
+    def consultar(self, paciente="", motivo="", estado=None, desde=None, hasta=None,
+                  orden=None, descendente=False):
+        """IDs de las citas que cumplen los filtros, en el orden pedido"""
+        mascara = np.ones(len(self.ids), dtype=bool)
+        if paciente:
+            mascara &= self.paciente.str.contains(paciente.lower(), regex=False).to_numpy()
+        if motivo:
+            mascara &= self.motivo.str.contains(motivo.lower(), regex=False).to_numpy()
+        if estado:
+            mascara &= self.estado == estado
+        if desde is not None:
+            mascara &= self.fecha >= np.datetime64(desde)
+        if hasta is not None:
+            mascara &= self.fecha <= np.datetime64(hasta)
+        posiciones = np.flatnonzero(mascara)
+        
+        if orden == "Fecha":
+            posiciones = posiciones[np.lexsort((self.minutos[posiciones], self.fecha[posiciones]))]
+        elif orden == "Hora":
+            posiciones = posiciones[np.lexsort((self.fecha[posiciones], self.minutos[posiciones]))]
+        elif orden in self.rangos:
+            posiciones = posiciones[np.argsort(self.rangos[orden][posiciones], kind="stable")]
+        if descendente:
+            posiciones = posiciones[::-1]
+        return self.ids[posiciones].tolist()
+
+
+class TrabajadorES:
+    """Hilo dedicado a leer y escribir citas sin bloquear la interfaz.
+    
+    Las tareas se ejecutan en orden desde una cola acotada. Las que comparten
+    clave de coalescencia y aún no empezaron se fusionan (solo corre la más
+    reciente). Los resultados vuelven por otra cola que revisa quien atiende
+    el servicio (la ventana con root.after, o el bucle de la API sin ventana).
+    """
+    
+    def __init__(self, tamano_cola=256, al_vaciar=None):
+        self.cola = queue.Queue(maxsize=tamano_cola)
+        self.resultados = queue.Queue()
+        self.al_vaciar = al_vaciar
+        self.lock = threading.Lock()
+        self.pendientes = {}
+        self.en_curso = 0
+        self.hilo = threading.Thread(target=self.ejecutar, name="es-citas", daemon=True)
+        self.hilo.start()
+    
+    def enviar(self, funcion, al_terminar=None, al_fallar=None, clave=None):
+        """Encolar una tarea; los callbacks se llaman desde procesar_resultados"""
+        with self.lock:
+            tarea = self.pendientes.get(clave) if clave is not None else None
+            if tarea is not None:
+                tarea.update(funcion=funcion, al_terminar=al_terminar, al_fallar=al_fallar)
+                return
+            tarea = {"funcion": funcion, "al_terminar": al_terminar,
+                     "al_fallar": al_fallar, "clave": clave}
+            if clave is not None:
+                self.pendientes[clave] = tarea
+            self.en_curso += 1
+        self.cola.put(tarea)
+    
+    def ejecutar(self):
+        """Bucle del hilo de E/S"""
+        while True:
+            tarea = self.cola.get()
+            if tarea is None:
+                self.cola.task_done()
+                break
+            with self.lock:
+                if tarea["clave"] is not None:
+                    self.pendientes.pop(tarea["clave"], None)
+                funcion = tarea["funcion"]
+                al_terminar, al_fallar = tarea["al_terminar"], tarea["al_fallar"]
+            try:
+                resultado = (al_terminar, funcion())
+            except Exception as error:
+                resultado = (al_fallar, error)
+            # Al terminar una tanda, sincronizar antes de avisar a la interfaz
+            if self.cola.empty() and self.al_vaciar is not None:
+                try:
+                    self.al_vaciar()
+                except Exception as error:
+                    resultado = (al_fallar, error)
+            # El resultado se publica antes de dejar de estar ocupado
+            self.resultados.put(resultado)
+            with self.lock:
+                self.en_curso -= 1
+            self.cola.task_done()
+    
+    def ocupado(self):
+        """Hay tareas pendientes o ejecutándose"""
+        return self.en_curso > 0
+    
+    def procesar_resultados(self):
+        """Ejecutar los callbacks de tareas terminadas (en el hilo que lo llama)"""
+        while True:
+            try:
+                callback, valor = self.resultados.get_nowait()
+            except queue.Empty:
+                return
+            if callback is not None:
+                callback(valor)
+    
+    def esperar(self):
+        """Bloquear hasta que se vacíe la cola y descartar los resultados"""
+        self.cola.join()
+        while not self.resultados.empty():
+            self.resultados.get_nowait()
+    
+    def detener(self):
+        """Terminar el hilo después de las tareas pendientes"""
+        self.cola.put(None)
+        self.hilo.join()
+
+
+class TablaVirtual:
+    """Treeview que solo materializa las filas visibles.
+    
+    La tabla guarda la lista ordenada de claves de las citas y crea items
+    únicamente para la ventana visible; los cambios se aplican fila por fila
+    (insertar, actualizar, eliminar) sin reconstruir toda la tabla.
+    
+    Para ubicar una clave sin recorrer la lista, cada una guarda el número
+    que tenía al entrar y se anotan (ordenados) los números eliminados
+    desde la última carga: la posición actual es el número menos los
+    eliminados antes que ella.
+    """
+    
+    ALTO_ENCABEZADO = 25
+    
+    def __init__(self, padre, columnas, obtener_valores, height=15):
+        self.obtener_valores = obtener_valores
+        self.claves = []
+        self.numeros = {}
+        self.eliminados = []
+        self.siguiente = 0
+        self.inicio = 0
+        self.filas = height
+        
+        self.tree = ttk.Treeview(padre, columns=columnas, show="headings", height=height)
+        self.scrollbar = ttk.Scrollbar(padre, orient="vertical", command=self.desplazar)
+        
+        estilo_alto = ttk.Style().lookup("Treeview", "rowheight")
+        self.alto_fila = int(estilo_alto) if str(estilo_alto).isdigit() else 20
+        
+        self.tree.bind('<Configure>', self.on_configure)
+        self.tree.bind('<MouseWheel>', self.on_rueda)
+        self.tree.bind('<Button-4>', lambda e: self.desplazar("scroll", -1, "units"))
+        self.tree.bind('<Button-5>', lambda e: self.desplazar("scroll", 1, "units"))
+        self.tree.bind('<Up>', lambda e: self.mover_seleccion(-1))
+        self.tree.bind('<Down>', lambda e: self.mover_seleccion(1))
+        self.tree.bind('<Prior>', lambda e: self.mover_seleccion(-self.filas))
+        self.tree.bind('<Next>', lambda e: self.mover_seleccion(self.filas))
+    
+    def cargar(self, claves, conservar_posicion=False):
+        """Reemplazar todas las claves (por defecto vuelve al inicio)"""
+        self.claves = list(claves)
+        self.numeros = {clave: numero for numero, clave in enumerate(self.claves)}
+        self.eliminados = []
+        self.siguiente = len(self.claves)
+        if not conservar_posicion:
+            self.inicio = 0
+        self.refrescar()
+    
+    def refrescar(self):
+        """Sincronizar los items visibles con la ventana actual"""
+        self.inicio = max(0, min(self.inicio, len(self.claves) - self.filas))
+        visibles = self.claves[self.inicio:self.inicio + self.filas]
+        iids = [str(clave) for clave in visibles]
+        
+        sobrantes = set(self.tree.get_children()) - set(iids)
+        if sobrantes:
+            self.tree.delete(*sobrantes)
+        for posicion, (clave, iid) in enumerate(zip(visibles, iids)):
+            if self.tree.exists(iid):
+                self.tree.move(iid, "", posicion)
+            else:
+                self.tree.insert("", posicion, iid=iid, values=self.obtener_valores(clave))
+        
+        self.actualizar_scrollbar()
+    
+    def actualizar_scrollbar(self):
+        """Ajustar la barra al tramo visible"""
+        total = len(self.claves)
+        if total <= self.filas:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.inicio / total, (self.inicio + self.filas) / total)
+    
+    def posicion(self, clave):
+        """Posición de una clave en la lista completa"""
+        numero = self.numeros[clave]
+        return numero - bisect.bisect_left(self.eliminados, numero)
+    
+    def insertar_fila(self, clave):
+        """Agregar una fila al final y mostrarla"""
+        self.claves.append(clave)
+        self.numeros[clave] = self.siguiente
+        self.siguiente += 1
+        self.inicio = len(self.claves) - self.filas
+        self.refrescar()
+    
+    def actualizar_fila(self, clave):
+        """Refrescar los valores de una fila si está visible"""
+        iid = str(clave)
+        if self.tree.exists(iid):
+            self.tree.item(iid, values=self.obtener_valores(clave))
+    
+    def eliminar_fila(self, clave):
+        """Quitar una fila de la tabla"""
+        del self.claves[self.posicion(clave)]
+        bisect.insort(self.eliminados, self.numeros.pop(clave))
+        iid = str(clave)
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+            self.refrescar()
+        else:
+            self.actualizar_scrollbar()
+    
+    def contiene(self, clave):
+        """Si la clave está en la tabla (visible o no)"""
+        return clave in self.numeros
+    
+    def seleccion(self):
+        """Claves de las filas seleccionadas"""
+        visibles = {str(clave): clave for clave in self.claves[self.inicio:self.inicio + self.filas]}
+        return [visibles[iid] for iid in self.tree.selection() if iid in visibles]
+    
+    def desplazar(self, accion, cantidad, unidad=None):
+        """Mover la ventana visible (comando de la barra de desplazamiento)"""
+        if accion == "moveto":
+            self.inicio = int(float(cantidad) * len(self.claves))
+        elif accion == "scroll":
+            paso = self.filas if unidad == "pages" else 1
+            self.inicio += int(cantidad) * paso
+        self.refrescar()
+    
+    def mover_seleccion(self, paso):
+        """Mover la selección con el teclado, desplazando la ventana si se sale de ella"""
+        seleccion = self.seleccion()
+        if not seleccion:
+            self.desplazar("scroll", 1 if paso > 0 else -1, "pages" if abs(paso) > 1 else "units")
+            return "break"
+        posicion = max(0, min(self.posicion(seleccion[0]) + paso, len(self.claves) - 1))
+        if posicion < self.inicio:
+            self.inicio = posicion
+        elif posicion >= self.inicio + self.filas:
+            self.inicio = posicion - self.filas + 1
+        self.refrescar()
+        iid = str(self.claves[posicion])
+        self.tree.selection_set(iid)
+        self.tree.focus(iid)
+        return "break"
+    
+    def on_rueda(self, event):
+        """Desplazar con la rueda del mouse"""
+        self.desplazar("scroll", -1 if event.delta > 0 else 1, "units")
+        return "break"
+    
+    def on_configure(self, event):
+        """Recalcular cuántas filas caben al cambiar el tamaño"""
+        filas = max(1, (event.height - self.ALTO_ENCABEZADO) // self.alto_fila)
+        if filas != self.filas:
+            self.filas = filas
+            self.refrescar()
+
+
+def diferencia_cita(anterior, cita, campos):
+    """Campos que cambiaron (más la versión) antes y después, para la bitácora"""
+    campos = [*campos, "Version"]
+    return {campo: anterior[campo] for campo in campos}, {campo: cita[campo] for campo in campos}
+
+
+def valor_json(valor):
+    """Escalares de NumPy y otros valores para json.dumps"""
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+
+def linea_json(entrada):
+    """Una entrada como línea JSON compacta (bytes, con salto de línea)"""
+    return (json.dumps(entrada, ensure_ascii=False, separators=(",", ":"), default=valor_json) + "\n").encode("utf-8")
+
+
+def anexar_lineas(archivo, lineas):
+    """Anexar líneas a un archivo JSONL abierto con 'a+b'.
+    
+    Si un cierre abrupto dejó la última línea a medias, primero se la
+    termina: así el resto cortado queda en una línea propia (que al leer se
+    salta) y no se pega a la entrada nueva.
+    """
+    if archivo.seek(0, os.SEEK_END) > 0:
+        archivo.seek(-1, os.SEEK_END)
+        if archivo.read(1) != b"\n":
+            lineas = b"\n" + lineas
+    archivo.write(lineas)
+
+
+def leer_lineas_json(ruta, posicion=0, danadas=None):
+    """Entradas de un archivo JSONL desde una posición y la posición final.
+    
+    Se saltan las líneas que no se pueden leer (restos de una escritura
+    interrumpida) y una última línea sin terminar, que puede estar a medio
+    escribir; la próxima lectura la retoma desde la posición devuelta.
+    """
+    entradas = []
+    try:
+        f = open(ruta, "rb")
+    except FileNotFoundError:
+        return entradas, posicion
+    with f:
+        f.seek(posicion)
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break
+            posicion += len(linea)
+            try:
+                entradas.append(json.loads(linea))
+            except ValueError:
+                if danadas:
+                    METRICAS.contar(danadas)
+    return entradas, posicion
+
+
+class BitacoraOperaciones:
+    """Registro de auditoría: una línea JSON por operación, solo se anexa.
+    
+    Cada línea dice quién hizo qué y cuándo, con los campos de la cita antes
+    y después (solo los que cambiaron; la cita completa al crear o eliminar).
+    Con eso se deshacen operaciones sin copiar las citas y, reproduciendo el
+    archivo en orden, se reconstruye el estado (ver reproducir_auditoria).
+    Las estaciones que comparten las citas comparten también la bitácora.
+    
+    La primera línea ("base") guarda las citas vigentes al crear el archivo,
+    para que la reconstrucción no pierda las que ya existían.
+    """
+    
+    def __init__(self, archivo):
+        base = os.path.splitext(archivo)[0]
+        self.ruta = base + ".auditoria.jsonl"
+        self.bloqueo = BloqueoArchivo(base + ".auditoria.lock")
+    
+    def anexar(self, entradas):
+        """Agregar entradas al final del archivo (bajo el bloqueo entre procesos)"""
+        lineas = b"".join(linea_json(entrada) for entrada in entradas)
+        with self.bloqueo, open(self.ruta, "a+b") as f:
+            anexar_lineas(f, lineas)
+    
+    def iniciar(self, citas):
+        """Anotar las citas vigentes como base si la bitácora todavía no existe"""
+        with self.bloqueo, open(self.ruta, "a+b") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                return
+            base = {"op": nuevo_id(), "usuario": "", "momento": datetime.now().isoformat(timespec="seconds"),
+                    "tipo": "base", "columnas": COLUMNAS_CITAS,
+                    "filas": [[cita[columna] for columna in COLUMNAS_CITAS] for cita in citas]}
+            f.write(linea_json(base))
+    
+    def leer(self):
+        """Entradas en orden (se saltan las líneas dañadas por una escritura interrumpida)"""
+        yield from leer_lineas_json(self.ruta, danadas="auditoria.lineas_danadas")[0]
+    
+    def ultimas(self, desde=0, limite=100):
+        """Página de operaciones, de la más reciente a la más antigua"""
+        ultimas = collections.deque((entrada for entrada in self.leer() if entrada["tipo"] != "base"),
+                                    maxlen=desde + limite)
+        return list(reversed(ultimas))[desde:]
+
+
+def reproducir_auditoria(bitacora, registro=None):
+    """Reconstruir las citas aplicando en orden las operaciones de una bitácora.
+    
+    Se parte de la base anotada al crear la bitácora. Una bitácora sin base
+    (anterior a que se anotara) necesita el `registro` con el estado inicial:
+    si no, se lanza ErrorCita en lugar de perder en silencio las citas que ya
+    existían.
+    """
+    entradas = bitacora.leer()
+    primera = next(entradas, None)
+    if primera is not None and primera["tipo"] == "base":
+        registro = RegistroCitas()
+        registro.agregar_varias(dict(zip(primera["columnas"], valores)) for valores in primera["filas"])
+    elif registro is None and primera is not None:
+        raise ErrorCita("La bitácora no guarda las citas que existían cuando empezó; "
+                        "reconstruirla dejaría fuera esas citas.")
+    else:
+        registro = registro if registro is not None else RegistroCitas()
+        entradas = itertools.chain([primera] if primera is not None else [], entradas)
+    
+    for entrada in entradas:
+        if entrada["tipo"] == "importar":
+            columnas = entrada["columnas"]
+            registro.agregar_varias(dict(zip(columnas, valores)) for valores in entrada["filas"])
+            continue
+        id_cita, destino = entrada["id"], entrada["despues"]
+        if destino is None:
+            if id_cita in registro:
+                registro.eliminar(id_cita)
+        elif entrada["antes"] is None:
+            registro.agregar(destino)
+        elif id_cita in registro:
+            registro.actualizar(id_cita, destino)
+    return registro
+
+
+class ErrorCita(ValueError):
+    """Datos de cita que no se pueden aceptar; el mensaje es para el usuario"""
+    
+    titulo = "Error"
+    estado_http = 400
+
+
+class CitaNoEncontrada(ErrorCita):
+    """No hay ninguna cita con ese ID"""
+    
+    titulo = "Atención"
+    estado_http = 404
+
+
+class HorarioOcupado(ErrorCita):
+    """El horario pedido se cruza con otra cita del mismo doctor"""
+    
+    titulo = "Horario ocupado"
+    estado_http = 409
+    
+    def __init__(self, mensaje, ocupada, libres):
+        super().__init__(mensaje)
+        self.ocupada = ocupada
+        self.libres = libres
+
+
+class CitaCambiada(ErrorCita):
+    """La cita cambió después de la operación que se quiere deshacer o rehacer"""
+    
+    titulo = "Atención"
+    estado_http = 409
+
+
+class ServicioCitas:
+    """Operaciones sobre citas, independientes de la interfaz.
+    
+    Cada operación valida, aplica el cambio en memoria (registro y agenda) y
+    encola el guardado en el hilo de E/S. La ventana Tk y la API HTTP son
+    clientes del servicio: lo llaman desde sus propios hilos y se suscriben
+    a sus eventos ("cambios", "guardado", "conflicto", ...) para enterarse de
+    lo que cambió, venga de donde venga.
+    
+    Cada operación queda en la bitácora de auditoría con su usuario (el de
+    la sesión, o el que indique el cliente) una vez guardada, y en la pila
+    de ese usuario para deshacerla aplicando la operación inversa.
+    """
+    
+    def __init__(self, almacenamiento):
+        self.almacenamiento = almacenamiento
+        # Todo acceso al almacenamiento pasa por el hilo de E/S
+        self.trabajador = TrabajadorES(al_vaciar=almacenamiento.sincronizar)
+        self.registro = RegistroCitas()
+        self.agenda = AgendaCitas()
+        self.estadisticas = EstadisticasCitas()
+        self.indice = None
+        # Meses archivados ya leídos ({mes: (marca, DataFrame)}) y el índice
+        # de búsqueda sobre los últimos pedidos; solo los toca el hilo de E/S
+        self.meses_leidos = {}
+        self.indice_historial = None
+        # Agregados de los meses archivados ({mes: (marca, EstadisticasCitas)})
+        self.estadisticas_meses = {}
+        self.cargado = False
+        self.cargando = False
+        self.proxima_vigilancia = 0
+        self.oyentes = []
+        self.lock = threading.RLock()
+        
+        # Bitácora: entradas (secuencia, entrada) que esperan a su guardado y
+        # pilas para deshacer y rehacer de cada usuario. Las pendientes tienen
+        # su propio lock: el hilo de E/S no debe esperar al del servicio
+        self.usuario = None
+        self.auditoria = BitacoraOperaciones(almacenamiento.archivo)
+        self.auditoria_pendiente = []
+        self.lock_auditoria = threading.Lock()
+        self.secuencia_auditoria = 0
+        self.pilas = {}
+    
+    def suscribir(self, oyente):
+        """Registrar oyente(evento, datos); se llama desde el hilo que produce el evento"""
+        self.oyentes.append(oyente)
+    
+    def notificar(self, evento, datos=None):
+        """Avisar un evento a todos los oyentes"""
+        for oyente in list(self.oyentes):
+            oyente(evento, datos)
+    
+    def atender(self):
+        """Procesar resultados del hilo de E/S y buscar cambios de otras estaciones.
+        
+        Lo llama periódicamente quien maneja el servicio (la ventana o la API).
+        """
+        self.trabajador.procesar_resultados()
+        ahora = time.monotonic()
+        if self.cargado and ahora >= self.proxima_vigilancia:
+            self.proxima_vigilancia = ahora + INTERVALO_VIGILANCIA / 1000
+            if not self.trabajador.ocupado():
+                self.trabajador.enviar(self.almacenamiento.cambios_remotos,
+                                       al_terminar=self.aplicar_cambios,
+                                       al_fallar=lambda error: self.notificar("sin_sincronizar", error),
+                                       clave="vigilar_cambios")
+    
+    def cargar(self):
+        """Leer todas las citas en el hilo de E/S"""
+        with self.lock:
+            if self.cargando:
+                return
+            self.cargando = True
+            self.cargado = False
+        self.notificar("cargando")
+        self.trabajador.enviar(self.leer_citas, al_terminar=self.on_cargadas,
+                               al_fallar=self.on_error_carga)
+    
+    @medido("carga.lectura")
+    def leer_citas(self):
+        """Leer citas y armar la agenda y los agregados (corre en el hilo de E/S)"""
+        self.almacenamiento.inicializar()
+        registro = self.almacenamiento.cargar()
+        self.auditoria.iniciar(registro.citas.values())
+        agenda = AgendaCitas()
+        agenda.cargar(registro.citas.values())
+        estadisticas = EstadisticasCitas()
+        estadisticas.cargar(registro.df)
+        return registro, agenda, estadisticas
+    
+    def on_cargadas(self, datos):
+        """Reemplazar las citas en memoria por las recién leídas"""
+        with self.lock:
+            self.registro, self.agenda, self.estadisticas = datos
+            self.cargado = True
+            self.cargando = False
+        self.notificar("cargado")
+    
+    def on_error_carga(self, error):
+        """Avisar que no se pudieron leer las citas"""
+        with self.lock:
+            self.cargando = False
+        self.notificar("error_carga", error)
+    
+    def exigir_carga(self):
+        """Rechazar operaciones mientras las citas no estén en memoria"""
+        if not self.cargado:
+            error = ErrorCita("Las citas todavía se están cargando. Intente de nuevo en unos segundos.")
+            error.estado_http = 503
+            raise error
+    
+    def aplicar_cambios(self, cambios):
+        """Poner al día las citas que cambiaron en el almacenamiento, de a una"""
+        if cambios is None:
+            METRICAS.contar("sincronizacion.recargas")
+            self.cargar()
+            return
+        
+        cambiadas = []
+        with self.lock:
+            for id_cita, cita in cambios.items():
+                if cita is None:
+                    if id_cita not in self.registro:
+                        continue
+                    self.estadisticas.quitar(self.registro.eliminar(id_cita))
+                    self.agenda.quitar(id_cita)
+                elif id_cita in self.registro:
+                    anterior = self.registro.obtener(id_cita)
+                    if anterior == cita:
+                        continue
+                    self.registro.actualizar(id_cita, cita)
+                    self.agenda.mover(cita)
+                    self.estadisticas.mover(anterior, self.registro.obtener(id_cita))
+                else:
+                    self.registro.agregar(cita)
+                    self.agenda.agregar(cita)
+                    self.estadisticas.agregar(cita)
+                cambiadas.append(id_cita)
+        if cambiadas:
+            METRICAS.contar("sincronizacion.citas", len(cambiadas))
+            self.notificar("cambios", cambiadas)
+    
+    def validar_fecha_hora(self, fecha, hora):
+        """Validar fecha y hora; devuelve la hora como HH:MM"""
+        try:
+            datetime.strptime(fecha, "%Y-%m-%d")
+        except ValueError:
+            raise ErrorCita("Formato de fecha incorrecto. Use YYYY-MM-DD")
+        
+        # Acepta tanto 24h como AM/PM; se guarda siempre en 24h
+        minutos = hora_a_minutos(hora)
+        if minutos is None:
+            raise ErrorCita("Formato de hora incorrecto. Use HH:MM o H:MM AM/PM\n"
+                            "Ejemplos: 14:30, 2:30 PM, 4:00 AM")
+        return minutos_a_hora(minutos)
+    
+    def validar_duracion(self, duracion):
+        """Duración en minutos como entero positivo"""
+        try:
+            duracion = int(duracion)
+        except (TypeError, ValueError):
+            duracion = 0
+        if duracion <= 0:
+            raise ErrorCita("La duración debe ser un número de minutos mayor a cero")
+        return duracion
+    
+    def verificar_horario(self, doctor, fecha, hora, duracion, ignorar=None):
+        """Rechazar horarios que se cruzan con otra cita del mismo doctor"""
+        inicio = hora_a_minutos(hora)
+        ocupado_por = self.agenda.conflicto(doctor, fecha, inicio, duracion, ignorar=ignorar)
+        if ocupado_por is None:
+            return
+        
+        cita = self.registro.obtener(ocupado_por)
+        libres = self.agenda.siguientes_libres(doctor, fecha, 5, duracion, ignorar=ignorar)
+        sugerencia = ", ".join(minutos_a_hora(m) for m in libres) or "ninguno este día"
+        raise HorarioOcupado(f"El horario se cruza con la cita de {cita['Paciente']} a las {cita['Hora']}.\n"
+                             f"Próximos horarios libres: {sugerencia}", cita, libres)
+    
+    def obtener(self, id_cita):
+        """Cita con ese ID"""
+        try:
+            return self.registro.obtener(id_cita)
+        except KeyError:
+            raise CitaNoEncontrada("La cita no existe o fue eliminada")
+    
+    def exigir_vigente(self, cita):
+        """Rechazar cambios a citas de días pasados (se archivan como historial)"""
+        if fecha_pasada(cita["Fecha"]):
+            raise ErrorCita("Las citas de días pasados forman parte del historial y no se pueden modificar.")
+    
+    @medido("servicio.agendar")
+    def agendar(self, paciente, fecha, hora, doctor="", duracion=DURACION_CITA, motivo="", usuario=None):
+        """Crear una cita nueva y devolverla"""
+        paciente, fecha, hora = paciente.strip(), fecha.strip(), hora.strip()
+        motivo = (motivo or "").strip()
+        if not paciente or not fecha or not hora:
+            raise ErrorCita("Complete todos los campos obligatorios (Paciente, Fecha, Hora)")
+        
+        with self.lock:
+            self.exigir_carga()
+            hora = self.validar_fecha_hora(fecha, hora)
+            doctor = (doctor or "").strip()
+            duracion = self.validar_duracion(duracion)
+            self.verificar_horario(doctor, fecha, hora, duracion)
+            
+            nueva_cita = {
+                "ID": nuevo_id(),
+                "Paciente": paciente,
+                "Doctor": doctor,
+                "Fecha": fecha,
+                "Hora": hora,
+                "Duracion": duracion,
+                "Motivo": motivo if motivo else "Consulta general",
+                "Estado": "Agendada",
+                "Version": 1
+            }
+            self.registro.agregar(nueva_cita)
+            self.agenda.agregar(nueva_cita)
+            self.estadisticas.agregar(nueva_cita)
+            self.apilar(self.anotar("agendar", nueva_cita["ID"], None, nueva_cita, usuario))
+            self.guardar("agregar", cita=nueva_cita)
+        self.notificar("cambios", [nueva_cita["ID"]])
+        return nueva_cita
+    
+    @medido("servicio.reprogramar")
+    def reprogramar(self, id_cita, fecha, hora, doctor=None, duracion=None, motivo=None,
+                    vista=None, version=None, usuario=None):
+        """Cambiar fecha, hora y demás datos de una cita y devolverla.
+        
+        `vista` es la cita tal como la vio el usuario: los cambios se fusionan
+        con lo que otra estación haya modificado después. Con `version`, en
+        cambio, se rechaza la operación si la cita ya no está en esa versión.
+        """
+        fecha, hora = fecha.strip(), hora.strip()
+        if not fecha or not hora:
+            raise ErrorCita("Complete los campos de fecha y hora")
+        
+        with self.lock:
+            self.exigir_carga()
+            actual = self.obtener(id_cita)
+            if version is not None and int(version) != actual["Version"]:
+                raise ConflictoCita("La cita cambió desde que se consultó.")
+            self.exigir_vigente(actual)
+            anterior = vista if vista is not None else actual
+            
+            hora = self.validar_fecha_hora(fecha, hora)
+            doctor = anterior["Doctor"] if doctor is None else doctor.strip()
+            duracion = self.validar_duracion(anterior["Duracion"] if duracion is None else duracion)
+            self.verificar_horario(doctor, fecha, hora, duracion, ignorar=id_cita)
+            
+            nuevos = {
+                "Doctor": doctor,
+                "Fecha": fecha,
+                "Hora": hora,
+                "Duracion": duracion,
+                "Motivo": motivo.strip() if motivo and motivo.strip() else anterior["Motivo"],
+                "Estado": "Reprogramada"
+            }
+            # Solo se envían los campos que cambiaron, para poder fusionar
+            # con lo que otra estación haya modificado mientras tanto
+            cambios = {campo: valor for campo, valor in nuevos.items()
+                       if not valores_iguales(valor, anterior[campo])}
+            base = {campo: anterior[campo] for campo in cambios}
+            self.registro.actualizar(id_cita, {**cambios, "Version": actual["Version"] + 1})
+            cita = self.registro.obtener(id_cita)
+            self.agenda.mover(cita)
+            self.estadisticas.mover(actual, cita)
+            self.apilar(self.anotar("reprogramar", id_cita, *diferencia_cita(actual, cita, cambios), usuario))
+            self.guardar("actualizar", id=id_cita, cambios=cambios,
+                         version=anterior["Version"], base=base)
+        self.notificar("cambios", [id_cita])
+        return cita
+    
+    @medido("servicio.asistencia")
+    def registrar_asistencia(self, id_cita, asistio, vista=None, version=None, usuario=None):
+        """Marcar una cita de hoy como "Atendida" o "No asistió" y devolverla"""
+        with self.lock:
+            self.exigir_carga()
+            actual = self.obtener(id_cita)
+            if version is not None and int(version) != actual["Version"]:
+                raise ConflictoCita("La cita cambió desde que se consultó.")
+            self.exigir_vigente(actual)
+            if str(actual["Fecha"]) != datetime.now().strftime("%Y-%m-%d"):
+                raise ErrorCita("La asistencia se registra el día de la cita.")
+            anterior = vista if vista is not None else actual
+            
+            estado = "Atendida" if asistio else "No asistió"
+            if estado != actual["Estado"]:
+                self.registro.actualizar(id_cita, {"Estado": estado, "Version": actual["Version"] + 1})
+                cita = self.registro.obtener(id_cita)
+                self.estadisticas.mover(actual, cita)
+                self.apilar(self.anotar("asistencia", id_cita, *diferencia_cita(actual, cita, ["Estado"]), usuario))
+                self.guardar("actualizar", id=id_cita, cambios={"Estado": estado},
+                             version=anterior["Version"], base={"Estado": anterior["Estado"]})
+            cita = self.registro.obtener(id_cita)
+        self.notificar("cambios", [id_cita])
+        return cita
+    
+    @medido("servicio.eliminar")
+    def eliminar(self, id_cita, vista=None, version=None, usuario=None):
+        """Eliminar una cita (con `vista` o `version` como en reprogramar)"""
+        with self.lock:
+            self.exigir_carga()
+            actual = self.obtener(id_cita)
+            if version is not None and int(version) != actual["Version"]:
+                raise ConflictoCita("La cita cambió desde que se consultó.")
+            self.exigir_vigente(actual)
+            version = (vista if vista is not None else actual)["Version"]
+            self.estadisticas.quitar(self.registro.eliminar(id_cita))
+            self.agenda.quitar(id_cita)
+            self.apilar(self.anotar("eliminar", id_cita, actual, None, usuario))
+            self.guardar("eliminar", id=id_cita, version=version)
+        self.notificar("cambios", [id_cita])
+    
+    def listar(self, desde=0, limite=None):
+        """Citas en orden de registro (una página si se indica límite)"""
+        with self.lock:
+            ids = self.registro.ids()
+            ids = ids[desde:] if limite is None else ids[desde:desde + limite]
+            return [self.registro.obtener(id_cita) for id_cita in ids]
+    
+    @medido("servicio.consultar")
+    def consultar(self, paciente="", motivo="", estado=None, desde=None, hasta=None,
+                  orden=None, descendente=False):
+        """IDs de las citas que cumplen los filtros, en el orden pedido"""
+        with self.lock:
+            if self.indice is None or not self.indice.vigente(self.registro):
+                self.indice = IndiceBusqueda(self.registro)
+            indice = self.indice
+        # El índice no cambia después de armado: se consulta fuera del lock
+        return indice.consultar(paciente=paciente, motivo=motivo, estado=estado, desde=desde,
+                                hasta=hasta, orden=orden, descendente=descendente)
+    
+    def buscar_historial(self, paciente="", motivo="", estado=None, desde=None, hasta=None):
+        """Buscar en las citas archivadas desde el hilo de E/S.
+        
+        El resultado llega con el evento "historial" (lista de citas).
+        """
+        self.notificar("buscando_historial")
+        self.trabajador.enviar(lambda: self.consultar_historial(paciente, motivo, estado, desde, hasta),
+                               al_terminar=lambda citas: self.notificar("historial", citas),
+                               al_fallar=lambda error: self.notificar("error_historial", error),
+                               clave="historial")
+    
+    @medido("servicio.historial")
+    def consultar_historial(self, paciente="", motivo="", estado=None, desde=None, hasta=None):
+        """Citas archivadas que cumplen los filtros, por fecha (corre en el hilo de E/S).
+        
+        Solo se leen los meses del rango pedido y cada uno una sola vez
+        mientras su marca no cambie.
+        """
+        primero = desde.strftime("%Y-%m") if desde is not None else ""
+        ultimo = hasta.strftime("%Y-%m") if hasta is not None else "9999-99"
+        meses = {mes: marca for mes, marca in self.almacenamiento.meses_archivados().items()
+                 if primero <= mes <= ultimo}
+        for mes, marca in meses.items():
+            leido = self.meses_leidos.get(mes)
+            if leido is None or leido[0] != marca:
+                self.meses_leidos[mes] = (marca, self.almacenamiento.leer_archivo(mes))
+                METRICAS.contar("historial.meses_leidos")
+        
+        clave = tuple(sorted(meses.items()))
+        if self.indice_historial is None or self.indice_historial[0] != clave:
+            partes = [self.meses_leidos[mes][1] for mes, _ in clave]
+            df = (pd.concat(partes, ignore_index=True).drop_duplicates("ID", keep="last")
+                  if partes else pd.DataFrame(columns=COLUMNAS_CITAS))
+            self.indice_historial = (clave, IndiceBusqueda(RegistroCitas(df)))
+        indice = self.indice_historial[1]
+        ids = indice.consultar(paciente=paciente, motivo=motivo, estado=estado,
+                               desde=desde, hasta=hasta, orden="Fecha")
+        return [indice.registro.obtener(id_cita) for id_cita in ids]
+    
+    def preparar_informes(self, desde, hasta):
+        """Resumir en el hilo de E/S los meses archivados entre dos fechas YYYY-MM-DD.
+        
+        Los informes se pueden pedir enseguida con lo vigente; si algún mes
+        archivado se resume, llega el evento "estadisticas" para repetirlos.
+        """
+        self.trabajador.enviar(lambda: self.resumir_archivo(desde, hasta),
+                               al_terminar=lambda meses: self.notificar("estadisticas", meses) if meses else None,
+                               al_fallar=lambda error: self.notificar("error_historial", error),
+                               clave="informes")
+    
+    @medido("servicio.resumir_archivo")
+    def resumir_archivo(self, desde, hasta):
+        """Agregados de los meses archivados del rango que cambiaron (hilo de E/S); devuelve esos meses"""
+        resumidos = []
+        for mes, marca in self.almacenamiento.meses_archivados().items():
+            if not desde[:7] <= mes <= hasta[:7]:
+                continue
+            anterior = self.estadisticas_meses.get(mes)
+            if anterior is not None and anterior[0] == marca:
+                continue
+            leido = self.meses_leidos.get(mes)
+            df = leido[1] if leido is not None and leido[0] == marca else self.almacenamiento.leer_archivo(mes)
+            estadisticas = EstadisticasCitas()
+            estadisticas.cargar(df)
+            self.estadisticas_meses[mes] = (marca, estadisticas)
+            resumidos.append(mes)
+        return resumidos
+    
+    def partes_estadisticas(self, desde, hasta):
+        """Agregados vigentes más los de los meses archivados ya resumidos del rango"""
+        archivados = [estadisticas for mes, (_, estadisticas) in list(self.estadisticas_meses.items())
+                      if desde[:7] <= mes <= hasta[:7]]
+        return [self.estadisticas] + archivados
+    
+    def informe(self, grupos):
+        """Indicadores de cada grupo de resúmenes y del total"""
+        filas = {clave: self.estadisticas.indicadores(juntar_resumenes(resumenes))
+                 for clave, resumenes in sorted(grupos.items())}
+        total = juntar_resumenes(resumen for resumenes in grupos.values() for resumen in resumenes)
+        return {"filas": filas, "total": self.estadisticas.indicadores(total, max(len(grupos), 1))}
+    
+    def informe_dia(self, fecha):
+        """Citas por estado, ocupación por hora y ausencias de cada doctor en un día"""
+        grupos = {}
+        with self.lock:
+            for parte in self.partes_estadisticas(fecha, fecha):
+                for doctor, resumen in parte.dia(fecha).items():
+                    grupos.setdefault(doctor, []).append(resumen)
+            return self.informe(grupos)
+    
+    def informe_doctor(self, doctor, desde, hasta):
+        """Los mismos indicadores de un doctor, día por día entre dos fechas YYYY-MM-DD"""
+        grupos = {}
+        with self.lock:
+            for parte in self.partes_estadisticas(desde, hasta):
+                for fecha, resumen in parte.dias_doctor(doctor, desde, hasta).items():
+                    grupos.setdefault(fecha, []).append(resumen)
+            return self.informe(grupos)
+    
+    def horarios_libres(self, doctor, fecha, duracion=DURACION_CITA, n=5):
+        """Próximos horarios libres (en minutos) de un doctor en una fecha.
+        
+        Si la fecha es hoy, solo se ofrecen horarios que todavía no pasaron.
+        """
+        try:
+            dia = datetime.strptime(fecha.strip(), "%Y-%m-%d")
+        except ValueError:
+            raise ErrorCita("Formato de fecha incorrecto. Use YYYY-MM-DD")
+        duracion = self.validar_duracion(duracion)
+        
+        ahora = datetime.now()
+        desde = ahora.hour * 60 + ahora.minute if dia.date() == ahora.date() else None
+        with self.lock:
+            return self.agenda.siguientes_libres((doctor or "").strip(), fecha.strip(), n,
+                                                 duracion, desde=desde)
+    
+    def doctores(self):
+        """Doctores que tienen alguna cita"""
+        with self.lock:
+            return {clave[0] for clave in self.agenda.dias if clave[0]}
+    
+    def guardar(self, operacion, **datos):
+        """Registrar la operación en el almacenamiento desde el hilo de E/S"""
+        registro = self.registro
+        hasta = self.secuencia_auditoria
+        coalescencia = self.almacenamiento.clave_coalescencia(operacion)
+        
+        def registrar():
+            try:
+                with METRICAS.medir(f"guardado.{operacion}"):
+                    cambios = self.almacenamiento.registrar(registro, operacion, **datos)
+            except Exception as error:
+                # Una operación rechazada no llega a la bitácora; si los
+                # guardados se fusionan, el próximo que funcione la incluye
+                if coalescencia is None or isinstance(error, ConflictoCita):
+                    error.operaciones_descartadas = self.descartar_auditoria(hasta)
+                raise
+            self.volcar_auditoria(hasta)
+            return cambios
+        self.notificar("guardando")
+        self.trabajador.enviar(registrar, al_terminar=self.on_registrado, al_fallar=self.on_error_guardado,
+                               clave=coalescencia)
+    
+    def anotar(self, tipo, id_cita, antes, despues, usuario=None, **datos):
+        """Preparar la entrada de bitácora de una operación (con el lock tomado).
+        
+        Se escribe recién cuando el guardado que sigue termina bien.
+        """
+        entrada = {"op": nuevo_id(), "usuario": usuario or self.usuario or "",
+                   "momento": datetime.now().isoformat(timespec="seconds"),
+                   "tipo": tipo, "id": id_cita, "antes": antes, "despues": despues, **datos}
+        with self.lock_auditoria:
+            self.secuencia_auditoria += 1
+            self.auditoria_pendiente.append((self.secuencia_auditoria, entrada))
+        return entrada
+    
+    def tomar_auditoria(self, hasta):
+        """Quitar de las pendientes las entradas hasta una secuencia"""
+        with self.lock_auditoria:
+            entradas = [entrada for secuencia, entrada in self.auditoria_pendiente if secuencia <= hasta]
+            self.auditoria_pendiente = [(secuencia, entrada) for secuencia, entrada in self.auditoria_pendiente
+                                        if secuencia > hasta]
+        return entradas
+    
+    def volcar_auditoria(self, hasta):
+        """Escribir en la bitácora las entradas ya guardadas (hilo de E/S)"""
+        entradas = self.tomar_auditoria(hasta)
+        if entradas:
+            self.auditoria.anexar(entradas)
+    
+    def descartar_auditoria(self, hasta):
+        """Olvidar las entradas de operaciones que no se guardaron; devuelve sus códigos"""
+        return {entrada["op"] for entrada in self.tomar_auditoria(hasta)}
+    
+    def olvidar_operaciones(self, descartadas):
+        """Sacar de las pilas para deshacer las operaciones que no se guardaron"""
+        if not descartadas:
+            return
+        with self.lock:
+            for deshacer, rehacer in self.pilas.values():
+                for pila in (deshacer, rehacer):
+                    for entrada in [entrada for entrada in pila if entrada["op"] in descartadas]:
+                        pila.remove(entrada)
+    
+    def pila(self, usuario):
+        """Pilas (deshacer, rehacer) de un usuario"""
+        return self.pilas.setdefault(usuario or self.usuario or "", (collections.deque(maxlen=LIMITE_DESHACER), []))
+    
+    def apilar(self, entrada):
+        """Sumar una operación nueva a la pila para deshacer; lo rehecho ya no aplica"""
+        deshacer, rehacer = self.pila(entrada["usuario"])
+        deshacer.append(entrada)
+        rehacer.clear()
+    
+    def operaciones_pendientes(self, usuario=None):
+        """Cuántas operaciones puede deshacer y rehacer el usuario"""
+        with self.lock:
+            deshacer, rehacer = self.pila(usuario)
+            return len(deshacer), len(rehacer)
+    
+    @medido("servicio.deshacer")
+    def deshacer(self, usuario=None):
+        """Deshacer la última operación del usuario; devuelve la entrada de bitácora nueva"""
+        return self.retroceder(usuario, rehacer=False)
+    
+    @medido("servicio.rehacer")
+    def rehacer(self, usuario=None):
+        """Volver a aplicar la última operación deshecha del usuario"""
+        return self.retroceder(usuario, rehacer=True)
+    
+    def retroceder(self, usuario, rehacer):
+        """Invertir la entrada de arriba de una pila y pasar la inversa a la otra"""
+        with self.lock:
+            self.exigir_carga()
+            deshacer, pendientes = self.pila(usuario)
+            origen, destino = (pendientes, deshacer) if rehacer else (deshacer, pendientes)
+            if not origen:
+                raise ErrorCita("No hay operaciones para rehacer" if rehacer else "No hay operaciones para deshacer")
+            try:
+                entrada = self.invertir(origen[-1], "rehacer" if rehacer else "deshacer", usuario)
+            except CitaCambiada:
+                # Ya no se puede aplicar: se descarta para no trabar la pila
+                origen.pop()
+                raise
+            origen.pop()
+            destino.append(entrada)
+        self.notificar("cambios", [entrada["id"]])
+        return entrada
+    
+    def invertir(self, entrada, tipo, usuario):
+        """Llevar una cita del estado posterior de una entrada al anterior (con el lock tomado).
+        
+        La cita tiene que seguir como la dejó la entrada (misma versión); la
+        versión no se restaura sino que avanza, como en cualquier cambio.
+        """
+        id_cita, esperado, objetivo = entrada["id"], entrada["despues"], entrada["antes"]
+        actual = self.registro.citas.get(id_cita)
+        if (actual is None) != (esperado is None) or (
+                actual is not None and not all(valores_iguales(actual[campo], valor)
+                                               for campo, valor in esperado.items())):
+            raise CitaCambiada("La cita cambió después de esa operación; ya no se puede deshacer ni rehacer.")
+        if actual is not None:
+            self.exigir_vigente(actual)
+        
+        if objetivo is None:
+            self.estadisticas.quitar(self.registro.eliminar(id_cita))
+            self.agenda.quitar(id_cita)
+            nueva = self.anotar(tipo, id_cita, actual, None, usuario, deshace=entrada["op"])
+            self.guardar("eliminar", id=id_cita, version=actual["Version"])
+            return nueva
+        
+        campos = {campo: valor for campo, valor in objetivo.items() if campo != "Version"}
+        cita = {**(actual or {}), **campos}
+        self.exigir_vigente(cita)
+        self.verificar_horario(cita["Doctor"], cita["Fecha"], cita["Hora"], cita["Duracion"], ignorar=id_cita)
+        if actual is None:
+            cita["Version"] = int(objetivo["Version"]) + 1
+            self.registro.agregar(cita)
+            self.agenda.agregar(cita)
+            self.estadisticas.agregar(cita)
+            nueva = self.anotar(tipo, id_cita, None, cita, usuario, deshace=entrada["op"])
+            self.guardar("agregar", cita=cita)
+            return nueva
+        
+        cambios = {campo: valor for campo, valor in campos.items() if not valores_iguales(valor, actual[campo])}
+        self.registro.actualizar(id_cita, {**cambios, "Version": actual["Version"] + 1})
+        cita = self.registro.obtener(id_cita)
+        self.agenda.mover(cita)
+        self.estadisticas.mover(actual, cita)
+        nueva = self.anotar(tipo, id_cita, *diferencia_cita(actual, cita, cambios), usuario, deshace=entrada["op"])
+        self.guardar("actualizar", id=id_cita, cambios=cambios, version=actual["Version"],
+                     base={campo: actual[campo] for campo in cambios})
+        return nueva
+    
+    def on_registrado(self, cambios):
+        """Incorporar el estado vigente de las citas que devolvió el almacenamiento"""
+        self.aplicar_cambios(cambios)
+        if not self.trabajador.ocupado():
+            self.notificar("guardado")
+    
+    def on_error_guardado(self, error):
+        """Avisar de un guardado fallido; en un conflicto se descarta la versión local"""
+        self.olvidar_operaciones(getattr(error, "operaciones_descartadas", ()))
+        if isinstance(error, ConflictoCita):
+            METRICAS.contar("guardado.conflictos")
+            self.aplicar_cambios(error.cambios)
+            self.notificar("conflicto", error)
+        else:
+            METRICAS.contar("guardado.errores")
+            self.notificar("error_guardado", error)
+    
+    def importar(self, ruta, verificar_horarios=True, usuario=None):
+        """Importar un archivo de citas (CSV, Excel o JSON) en el hilo de E/S.
+        
+        El resultado llega con el evento "importado": cuántas citas entraron,
+        cuántas filas tuvieron errores y el archivo con el detalle de cada una.
+        """
+        self.exigir_carga()
+        self.notificar("importando")
+        usuario = usuario or self.usuario
+        self.trabajador.enviar(lambda: self.ejecutar_importacion(ruta, verificar_horarios, usuario),
+                               al_terminar=lambda resultado: self.notificar("importado", resultado),
+                               al_fallar=lambda error: self.notificar("error_importacion", error))
+    
+    @medido("servicio.importar")
+    def ejecutar_importacion(self, ruta, verificar_horarios=True, usuario=None):
+        """Validar el archivo por lotes e incorporar las citas válidas con una sola escritura"""
+        validas, errores = [], []
+        for fila, lote in leer_lotes(ruta):
+            df, errores_lote = validar_lote(lote, fila)
+            validas.append(df)
+            errores.extend(errores_lote)
+        
+        with self.lock:
+            self.exigir_carga()
+            citas, rechazadas = self.incorporar(validas, verificar_horarios)
+            if citas:
+                # En la bitácora, filas de valores: la misma información en menos espacio
+                self.anotar("importar", None, None, None, usuario, columnas=COLUMNAS_CITAS,
+                            filas=[[cita[columna] for columna in COLUMNAS_CITAS] for cita in citas])
+                self.guardar("importar", citas=citas, verificar_horarios=verificar_horarios)
+        if citas:
+            self.notificar("cambios", [cita["ID"] for cita in citas])
+        errores = sorted(errores + rechazadas)
+        return {"importadas": len(citas), "errores": len(errores),
+                "reporte": escribir_reporte_errores(ruta, errores) if errores else None}
+    
+    def incorporar(self, lotes, verificar_horarios=True):
+        """Agregar filas ya validadas al registro y a la agenda (con el lock tomado).
+        
+        Se rechazan los ID repetidos y, si se pide, los horarios que se cruzan
+        con otra cita del mismo doctor, incluidas las del mismo archivo. Las
+        filas sin doctor se comparan entre sí, igual que al agendar sin doctor.
+        Devuelve las citas aceptadas y los errores (fila, mensaje).
+        """
+        nuevas, errores = {}, []
+        for lote in lotes:
+            filas = lote.pop("_fila").tolist()
+            columnas = list(lote.columns)
+            registros = (dict(zip(columnas, valores))
+                         for valores in zip(*(lote[columna].tolist() for columna in columnas)))
+            for fila, cita in zip(filas, registros):
+                if cita["ID"] in self.registro or cita["ID"] in nuevas:
+                    errores.append((fila, "ID repetido"))
+                    continue
+                if verificar_horarios:
+                    ocupado_por = self.agenda.conflicto(cita["Doctor"], cita["Fecha"],
+                                                        hora_a_minutos(cita["Hora"]), cita["Duracion"])
+                    if ocupado_por is not None:
+                        ocupada = nuevas.get(ocupado_por) or self.registro.obtener(ocupado_por)
+                        errores.append((fila, f"Horario ocupado por {ocupada['Paciente']} "
+                                              f"a las {ocupada['Hora']}"))
+                        continue
+                self.agenda.agregar(cita)
+                self.estadisticas.agregar(cita)
+                nuevas[cita["ID"]] = cita
+        citas = list(nuevas.values())
+        self.registro.agregar_varias(citas)
+        return citas, errores
+    
+    def exportar(self, destino, solo_vigentes=False):
+        """Exportar las citas a CSV, JSON o Excel (según la extensión), por lotes.
+        
+        Incluye el historial archivado, salvo que se pida solo la agenda
+        vigente. El evento "exportado" trae (destino, cantidad de citas).
+        """
+        with self.lock:
+            # Las citas no se mutan: basta con copiar la lista de referencias
+            citas = list(self.registro.citas.values())
+        self.notificar("exportando")
+        self.trabajador.enviar(lambda: exportar_por_partes(self.citas_a_exportar(citas, solo_vigentes), destino),
+                               al_terminar=lambda total: self.notificar("exportado", (destino, total)),
+                               al_fallar=self.on_error_guardado)
+    
+    def citas_a_exportar(self, vigentes, solo_vigentes=False):
+        """Citas archivadas, de a un mes (en el hilo de E/S), seguidas de las vigentes"""
+        if not solo_vigentes:
+            ids = {cita["ID"] for cita in vigentes}
+            for mes in sorted(self.almacenamiento.meses_archivados()):
+                for cita in self.almacenamiento.leer_archivo(mes).to_dict("records"):
+                    # Una cita que quedó en ambos lados se exporta una vez, como vigente
+                    if cita["ID"] not in ids:
+                        yield cita
+        yield from vigentes
+    
+    def esperar_es(self, funcion, espera=60):
+        """Ejecutar una función en el hilo de E/S y esperar su resultado.
+        
+        Para los hilos de la API: el resultado llega cuando quien maneja el
+        servicio llama a atender().
+        """
+        listo = threading.Event()
+        resultado = {}
+        
+        def terminar(valor):
+            resultado["valor"] = valor
+            listo.set()
+        
+        def fallar(error):
+            resultado["error"] = error
+            listo.set()
+        
+        self.trabajador.enviar(funcion, al_terminar=terminar, al_fallar=fallar)
+        if not listo.wait(espera):
+            error = ErrorCita("El almacenamiento no respondió a tiempo")
+            error.estado_http = 503
+            raise error
+        if "error" in resultado:
+            raise resultado["error"]
+        return resultado["valor"]
+    
+    def esperar(self):
+        """Bloquear hasta que el hilo de E/S termine y atender sus resultados (uso sin ventana)"""
+        while self.trabajador.ocupado():
+            time.sleep(0.05)
+        self.trabajador.procesar_resultados()
+    
+    def cerrar(self):
+        """Terminar las escrituras pendientes y cerrar el almacenamiento"""
+        self.trabajador.enviar(self.almacenamiento.cerrar)
+        self.trabajador.esperar()
+    
+    def detener(self):
+        """Cerrar el almacenamiento y terminar el hilo de E/S"""
+        self.cerrar()
+        self.trabajador.detener()
+
+
+class NotificadorBandeja:
+    """Deja cada recordatorio como una línea JSON en una bandeja de salida.
+    
+    Sirve para pruebas y como punto de entrega: otro proceso (correo, SMS)
+    puede leer la bandeja y enviar los mensajes.
+    """
+    
+    def __init__(self, archivo):
+        self.ruta = os.path.splitext(archivo)[0] + ".bandeja.jsonl"
+    
+    def enviar(self, recordatorio):
+        """Anexar el recordatorio a la bandeja"""
+        with open(self.ruta, "a+b") as f:
+            anexar_lineas(f, linea_json(recordatorio))
+
+
+class NotificadorConsola:
+    """Muestra los recordatorios por la salida estándar (modo sin ventanas)"""
+    
+    def __init__(self, archivo):
+        pass
+    
+    def enviar(self, recordatorio):
+        """Imprimir el mensaje"""
+        print(f"[{recordatorio['momento']}] {recordatorio['mensaje']}")
+
+
+NOTIFICADORES = {
+    "bandeja": NotificadorBandeja,
+    "consola": NotificadorConsola,
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def inicio_dia(fecha):
+    """Medianoche de una fecha YYYY-MM-DD como marca de tiempo, o None (en caché como las horas)"""
+    try:
+        return datetime.strptime(fecha, "%Y-%m-%d").timestamp()
+    except ValueError:
+        return None
+
+
+def momento_cita(cita):
+    """Inicio de una cita como marca de tiempo (segundos), o None si no se entiende"""
+    dia = inicio_dia(str(cita["Fecha"]))
+    minutos = hora_a_minutos(str(cita["Hora"]))
+    return None if dia is None or minutos is None else dia + minutos * 60
+
+
+class ProgramadorRecordatorios:
+    """Envía recordatorios antes de cada cita desde un hilo propio.
+    
+    Los avisos pendientes están en un montículo ordenado por el momento de
+    envío: el hilo duerme hasta el primero y no recorre las citas en cada
+    vuelta. El montículo se arma una vez al cargar y después solo se suman
+    las citas que el servicio avisa como cambiadas; las entradas viejas (la
+    cita cambió de versión o se eliminó) se descartan al salir. Los envíos
+    quedan anotados en un archivo compartido, así ni un reinicio ni otra
+    estación repiten un aviso.
+    """
+    
+    ESTADOS_CERRADOS = ("Atendida", "No asistió")
+    REINTENTO = 60
+    
+    def __init__(self, servicio, notificadores, anticipaciones=None):
+        self.servicio = servicio
+        self.notificadores = notificadores
+        # Del aviso más anticipado al menos anticipado
+        self.anticipaciones = sorted((anticipaciones or ANTICIPACION_RECORDATORIOS).items(),
+                                     key=lambda item: -item[1])
+        self.monticulo = []
+        self.versiones = {}
+        self.secuencia = 0
+        
+        base = os.path.splitext(servicio.almacenamiento.archivo)[0]
+        self.ruta_enviados = base + ".recordatorios.jsonl"
+        self.bloqueo = BloqueoArchivo(base + ".recordatorios.lock")
+        self.enviados = set()
+        self.posicion = 0
+        
+        self.condicion = threading.Condition()
+        self.pendientes = set()
+        self.recargar = True
+        self.detenido = False
+        self.hilo = None
+        servicio.suscribir(self.on_evento)
+    
+    def iniciar(self):
+        """Arrancar el hilo de recordatorios"""
+        self.hilo = threading.Thread(target=self.ejecutar, name="recordatorios", daemon=True)
+        self.hilo.start()
+    
+    def detener(self):
+        """Terminar el hilo"""
+        with self.condicion:
+            self.detenido = True
+            self.condicion.notify()
+        if self.hilo is not None:
+            self.hilo.join()
+    
+    def on_evento(self, evento, datos):
+        """Anotar citas cambiadas o una carga completa (desde el hilo que avisa)"""
+        if evento not in ("cambios", "cargado"):
+            return
+        with self.condicion:
+            if evento == "cargado":
+                self.recargar = True
+            else:
+                self.pendientes.update(datos)
+            self.condicion.notify()
+    
+    def ejecutar(self):
+        """Bucle del hilo: esperar al próximo aviso o a un cambio"""
+        while True:
+            with self.condicion:
+                while not (self.detenido or self.recargar or self.pendientes):
+                    espera = self.monticulo[0][0] - time.time() if self.monticulo else INTERVALO_RECORDATORIOS
+                    if espera <= 0:
+                        break
+                    # Con tope, por si cambia la hora del sistema
+                    self.condicion.wait(min(espera, INTERVALO_RECORDATORIOS))
+                if self.detenido:
+                    return
+                recargar, pendientes = self.recargar, self.pendientes
+                self.recargar, self.pendientes = False, set()
+            try:
+                if recargar:
+                    self.reconstruir()
+                for id_cita in pendientes:
+                    self.programar(id_cita)
+                self.enviar_vencidos()
+            except Exception as error:
+                METRICAS.contar("recordatorios.errores")
+                self.servicio.notificar("error_recordatorio", error)
+                with self.condicion:
+                    self.recargar = True
+                    self.condicion.wait_for(lambda: self.detenido, self.REINTENTO)
+    
+    def avisos(self, cita, ahora):
+        """(momento, tipo) de los avisos que le quedan a una cita"""
+        inicio = momento_cita(cita)
+        if inicio is None or inicio <= ahora or cita["Estado"] in self.ESTADOS_CERRADOS:
+            return []
+        avisos = [(inicio - minutos * 60, tipo) for tipo, minutos in self.anticipaciones
+                  if inicio - minutos * 60 >= ahora]
+        # Una cita agendada sobre la hora recibe igual el último aviso
+        return avisos or [(ahora, self.anticipaciones[-1][0])]
+    
+    @medido("recordatorios.reconstruir")
+    def reconstruir(self):
+        """Armar el montículo con todas las citas vigentes (solo al cargar)"""
+        ahora = time.time()
+        self.versiones = {}
+        self.monticulo = []
+        registro = self.servicio.registro
+        with registro.lock:
+            citas = list(registro.citas.values())
+        for cita in citas:
+            self.versiones[cita["ID"]] = cita["Version"]
+            for momento, tipo in self.avisos(cita, ahora):
+                self.secuencia += 1
+                self.monticulo.append((momento, self.secuencia, cita["ID"], tipo, cita["Version"]))
+        heapq.heapify(self.monticulo)
+    
+    def programar(self, id_cita):
+        """Sumar los avisos de una cita nueva o modificada"""
+        cita = self.servicio.registro.citas.get(id_cita)
+        if cita is None:
+            self.versiones.pop(id_cita, None)
+            return
+        if self.versiones.get(id_cita) == cita["Version"]:
+            # Ya programada (el aviso puede llegar repetido)
+            return
+        self.versiones[id_cita] = cita["Version"]
+        for momento, tipo in self.avisos(cita, time.time()):
+            self.secuencia += 1
+            heapq.heappush(self.monticulo, (momento, self.secuencia, id_cita, tipo, cita["Version"]))
+        # Demasiadas entradas viejas: rearmar con las vigentes
+        if len(self.monticulo) > 2 * len(self.anticipaciones) * len(self.versiones) + 1000:
+            self.monticulo = [entrada for entrada in self.monticulo if self.versiones.get(entrada[2]) == entrada[4]]
+            heapq.heapify(self.monticulo)
+    
+    def enviar_vencidos(self):
+        """Enviar los avisos cuyo momento ya llegó"""
+        ahora = time.time()
+        while self.monticulo and self.monticulo[0][0] <= ahora:
+            momento, secuencia, id_cita, tipo, version = heapq.heappop(self.monticulo)
+            cita = self.servicio.registro.citas.get(id_cita)
+            if cita is None or cita["Version"] != version or self.versiones.get(id_cita) != version:
+                continue
+            try:
+                self.enviar(cita, tipo)
+            except Exception as error:
+                METRICAS.contar("recordatorios.errores")
+                self.servicio.notificar("error_recordatorio", error)
+                heapq.heappush(self.monticulo, (ahora + self.REINTENTO, secuencia, id_cita, tipo, version))
+                return
+    
+    def enviar(self, cita, tipo):
+        """Entregar un aviso a los notificadores, una sola vez entre todas las estaciones"""
+        clave = f"{cita['ID']}|{tipo}|{cita['Fecha']}|{cita['Hora']}"
+        with self.bloqueo:
+            self.leer_enviados()
+            if clave in self.enviados:
+                return
+            dias = (datetime.strptime(str(cita["Fecha"]), "%Y-%m-%d").date() - datetime.now().date()).days
+            cuando = "hoy" if dias == 0 else "mañana" if dias == 1 else f"el {cita['Fecha']}"
+            recordatorio = {
+                "momento": datetime.now().isoformat(timespec="seconds"),
+                "tipo": tipo, "id": cita["ID"], "paciente": cita["Paciente"], "doctor": cita["Doctor"],
+                "fecha": cita["Fecha"], "hora": cita["Hora"],
+                "mensaje": (f"Recordatorio para {cita['Paciente']}: tiene cita {cuando} "
+                            f"a las {cita['Hora']}"
+                            + (f" con {cita['Doctor']}." if cita["Doctor"] else ".")),
+            }
+            for notificador in self.notificadores:
+                notificador.enviar(recordatorio)
+            with open(self.ruta_enviados, "a+b") as f:
+                anexar_lineas(f, linea_json({"clave": clave, "momento": recordatorio["momento"]}))
+                self.posicion = f.tell()
+            self.enviados.add(clave)
+        METRICAS.contar("recordatorios.enviados")
+        self.servicio.notificar("recordatorio", recordatorio)
+    
+    def leer_enviados(self):
+        """Sumar los envíos que anotaron otras estaciones desde la última lectura"""
+        entradas, self.posicion = leer_lineas_json(self.ruta_enviados, self.posicion,
+                                                   danadas="recordatorios.lineas_danadas")
+        self.enviados.update(entrada["clave"] for entrada in entradas
+                             if isinstance(entrada, dict) and "clave" in entrada)
+    
+    def proximos(self, limite=20):
+        """Próximos avisos vigentes [(momento ISO, tipo, cita)] (para consultar, no en cada vuelta)"""
+        proximos = []
+        for momento, _, id_cita, tipo, version in heapq.nsmallest(limite * 2 + 10, list(self.monticulo)):
+            cita = self.servicio.registro.citas.get(id_cita)
+            if cita is not None and cita["Version"] == version and len(proximos) < limite:
+                proximos.append((datetime.fromtimestamp(momento).isoformat(timespec="seconds"), tipo, cita))
+        return proximos
+
+
+def iniciar_recordatorios(servicio):
+    """Arrancar el programador con el notificador configurado, o None si está desactivado"""
+    if NOTIFICADOR_RECORDATORIOS is None:
+        return None
+    notificador = NOTIFICADORES[NOTIFICADOR_RECORDATORIOS](servicio.almacenamiento.archivo)
+    programador = ProgramadorRecordatorios(servicio, [notificador])
+    programador.iniciar()
+    return programador
+
+
+class ServidorAPI:
+    """API HTTP/JSON local sobre el servicio de citas (asyncio, sin dependencias).
+    
+    Corre en un hilo con su propio bucle de eventos y escucha solo en
+    127.0.0.1. Cada petición se atiende en un hilo del ejecutor del bucle,
+    así una consulta pesada no frena a las demás.
+    
+    Hay que iniciar sesión con un usuario del sistema; las demás peticiones
+    llevan el token en "Authorization: Bearer <token>" y se registran a
+    nombre de ese usuario:
+    
+        POST   /sesion                           {"usuario": ..., "password": ...} -> token
+        DELETE /sesion                           cerrar la sesión
+        GET    /citas?desde=0&limite=100         listar
+        GET    /citas/<id>                       obtener
+        POST   /citas                            agendar
+        PATCH  /citas/<id>                       reprogramar
+        DELETE /citas/<id>?version=N             eliminar
+        GET    /consulta?paciente=&estado=...    buscar y ordenar
+        GET    /libres?doctor=&fecha=&duracion=  próximos horarios libres
+        GET    /historial?paciente=&desde_fecha= citas archivadas (días pasados)
+        POST   /asistencia/<id>                  {"asistio": true} (citas de hoy)
+        GET    /informes/dia?fecha=              estados, ocupación y ausencias por doctor
+        GET    /informes/doctor?doctor=&desde_fecha=&hasta_fecha=   lo mismo por día
+        POST   /deshacer, /rehacer               última operación del usuario de la sesión
+        GET    /auditoria?desde=0&limite=100     bitácora, de la más reciente a la más antigua (admin)
+        GET    /recordatorios?limite=20          próximos recordatorios programados
+        POST   /lote                             {"operaciones": [{"op": "agendar", ...}, ...]}
+        GET    /metricas                         tiempos (percentiles) y contadores (admin)
+    """
+    
+    RAZONES = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized",
+               403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+               413: "Payload Too Large", 429: "Too Many Requests",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+    TAMANO_MAXIMO = 16 * 1024 * 1024
+    
+    def __init__(self, servicio, usuarios, host="127.0.0.1", puerto=PUERTO_API, atender=False,
+                 recordatorios=None):
+        self.servicio = servicio
+        self.usuarios = usuarios
+        self.recordatorios = recordatorios
+        # Sesiones abiertas: token -> (usuario, vencimiento en time.monotonic)
+        self.sesiones = {}
+        self.lock_sesiones = threading.Lock()
+        self.host = host
+        self.puerto = puerto
+        # Sin ventana, el bucle de la API también atiende al servicio
+        self.atender_servicio = atender
+        self.bucle = None
+        self.hilo = None
+        self.error = None
+    
+    def iniciar(self):
+        """Arrancar el servidor en su hilo; devuelve el puerto en uso"""
+        listo = threading.Event()
+        self.hilo = threading.Thread(target=self.ejecutar, args=(listo,), name="api-citas", daemon=True)
+        self.hilo.start()
+        listo.wait()
+        if self.error is not None:
+            raise self.error
+        return self.puerto
+    
+    def ejecutar(self, listo):
+        """Bucle de eventos del servidor"""
+        self.bucle = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.bucle)
+        try:
+            servidor = self.bucle.run_until_complete(
+                asyncio.start_server(self.atender_conexion, self.host, self.puerto))
+        except OSError as error:
+            self.error = error
+            listo.set()
+            return
+        self.puerto = servidor.sockets[0].getsockname()[1]
+        listo.set()
+        
+        if self.atender_servicio:
+            self.bucle.create_task(self.atender_periodicamente())
+        try:
+            self.bucle.run_forever()
+        finally:
+            servidor.close()
+            # Cancelar conexiones abiertas antes de cerrar el bucle
+            tareas = asyncio.all_tasks(self.bucle)
+            for tarea in tareas:
+                tarea.cancel()
+            self.bucle.run_until_complete(asyncio.gather(*tareas, return_exceptions=True))
+            self.bucle.run_until_complete(servidor.wait_closed())
+            self.bucle.close()
+    
+    def detener(self):
+        """Cerrar el servidor y esperar a que termine su hilo"""
+        if self.hilo is not None and self.hilo.is_alive():
+            self.bucle.call_soon_threadsafe(self.bucle.stop)
+            self.hilo.join()
+    
+    async def atender_periodicamente(self):
+        """Procesar resultados de E/S y cambios remotos cuando no hay ventana"""
+        while True:
+            self.servicio.atender()
+            await asyncio.sleep(0.1)
+    
+    async def atender_conexion(self, reader, writer):
+        """Atender las peticiones de una conexión (HTTP/1.1 con keep-alive)"""
+        try:
+            while True:
+                try:
+                    cabecera = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                linea, *lineas = cabecera.decode("latin-1").split("\r\n")
+                partes = linea.split(" ")
+                cabeceras = {}
+                for texto in lineas:
+                    if ":" in texto:
+                        nombre, valor = texto.split(":", 1)
+                        cabeceras[nombre.strip().lower()] = valor.strip()
+                
+                largo = int(cabeceras.get("content-length") or 0)
+                if len(partes) != 3:
+                    estado, respuesta = 400, {"error": "Petición mal formada"}
+                elif largo > self.TAMANO_MAXIMO:
+                    estado, respuesta = 413, {"error": "Cuerpo demasiado grande"}
+                else:
+                    cuerpo = await reader.readexactly(largo)
+                    estado, respuesta = await asyncio.to_thread(
+                        self.responder_medido, partes[0], partes[1], cuerpo, cabeceras)
+                
+                cerrar = (estado in (400, 413) or cabeceras.get("connection", "").lower() == "close"
+                          or partes[-1] == "HTTP/1.0")
+                contenido = json.dumps(respuesta, ensure_ascii=False, default=str).encode("utf-8")
+                writer.write((f"HTTP/1.1 {estado} {self.RAZONES.get(estado, '')}\r\n"
+                              f"Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(contenido)}\r\n"
+                              f"Connection: {'close' if cerrar else 'keep-alive'}\r\n\r\n").encode()
+                             + contenido)
+                await writer.drain()
+                if cerrar:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # El servidor se está cerrando
+            pass
+        finally:
+            writer.close()
+    
+    def responder_medido(self, metodo, destino, cuerpo, cabeceras):
+        """Responder anotando la duración por método HTTP"""
+        with METRICAS.medir(f"api.{metodo}"):
+            return self.responder(metodo, destino, cuerpo, cabeceras)
+    
+    def abrir_sesion(self, datos):
+        """Verificar usuario y contraseña y entregar un token de sesión"""
+        usuario, password = datos.get("usuario"), datos.get("password")
+        if not isinstance(usuario, str) or not isinstance(password, str):
+            return 400, {"error": "Faltan usuario y contraseña"}
+        try:
+            nombre = self.usuarios.verificar(usuario, password)
+        except AccesoBloqueado as error:
+            return 429, {"error": str(error)}
+        if nombre is None:
+            return 401, {"error": "Usuario o contraseña incorrectos"}
+        
+        token = secrets.token_urlsafe(32)
+        ahora = time.monotonic()
+        with self.lock_sesiones:
+            # De paso se descartan las sesiones vencidas
+            self.sesiones = {clave: sesion for clave, sesion in self.sesiones.items() if sesion[1] > ahora}
+            self.sesiones[token] = (usuario, ahora + DURACION_SESION_API)
+        return 201, {"token": token, "usuario": usuario, "nombre": nombre, "segundos": DURACION_SESION_API}
+    
+    def token(self, cabeceras):
+        """Token de la cabecera Authorization (esquema Bearer), o None"""
+        esquema, _, token = cabeceras.get("authorization", "").partition(" ")
+        return token.strip() if esquema.lower() == "bearer" else None
+    
+    def usuario_sesion(self, token):
+        """Usuario de una sesión vigente, o None"""
+        with self.lock_sesiones:
+            sesion = self.sesiones.get(token)
+        if sesion is None or sesion[1] <= time.monotonic():
+            return None
+        return sesion[0]
+    
+    def responder(self, metodo, destino, cuerpo, cabeceras):
+        """Traducir una petición HTTP a una operación del servicio"""
+        url = urllib.parse.urlsplit(destino)
+        ruta = [parte for parte in url.path.split("/") if parte]
+        parametros = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            datos = json.loads(cuerpo) if cuerpo else {}
+        except ValueError:
+            return 400, {"error": "El cuerpo no es JSON válido"}
+        if not isinstance(datos, dict):
+            return 400, {"error": "Se esperaba un objeto JSON"}
+        
+        if ruta == ["sesion"] and metodo == "POST":
+            return self.abrir_sesion(datos)
+        token = self.token(cabeceras)
+        usuario = self.usuario_sesion(token)
+        if usuario is None:
+            return 401, {"error": "Inicie sesión con POST /sesion y envíe el token en Authorization"}
+        if ruta == ["sesion"]:
+            if metodo != "DELETE":
+                return 405, {"error": "Método no permitido"}
+            with self.lock_sesiones:
+                self.sesiones.pop(token, None)
+            return 200, {"usuario": usuario}
+        
+        if ruta == ["metricas"] and metodo == "GET":
+            if usuario not in USUARIOS_ADMIN:
+                return 403, {"error": "Solo un administrador puede ver las métricas"}
+            return 200, METRICAS.resumen()
+        
+        if ruta == ["lote"] and metodo == "POST":
+            operaciones = datos.get("operaciones")
+            if not isinstance(operaciones, list):
+                return 400, {"error": "Falta la lista de operaciones"}
+            resultados = []
+            for operacion in operaciones:
+                estado, respuesta = self.ejecutar_operacion(operacion, usuario)
+                resultados.append({"estado": estado, **respuesta})
+            return 200, {"resultados": resultados}
+        
+        rutas = {
+            ("GET", "citas", False): "listar",
+            ("POST", "citas", False): "agendar",
+            ("GET", "citas", True): "obtener",
+            ("PATCH", "citas", True): "reprogramar",
+            ("PUT", "citas", True): "reprogramar",
+            ("DELETE", "citas", True): "eliminar",
+            ("GET", "consulta", False): "consultar",
+            ("GET", "libres", False): "libres",
+            ("GET", "historial", False): "historial",
+            ("POST", "asistencia", True): "asistencia",
+            ("GET", "informes", True): "informe",
+            ("POST", "deshacer", False): "deshacer",
+            ("POST", "rehacer", False): "rehacer",
+            ("GET", "auditoria", False): "auditoria",
+            ("GET", "recordatorios", False): "recordatorios",
+        }
+        if not ruta or len(ruta) > 2:
+            return 404, {"error": "Ruta desconocida"}
+        clave = (metodo, ruta[0], len(ruta) == 2)
+        if clave not in rutas:
+            conocida = any(r[1:] == clave[1:] for r in rutas)
+            return (405, {"error": "Método no permitido"}) if conocida else (404, {"error": "Ruta desconocida"})
+        
+        operacion = {**parametros, **datos, "op": rutas[clave]}
+        if len(ruta) == 2:
+            operacion["id"] = ruta[1]
+        return self.ejecutar_operacion(operacion, usuario)
+    
+    def ejecutar_operacion(self, operacion, usuario):
+        """Ejecutar {"op": ..., ...} a nombre del usuario de la sesión; devuelve (estado HTTP, respuesta)"""
+        servicio = self.servicio
+        op = operacion.get("op") if isinstance(operacion, dict) else None
+        try:
+            if op == "agendar":
+                cita = servicio.agendar(operacion.get("paciente", ""), operacion.get("fecha", ""),
+                                        operacion.get("hora", ""), operacion.get("doctor", ""),
+                                        operacion.get("duracion", DURACION_CITA),
+                                        operacion.get("motivo", ""), usuario=usuario)
+                return 201, {"cita": cita_json(cita)}
+            if op == "reprogramar":
+                actual = servicio.obtener(operacion.get("id"))
+                cita = servicio.reprogramar(operacion["id"],
+                                            operacion.get("fecha", actual["Fecha"]),
+                                            operacion.get("hora", actual["Hora"]),
+                                            operacion.get("doctor"), operacion.get("duracion"),
+                                            operacion.get("motivo"), version=operacion.get("version"),
+                                            usuario=usuario)
+                return 200, {"cita": cita_json(cita)}
+            if op == "eliminar":
+                servicio.eliminar(operacion.get("id"), version=operacion.get("version"), usuario=usuario)
+                return 200, {"id": operacion["id"]}
+            if op == "obtener":
+                return 200, {"cita": cita_json(servicio.obtener(operacion.get("id")))}
+            if op == "listar":
+                servicio.exigir_carga()
+                desde, limite = self.pagina(operacion)
+                citas = servicio.listar(desde, limite)
+                return 200, {"total": len(servicio.registro),
+                             "citas": [cita_json(cita) for cita in citas]}
+            if op == "consultar":
+                servicio.exigir_carga()
+                ids = servicio.consultar(
+                    paciente=operacion.get("paciente", ""), motivo=operacion.get("motivo", ""),
+                    estado=operacion.get("estado") or None,
+                    desde=self.fecha(operacion.get("desde_fecha")),
+                    hasta=self.fecha(operacion.get("hasta_fecha")),
+                    orden=operacion.get("orden") or None,
+                    descendente=self.booleano(operacion, "descendente", False))
+                desde, limite = self.pagina(operacion)
+                pagina = ids[desde:] if limite is None else ids[desde:desde + limite]
+                return 200, {"total": len(ids),
+                             "citas": [cita_json(servicio.obtener(i)) for i in pagina]}
+            if op == "libres":
+                servicio.exigir_carga()
+                libres = servicio.horarios_libres(operacion.get("doctor", ""), operacion.get("fecha", ""),
+                                                  operacion.get("duracion", DURACION_CITA),
+                                                  int(operacion.get("n", 5)))
+                return 200, {"libres": [minutos_a_hora(m) for m in libres]}
+            if op == "asistencia":
+                cita = servicio.registrar_asistencia(operacion.get("id"), self.booleano(operacion, "asistio", True),
+                                                     version=operacion.get("version"), usuario=usuario)
+                return 200, {"cita": cita_json(cita)}
+            if op == "informe":
+                servicio.exigir_carga()
+                if operacion.get("id") == "dia":
+                    fecha = self.fecha_requerida(operacion, "fecha")
+                    desde = hasta = fecha
+                elif operacion.get("id") == "doctor":
+                    desde = self.fecha_requerida(operacion, "desde_fecha")
+                    hasta = self.fecha_requerida(operacion, "hasta_fecha")
+                else:
+                    return 404, {"error": "Informe desconocido"}
+                servicio.esperar_es(lambda: servicio.resumir_archivo(desde, hasta))
+                if operacion["id"] == "dia":
+                    return 200, servicio.informe_dia(fecha)
+                return 200, servicio.informe_doctor(operacion.get("doctor", ""), desde, hasta)
+            if op in ("deshacer", "rehacer"):
+                entrada = servicio.rehacer(usuario) if op == "rehacer" else servicio.deshacer(usuario)
+                return 200, {"operacion": entrada}
+            if op == "auditoria":
+                if usuario not in USUARIOS_ADMIN:
+                    return 403, {"error": "Solo un administrador puede ver la bitácora"}
+                desde, limite = self.pagina(operacion)
+                return 200, {"operaciones": servicio.auditoria.ultimas(desde, 100 if limite is None else limite)}
+            if op == "recordatorios":
+                if self.recordatorios is None:
+                    return 404, {"error": "Los recordatorios están desactivados"}
+                _, limite = self.pagina(operacion)
+                proximos = self.recordatorios.proximos(20 if limite is None else limite)
+                return 200, {"recordatorios": [{"momento": momento, "tipo": tipo, "cita": cita_json(cita)}
+                                               for momento, tipo, cita in proximos]}
+            if op == "historial":
+                filtros = dict(paciente=operacion.get("paciente", ""), motivo=operacion.get("motivo", ""),
+                               estado=operacion.get("estado") or None,
+                               desde=self.fecha(operacion.get("desde_fecha")),
+                               hasta=self.fecha(operacion.get("hasta_fecha")))
+                citas = servicio.esperar_es(lambda: servicio.consultar_historial(**filtros))
+                desde, limite = self.pagina(operacion)
+                pagina = citas[desde:] if limite is None else citas[desde:desde + limite]
+                return 200, {"total": len(citas), "citas": [cita_json(cita) for cita in pagina]}
+            return 400, {"error": f"Operación desconocida: {op}"}
+        except HorarioOcupado as error:
+            return error.estado_http, {"error": str(error),
+                                       "libres": [minutos_a_hora(m) for m in error.libres]}
+        except ErrorCita as error:
+            return error.estado_http, {"error": str(error)}
+        except ConflictoCita as error:
+            return 409, {"error": str(error)}
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            return 400, {"error": f"Datos inválidos: {error}"}
+    
+    def pagina(self, operacion):
+        """Inicio y límite de una página de resultados"""
+        limite = operacion.get("limite")
+        return int(operacion.get("desde", 0)), None if limite is None else int(limite)
+    
+    def booleano(self, operacion, campo, defecto):
+        """Valor sí/no de un parámetro (JSON o texto de la URL); otro valor es un error 400"""
+        valor = operacion.get(campo, defecto)
+        if isinstance(valor, bool):
+            return valor
+        texto = str(valor).strip().lower()
+        if texto in ("1", "true", "si", "sí"):
+            return True
+        if texto in ("0", "false", "no", ""):
+            return False
+        raise ErrorCita(f"Valor no válido para {campo}: {valor} (use true o false)")
+    
+    def fecha(self, texto):
+        """Fecha YYYY-MM-DD de un filtro, o None"""
+        return datetime.strptime(texto, "%Y-%m-%d") if texto else None
+    
+    def fecha_requerida(self, operacion, campo):
+        """Texto YYYY-MM-DD de un parámetro obligatorio; si falta o no es una fecha, error 400"""
+        try:
+            fecha = self.fecha(operacion.get(campo))
+        except (TypeError, ValueError):
+            fecha = None
+        if fecha is None:
+            raise ErrorCita(f"{campo} requerida (YYYY-MM-DD)")
+        return fecha.strftime("%Y-%m-%d")
+
 
 class SistemaCitasMedicas:
     def __init__(self):
         # Archivos del sistema
         self.archivo_citas = "citas_medicas.xlsx"
         self.archivo_usuarios = "usuarios.json"
+        self.usuarios = AlmacenUsuarios(self.archivo_usuarios)
+        self.tipo_almacenamiento = "diario"
+        
+        # La ventana es un cliente más del servicio; sus eventos llegan por
+        # una cola porque pueden originarse en otros hilos (E/S, recordatorios)
+        self.servicio = ServicioCitas(ALMACENAMIENTOS[self.tipo_almacenamiento](self.archivo_citas))
+        self.eventos = queue.Queue()
+        self.servicio.suscribir(lambda evento, datos: self.eventos.put((evento, datos)))
         
         # Variables de sesión
         self.usuario_actual = None
-        self.df = None
+        self.usuario_login = None
+        self.ventana_principal = False
+        self.panel_rendimiento = None
+        self.ventana_historial = None
+        self.cita_seleccionada = None
         
         # Configuración inicial
         self.inicializar_archivos()
+        self.recordatorios = iniciar_recordatorios(self.servicio)
+        self.servicio.cargar()
         self.crear_ventana_login()
     
     def inicializar_archivos(self):
         """Crear archivos necesarios si no existen"""
-        # Archivo de citas
-        if not os.path.exists(self.archivo_citas):
-            df_vacio = pd.DataFrame(columns=["Paciente", "Fecha", "Hora", "Motivo", "Estado"])
-            df_vacio.to_excel(self.archivo_citas, index=False)
+        # El archivo de citas se prepara en el hilo de E/S al cargar
         
         # Archivo de usuarios con usuario por defecto
-        if not os.path.exists(self.archivo_usuarios):
-            usuarios_default = {
-                "admin": {
-                    "password": self.hash_password("admin123"),
-                    "nombre": "Administrador"
-                },
-                "doctor": {
-                    "password": self.hash_password("doctor123"),
-                    "nombre": "Dr. García"
-                }
+        self.usuarios.inicializar({
+            "admin": {
+                "password": "admin123",
+                "nombre": "Administrador"
+            },
+            "doctor": {
+                "password": "doctor123",
+                "nombre": "Dr. García"
             }
-            with open(self.archivo_usuarios, 'w') as f:
-                json.dump(usuarios_default, f, indent=4)
-    
-    def hash_password(self, password):
-        """Encriptar contraseña"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        })
     
     def verificar_credenciales(self, usuario, password):
         """Verificar login del usuario"""
-        try:
-            with open(self.archivo_usuarios, 'r') as f:
-                usuarios = json.load(f)
-            
-            if usuario in usuarios:
-                password_hash = self.hash_password(password)
-                if usuarios[usuario]["password"] == password_hash:
-                    return usuarios[usuario]["nombre"]
-            return None
-        except:
-            return None
+        return self.usuarios.verificar(usuario, password)
     
     def crear_ventana_login(self):
         """Crear ventana de login"""
@@ -110,8 +3966,17 @@ class SistemaCitasMedicas:
         # Bind Enter key
         self.entry_password.bind('<Return>', lambda e: self.login())
         
+        # Importar pandas/openpyxl mientras el usuario escribe sus datos
+        self.login_window.after(100, lambda: self.servicio.trabajador.enviar(self.precargar_modulos))
+        self.login_window.after(100, self.revisar_es, self.login_window)
+        
         self.login_window.mainloop()
     
+    def precargar_modulos(self):
+        """Importar en el hilo de E/S los módulos pesados"""
+        pd.cargar()
+        importlib.import_module("openpyxl")
+    
     def centrar_ventana(self, ventana, ancho, alto):
         """Centrar ventana en la pantalla"""
         screen_width = ventana.winfo_screenwidth()
@@ -129,9 +3994,16 @@ class SistemaCitasMedicas:
             messagebox.showerror("Error", "Complete todos los campos")
             return
         
-        nombre_usuario = self.verificar_credenciales(usuario, password)
+        try:
+            nombre_usuario = self.verificar_credenciales(usuario, password)
+        except AccesoBloqueado as error:
+            messagebox.showerror("Error", str(error))
+            self.entry_password.delete(0, tk.END)
+            return
         if nombre_usuario:
             self.usuario_actual = nombre_usuario
+            self.usuario_login = usuario
+            self.servicio.usuario = nombre_usuario
             self.login_window.destroy()
             self.crear_ventana_principal()
         else:
@@ -144,20 +4016,131 @@ class SistemaCitasMedicas:
         self.root.title(f"Sistema de Citas Médicas - {self.usuario_actual}")
         self.root.geometry("1200x700")
         self.root.configure(bg='#ecf0f1')
+        self.panel_rendimiento = None
+        self.ventana_historial = None
         
         # Centrar ventana
         self.centrar_ventana(self.root, 1200, 700)
         
-        # Cargar datos
-        self.df = pd.read_excel(self.archivo_citas)
+        with METRICAS.medir("carga.ventana"):
+            self.crear_header()
+            
+            # Pestañas: gestión de citas y tablero de estadísticas
+            self.pestanas = ttk.Notebook(self.root)
+            self.pestanas.pack(fill='both', expand=True)
+            pestana_citas = tk.Frame(self.pestanas, bg='#ecf0f1')
+            self.pestana_tablero = tk.Frame(self.pestanas, bg='#ecf0f1')
+            self.pestanas.add(pestana_citas, text="📋 Citas")
+            self.pestanas.add(self.pestana_tablero, text="📈 Tablero")
+            
+            self.crear_formulario(pestana_citas)
+            self.crear_tabla(pestana_citas)
+            self.crear_tablero(self.pestana_tablero)
+            self.pestanas.bind('<<NotebookTabChanged>>', lambda e: self.programar_tablero())
+        self.root.protocol("WM_DELETE_WINDOW", self.cerrar_aplicacion)
+        self.root.bind('<Control-P>', self.mostrar_panel_rendimiento)
+        self.root.bind('<Control-z>', lambda e: self.deshacer())
+        self.root.bind('<Control-y>', lambda e: self.rehacer())
         
-        self.crear_header()
-        self.crear_formulario()
-        self.crear_tabla()
-        self.actualizar_tabla()
+        # Las citas se leen en segundo plano; los botones se habilitan al terminar
+        self.ventana_principal = True
+        if self.servicio.cargado:
+            self.on_datos_cargados()
+        else:
+            self.habilitar_botones(False)
+            self.mostrar_estado_es("⏳ Cargando citas…")
+        self.root.after(100, self.revisar_es, self.root)
         
         self.root.mainloop()
     
+    @medido("carga.mostrar")
+    def on_datos_cargados(self):
+        """Mostrar las citas cargadas y habilitar la edición"""
+        self.combo_doctor.config(values=self.nombres_doctores())
+        self.actualizar_tabla()
+        self.programar_tablero()
+        self.habilitar_botones(True)
+        self.mostrar_estado_es("")
+    
+    def on_error_carga(self, error):
+        """Avisar que no se pudieron leer las citas"""
+        self.mostrar_estado_es("⚠️ Error al cargar")
+        messagebox.showerror("Error", f"No se pudieron cargar las citas:\n{error}")
+    
+    def revisar_es(self, ventana):
+        """Atender al servicio y a sus eventos sin bloquear el mainloop"""
+        self.servicio.atender()
+        self.procesar_eventos()
+        ventana.after(100, self.revisar_es, ventana)
+    
+    def procesar_eventos(self):
+        """Reflejar en la ventana los eventos pendientes del servicio"""
+        while True:
+            try:
+                evento, datos = self.eventos.get_nowait()
+            except queue.Empty:
+                return
+            if not self.ventana_principal:
+                # Sin ventana principal no hay nada que actualizar
+                continue
+            if evento == "cambios":
+                self.reflejar_cambios(datos)
+                self.programar_tablero()
+                self.actualizar_botones_deshacer()
+            elif evento == "estadisticas":
+                self.programar_tablero()
+            elif evento == "cargando":
+                self.habilitar_botones(False)
+                self.mostrar_estado_es("⏳ Cargando citas…")
+            elif evento == "cargado":
+                self.on_datos_cargados()
+            elif evento == "error_carga":
+                self.on_error_carga(datos)
+            elif evento in ("guardando", "exportando"):
+                self.mostrar_estado_es("📤 Exportando…" if evento == "exportando" else "💾 Guardando…")
+            elif evento == "importando":
+                self.mostrar_estado_es("📥 Importando…")
+            elif evento == "importado":
+                self.on_importado(datos)
+            elif evento == "error_importacion":
+                self.mostrar_estado_es("⚠️ Error al importar")
+                messagebox.showerror("Error", f"No se pudo importar el archivo:\n{datos}")
+            elif evento == "guardado":
+                self.mostrar_estado_es("✔️ Guardado")
+            elif evento == "exportado":
+                destino, total = datos
+                self.mostrar_estado_es("✔️ Guardado")
+                messagebox.showinfo("Éxito", f"{total} citas exportadas a {destino} (con el historial)")
+            elif evento == "conflicto":
+                self.mostrar_estado_es("⚠️ Conflicto")
+                messagebox.showwarning("Conflicto", f"{datos}\nSe muestran los datos actuales de la cita.")
+            elif evento == "error_guardado":
+                self.mostrar_estado_es("⚠️ Error al guardar")
+                messagebox.showerror("Error", f"No se pudo guardar la cita:\n{datos}")
+            elif evento == "sin_sincronizar":
+                self.mostrar_estado_es("⚠️ Sin sincronizar")
+            elif evento == "buscando_historial":
+                self.mostrar_estado_es("📚 Buscando en el historial…")
+            elif evento == "historial":
+                self.mostrar_estado_es("")
+                self.mostrar_historial(datos)
+            elif evento == "error_historial":
+                self.mostrar_estado_es("⚠️ Error en el historial")
+                messagebox.showerror("Error", f"No se pudo leer el historial:\n{datos}")
+            elif evento == "recordatorio":
+                self.mostrar_estado_es(f"🔔 Recordatorio a {datos['paciente']}")
+            elif evento == "error_recordatorio":
+                self.mostrar_estado_es("⚠️ Error al enviar recordatorios")
+    
+    def mostrar_estado_es(self, texto):
+        """Indicador de guardado/carga en el encabezado"""
+        self.label_estado_es.config(text=texto)
+    
+    def habilitar_botones(self, habilitar):
+        """Activar o desactivar los botones que modifican citas"""
+        for boton in self.botones_citas:
+            boton.config(state='normal' if habilitar else 'disabled')
+    
     def crear_header(self):
         """Crear header con título y botón de logout"""
         header_frame = tk.Frame(self.root, bg='#2c3e50', height=60)
@@ -173,6 +4156,19 @@ class SistemaCitasMedicas:
         user_frame = tk.Frame(header_frame, bg='#2c3e50')
         user_frame.pack(side='right', padx=20, pady=15)
         
+        self.label_estado_es = tk.Label(user_frame, text="", font=("Arial", 10),
+                                        bg='#2c3e50', fg='#bdc3c7')
+        self.label_estado_es.pack(side='left', padx=10)
+        
+        self.btn_deshacer = tk.Button(user_frame, text="↩️ Deshacer", command=self.deshacer,
+                                      bg='#34495e', fg='white', font=("Arial", 9, "bold"),
+                                      padx=8, relief='flat', state='disabled')
+        self.btn_deshacer.pack(side='left', padx=2)
+        self.btn_rehacer = tk.Button(user_frame, text="↪️ Rehacer", command=self.rehacer,
+                                     bg='#34495e', fg='white', font=("Arial", 9, "bold"),
+                                     padx=8, relief='flat', state='disabled')
+        self.btn_rehacer.pack(side='left', padx=2)
+        
         tk.Label(user_frame, text=f"👤 {self.usuario_actual}",
                 font=("Arial", 12), bg='#2c3e50', fg='white').pack(side='left', padx=10)
         
@@ -181,9 +4177,9 @@ class SistemaCitasMedicas:
                               padx=15, pady=5, relief='flat')
         btn_logout.pack(side='right')
     
-    def crear_formulario(self):
+    def crear_formulario(self, padre):
         """Crear formulario de citas"""
-        form_frame = tk.Frame(self.root, bg='white', relief='solid', bd=1)
+        form_frame = tk.Frame(padre, bg='white', relief='solid', bd=1)
         form_frame.pack(fill='x', padx=20, pady=10)
         
         # Título del formulario
@@ -226,12 +4222,38 @@ class SistemaCitasMedicas:
         self.entry_motivo = tk.Entry(fila2, font=("Arial", 10), width=25)
         self.entry_motivo.pack(side='left', padx=5)
         
+        # Tercera fila
+        fila3 = tk.Frame(campos_frame, bg='white')
+        fila3.pack(fill='x', pady=5)
+        
+        tk.Label(fila3, text="🩺 Doctor:", font=("Arial", 10), 
+                bg='white', fg='#34495e', width=12, anchor='e').pack(side='left', padx=5)
+        self.combo_doctor = ttk.Combobox(fila3, font=("Arial", 10), width=18,
+                                         values=self.nombres_doctores())
+        self.combo_doctor.pack(side='left', padx=5)
+        
+        tk.Label(fila3, text="⏱️ Duración:", font=("Arial", 10), 
+                bg='white', fg='#34495e', width=12, anchor='e').pack(side='left', padx=5)
+        self.spin_duracion = tk.Spinbox(fila3, from_=5, to=240, increment=5,
+                                        font=("Arial", 10), width=5)
+        self.spin_duracion.pack(side='left', padx=5)
+        self.spin_duracion.delete(0, tk.END)
+        self.spin_duracion.insert(0, DURACION_CITA)
+        
+        btn_libres = tk.Button(fila3, text="🔍 Próximos libres", command=self.mostrar_horarios_libres,
+                              bg='#16a085', fg='white', font=("Arial", 9, "bold"),
+                              padx=10, relief='flat')
+        btn_libres.pack(side='left', padx=10)
+        
         # Instrucciones de formato
         instrucciones_frame = tk.Frame(campos_frame, bg='white')
         instrucciones_frame.pack(fill='x', pady=5)
         
         tk.Label(instrucciones_frame, text="💡 Formatos de hora válidos: 9:00 AM, 2:30 PM, 14:30, 08:15", 
                 font=("Arial", 8), bg='white', fg='#7f8c8d').pack()
+        self.label_libres = tk.Label(instrucciones_frame, text="", 
+                                     font=("Arial", 8), bg='white', fg='#16a085')
+        self.label_libres.pack()
         
         # Botones
         botones_frame = tk.Frame(form_frame, bg='white')
@@ -252,43 +4274,308 @@ class SistemaCitasMedicas:
                                 padx=20, pady=8, relief='flat')
         btn_eliminar.pack(side='left', padx=5)
         
+        btn_asistio = tk.Button(botones_frame, text="✔️ Asistió", command=lambda: self.registrar_asistencia(True),
+                               bg='#2980b9', fg='white', font=("Arial", 10, "bold"),
+                               padx=12, pady=8, relief='flat')
+        btn_asistio.pack(side='left', padx=5)
+        
+        btn_ausente = tk.Button(botones_frame, text="🚫 No asistió", command=lambda: self.registrar_asistencia(False),
+                               bg='#7f8c8d', fg='white', font=("Arial", 10, "bold"),
+                               padx=12, pady=8, relief='flat')
+        btn_ausente.pack(side='left', padx=5)
+        
         btn_limpiar = tk.Button(botones_frame, text="🧹 Limpiar", command=self.limpiar_formulario,
                                bg='#95a5a6', fg='white', font=("Arial", 10, "bold"),
                                padx=20, pady=8, relief='flat')
         btn_limpiar.pack(side='left', padx=5)
+        
+        btn_exportar = tk.Button(botones_frame, text="📤 Exportar", command=self.exportar_citas,
+                                bg='#3498db', fg='white', font=("Arial", 10, "bold"),
+                                padx=20, pady=8, relief='flat')
+        btn_exportar.pack(side='left', padx=5)
+        
+        btn_importar = tk.Button(botones_frame, text="📥 Importar", command=self.importar_citas,
+                                bg='#8e44ad', fg='white', font=("Arial", 10, "bold"),
+                                padx=20, pady=8, relief='flat')
+        btn_importar.pack(side='left', padx=5)
+        
+        self.botones_citas = [btn_agendar, btn_reprogramar, btn_eliminar, btn_asistio, btn_ausente,
+                              btn_exportar, btn_importar]
     
-    def crear_tabla(self):
+    def crear_tabla(self, padre):
         """Crear tabla de citas"""
-        tabla_frame = tk.Frame(self.root, bg='white', relief='solid', bd=1)
+        tabla_frame = tk.Frame(padre, bg='white', relief='solid', bd=1)
         tabla_frame.pack(fill='both', expand=True, padx=20, pady=10)
         
         # Título de la tabla
         tk.Label(tabla_frame, text="📊 Lista de Citas", 
                 font=("Arial", 14, "bold"), bg='white', fg='#2c3e50').pack(pady=10)
         
+        self.crear_filtros(tabla_frame)
+        
         # Frame para tabla y scrollbar
         tree_frame = tk.Frame(tabla_frame, bg='white')
         tree_frame.pack(fill='both', expand=True, padx=10, pady=10)
         
-        # Tabla
-        columnas = ["Paciente", "Fecha", "Hora", "Motivo", "Estado"]
-        self.tabla = ttk.Treeview(tree_frame, columns=columnas, show="headings", height=15)
+        # Tabla (con su propia barra de desplazamiento virtual)
+        columnas = COLUMNAS_TABLA
+        self.tabla = TablaVirtual(tree_frame, columnas, self.valores_fila, height=15)
         
-        # Configurar columnas
+        # Configurar columnas (clic en el encabezado para ordenar)
         for col in columnas:
-            self.tabla.heading(col, text=col)
-            self.tabla.column(col, width=200 if col == "Motivo" else 150, anchor='center')
-        
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tabla.yview)
-        self.tabla.configure(yscrollcommand=scrollbar.set)
+            self.tabla.tree.heading(col, text=col, command=lambda c=col: self.ordenar_por(c))
+            self.tabla.tree.column(col, width=200 if col == "Motivo" else 140, anchor='center')
         
         # Posicionar tabla y scrollbar
-        self.tabla.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        self.tabla.tree.pack(side='left', fill='both', expand=True)
+        self.tabla.scrollbar.pack(side='right', fill='y')
         
         # Event binding para selección
-        self.tabla.bind('<<TreeviewSelect>>', self.seleccionar_fila)
+        self.tabla.tree.bind('<<TreeviewSelect>>', self.seleccionar_fila)
+    
+    def crear_filtros(self, padre):
+        """Crear barra de búsqueda y filtros de la tabla"""
+        filtros_frame = tk.Frame(padre, bg='white')
+        filtros_frame.pack(fill='x', padx=10)
+        
+        self.orden_tabla = None
+        self.orden_descendente = False
+        self.filtro_programado = None
+        
+        tk.Label(filtros_frame, text="🔎 Paciente:", font=("Arial", 9), 
+                bg='white', fg='#34495e').pack(side='left', padx=(0, 3))
+        self.filtro_paciente = tk.Entry(filtros_frame, font=("Arial", 9), width=16)
+        self.filtro_paciente.pack(side='left', padx=3)
+        
+        tk.Label(filtros_frame, text="Desde:", font=("Arial", 9), 
+                bg='white', fg='#34495e').pack(side='left', padx=3)
+        self.filtro_desde = tk.Entry(filtros_frame, font=("Arial", 9), width=11)
+        self.filtro_desde.pack(side='left', padx=3)
+        
+        tk.Label(filtros_frame, text="Hasta:", font=("Arial", 9), 
+                bg='white', fg='#34495e').pack(side='left', padx=3)
+        self.filtro_hasta = tk.Entry(filtros_frame, font=("Arial", 9), width=11)
+        self.filtro_hasta.pack(side='left', padx=3)
+        
+        tk.Label(filtros_frame, text="Estado:", font=("Arial", 9), 
+                bg='white', fg='#34495e').pack(side='left', padx=3)
+        self.filtro_estado = ttk.Combobox(filtros_frame, font=("Arial", 9), width=13,
+                                          values=["Todos"] + ESTADOS_CITA, state='readonly')
+        self.filtro_estado.set("Todos")
+        self.filtro_estado.pack(side='left', padx=3)
+        
+        tk.Label(filtros_frame, text="Motivo:", font=("Arial", 9), 
+                bg='white', fg='#34495e').pack(side='left', padx=3)
+        self.filtro_motivo = tk.Entry(filtros_frame, font=("Arial", 9), width=16)
+        self.filtro_motivo.pack(side='left', padx=3)
+        
+        tk.Button(filtros_frame, text="✖ Limpiar filtros", command=self.limpiar_filtros,
+                 bg='#95a5a6', fg='white', font=("Arial", 8, "bold"),
+                 padx=8, relief='flat').pack(side='left', padx=8)
+        
+        tk.Button(filtros_frame, text="📚 Historial", command=self.buscar_historial,
+                 bg='#16a085', fg='white', font=("Arial", 8, "bold"),
+                 padx=8, relief='flat').pack(side='left')
+        
+        self.label_resultados = tk.Label(filtros_frame, text="", font=("Arial", 9), 
+                                         bg='white', fg='#7f8c8d')
+        self.label_resultados.pack(side='right', padx=3)
+        
+        # Resultados en vivo mientras se escribe
+        for entry in (self.filtro_paciente, self.filtro_desde, self.filtro_hasta, self.filtro_motivo):
+            entry.bind('<KeyRelease>', self.programar_filtro)
+        self.filtro_estado.bind('<<ComboboxSelected>>', self.programar_filtro)
+    
+    def crear_tablero(self, padre):
+        """Crear la pestaña de tablero: agenda del día por doctor y resumen por día de un doctor"""
+        self.tablero_programado = None
+        self.rango_tablero = None
+        hoy = datetime.now()
+        
+        controles_frame = tk.Frame(padre, bg='white', relief='solid', bd=1)
+        controles_frame.pack(fill='x', padx=20, pady=10)
+        
+        tk.Label(controles_frame, text="📈 Tablero de Citas", 
+                font=("Arial", 14, "bold"), bg='white', fg='#2c3e50').pack(pady=10)
+        
+        fila = tk.Frame(controles_frame, bg='white')
+        fila.pack(pady=(0, 10))
+        
+        tk.Label(fila, text="📅 Día:", font=("Arial", 10), 
+                bg='white', fg='#34495e').pack(side='left', padx=5)
+        self.entry_tablero_fecha = tk.Entry(fila, font=("Arial", 10), width=11)
+        self.entry_tablero_fecha.insert(0, hoy.strftime("%Y-%m-%d"))
+        self.entry_tablero_fecha.pack(side='left', padx=5)
+        
+        tk.Label(fila, text="🩺 Doctor:", font=("Arial", 10), 
+                bg='white', fg='#34495e').pack(side='left', padx=(20, 5))
+        self.combo_tablero_doctor = ttk.Combobox(fila, font=("Arial", 10), width=18,
+                                                 postcommand=self.actualizar_doctores_tablero)
+        self.combo_tablero_doctor.pack(side='left', padx=5)
+        
+        tk.Label(fila, text="Desde:", font=("Arial", 10), 
+                bg='white', fg='#34495e').pack(side='left', padx=5)
+        self.entry_tablero_desde = tk.Entry(fila, font=("Arial", 10), width=11)
+        self.entry_tablero_desde.insert(0, (hoy - timedelta(days=30)).strftime("%Y-%m-%d"))
+        self.entry_tablero_desde.pack(side='left', padx=5)
+        
+        tk.Label(fila, text="Hasta:", font=("Arial", 10), 
+                bg='white', fg='#34495e').pack(side='left', padx=5)
+        self.entry_tablero_hasta = tk.Entry(fila, font=("Arial", 10), width=11)
+        self.entry_tablero_hasta.insert(0, (hoy + timedelta(days=30)).strftime("%Y-%m-%d"))
+        self.entry_tablero_hasta.pack(side='left', padx=5)
+        
+        for entry in (self.entry_tablero_fecha, self.entry_tablero_desde, self.entry_tablero_hasta):
+            entry.bind('<KeyRelease>', self.programar_tablero)
+        self.combo_tablero_doctor.bind('<<ComboboxSelected>>', self.programar_tablero)
+        self.combo_tablero_doctor.bind('<KeyRelease>', self.programar_tablero)
+        
+        # Agenda del día: una fila por doctor, ocupación por hora
+        horas = range(HORARIO_ATENCION[0] // 60, (HORARIO_ATENCION[1] + 59) // 60)
+        columnas_dia = ("Doctor", "Citas", *ESTADOS_CITA, "% Ausencias", *(f"{hora:02d}h" for hora in horas))
+        self.label_tablero_dia, self.arbol_tablero_dia = self.crear_arbol_tablero(padre, columnas_dia)
+        
+        # Un doctor, día por día
+        columnas_doctor = ("Fecha", "Citas", *ESTADOS_CITA, "% Ausencias", "% Ocupación")
+        self.label_tablero_doctor, self.arbol_tablero_doctor = self.crear_arbol_tablero(padre, columnas_doctor)
+    
+    def crear_arbol_tablero(self, padre, columnas):
+        """Sección del tablero con título y tabla; devuelve la etiqueta y la tabla"""
+        frame = tk.Frame(padre, bg='white', relief='solid', bd=1)
+        frame.pack(fill='both', expand=True, padx=20, pady=(0, 10))
+        
+        etiqueta = tk.Label(frame, text="", font=("Arial", 11, "bold"), bg='white', fg='#2c3e50')
+        etiqueta.pack(pady=5)
+        
+        arbol = ttk.Treeview(frame, columns=columnas, show="headings", height=6)
+        for columna in columnas:
+            arbol.heading(columna, text=columna)
+            ancho = 150 if columna in ("Doctor", "Fecha") else 90 if columna in ESTADOS_CITA else 60
+            arbol.column(columna, width=ancho, anchor='w' if columna in ("Doctor", "Fecha") else 'center')
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=arbol.yview)
+        arbol.configure(yscrollcommand=scrollbar.set)
+        arbol.pack(side='left', fill='both', expand=True, padx=(10, 0), pady=(0, 10))
+        scrollbar.pack(side='right', fill='y', pady=(0, 10))
+        return etiqueta, arbol
+    
+    def actualizar_doctores_tablero(self):
+        """Doctores para el selector del tablero"""
+        self.combo_tablero_doctor.config(values=self.nombres_doctores())
+    
+    def programar_tablero(self, event=None):
+        """Agrupar cambios seguidos en un solo refresco del tablero (si está a la vista)"""
+        if str(self.pestanas.select()) != str(self.pestana_tablero):
+            return
+        if self.tablero_programado is not None:
+            self.root.after_cancel(self.tablero_programado)
+        self.tablero_programado = self.root.after(100, self.actualizar_tablero)
+    
+    @medido("ui.tablero")
+    def actualizar_tablero(self):
+        """Mostrar los agregados del día y del doctor elegidos"""
+        self.tablero_programado = None
+        fecha = self.leer_fecha_filtro(self.entry_tablero_fecha)
+        desde = self.leer_fecha_filtro(self.entry_tablero_desde)
+        hasta = self.leer_fecha_filtro(self.entry_tablero_hasta)
+        if fecha is None or desde is None or hasta is None or not self.servicio.cargado:
+            return
+        fecha, desde, hasta = (valor.strftime("%Y-%m-%d") for valor in (fecha, desde, hasta))
+        
+        # Los meses archivados del rango se resumen aparte; al llegar se repite
+        rango = (min(fecha, desde), max(fecha, hasta))
+        if rango != self.rango_tablero:
+            self.rango_tablero = rango
+            self.servicio.preparar_informes(*rango)
+        
+        informe = self.servicio.informe_dia(fecha)
+        self.llenar_arbol_tablero(self.arbol_tablero_dia, informe, nombre_vacio="(sin doctor)", horas=True)
+        self.label_tablero_dia.config(text=f"📅 Agenda del {fecha}: {informe['total']['total']} citas, "
+                                           f"ausencias {self.porcentaje(informe['total']['ausencias'])}")
+        
+        doctor = self.combo_tablero_doctor.get().strip()
+        informe = self.servicio.informe_doctor(doctor, desde, hasta)
+        self.llenar_arbol_tablero(self.arbol_tablero_doctor, informe)
+        self.label_tablero_doctor.config(
+            text=f"🩺 {doctor or '(sin doctor)'} del {desde} al {hasta}: {informe['total']['total']} citas, "
+                 f"ausencias {self.porcentaje(informe['total']['ausencias'])}")
+    
+    def llenar_arbol_tablero(self, arbol, informe, nombre_vacio="", horas=False):
+        """Reemplazar las filas de una tabla del tablero (son pocas: doctores o días)"""
+        arbol.delete(*arbol.get_children())
+        for clave, datos in informe["filas"].items():
+            valores = [clave or nombre_vacio, datos["total"],
+                       *(datos["estados"].get(estado, 0) for estado in ESTADOS_CITA),
+                       self.porcentaje(datos["ausencias"])]
+            if horas:
+                valores += [self.porcentaje(ocupacion) for ocupacion in datos["ocupacion"].values()]
+            else:
+                valores.append(self.porcentaje(datos["ocupacion_dia"]))
+            arbol.insert("", "end", values=valores)
+    
+    def porcentaje(self, valor):
+        """Proporción como porcentaje, o guion si no hay datos"""
+        return "—" if valor is None else f"{valor:.0%}"
+    
+    def leer_fecha_filtro(self, entry):
+        """Fecha de un campo de filtro, o None si está vacío o incompleto"""
+        try:
+            return datetime.strptime(entry.get().strip(), "%Y-%m-%d")
+        except ValueError:
+            return None
+    
+    def filtros_activos(self):
+        """Si hay algún filtro u orden aplicado a la tabla"""
+        return bool(self.filtro_paciente.get().strip() or self.filtro_motivo.get().strip()
+                    or self.filtro_estado.get() != "Todos"
+                    or self.leer_fecha_filtro(self.filtro_desde)
+                    or self.leer_fecha_filtro(self.filtro_hasta)
+                    or self.orden_tabla)
+    
+    def programar_filtro(self, event=None):
+        """Agrupar pulsaciones seguidas en una sola consulta"""
+        if self.filtro_programado is not None:
+            self.root.after_cancel(self.filtro_programado)
+        self.filtro_programado = self.root.after(30, self.aplicar_filtros)
+    
+    @medido("tabla.filtrar")
+    def aplicar_filtros(self, conservar_posicion=False):
+        """Mostrar en la tabla solo las citas que cumplen los filtros"""
+        self.filtro_programado = None
+        estado = self.filtro_estado.get()
+        ids = self.servicio.consultar(
+            paciente=self.filtro_paciente.get().strip(),
+            motivo=self.filtro_motivo.get().strip(),
+            estado=None if estado == "Todos" else estado,
+            desde=self.leer_fecha_filtro(self.filtro_desde),
+            hasta=self.leer_fecha_filtro(self.filtro_hasta),
+            orden=self.orden_tabla,
+            descendente=self.orden_descendente)
+        self.tabla.cargar(ids, conservar_posicion=conservar_posicion)
+        self.label_resultados.config(text=f"Mostrando {len(ids)} de {len(self.servicio.registro)} citas")
+    
+    def ordenar_por(self, columna):
+        """Ordenar por una columna; un segundo clic invierte el orden"""
+        if self.orden_tabla == columna:
+            self.orden_descendente = not self.orden_descendente
+        else:
+            self.orden_tabla = columna
+            self.orden_descendente = False
+        
+        for col in COLUMNAS_TABLA:
+            flecha = (" ▼" if self.orden_descendente else " ▲") if col == columna else ""
+            self.tabla.tree.heading(col, text=col + flecha)
+        self.aplicar_filtros()
+    
+    def limpiar_filtros(self):
+        """Quitar filtros y orden y mostrar todas las citas"""
+        for entry in (self.filtro_paciente, self.filtro_desde, self.filtro_hasta, self.filtro_motivo):
+            entry.delete(0, tk.END)
+        self.filtro_estado.set("Todos")
+        self.orden_tabla = None
+        self.orden_descendente = False
+        for col in COLUMNAS_TABLA:
+            self.tabla.tree.heading(col, text=col)
+        self.actualizar_tabla()
     
     def on_entry_hora_click(self, event):
         """Limpiar placeholder cuando se hace clic en el campo hora"""
@@ -304,143 +4591,158 @@ class SistemaCitasMedicas:
     
     def seleccionar_fila(self, event):
         """Cargar datos de fila seleccionada en el formulario"""
-        seleccion = self.tabla.selection()
+        seleccion = self.tabla.seleccion()
         if seleccion:
-            item = self.tabla.item(seleccion[0])
-            valores = item['values']
+            cita = self.servicio.registro.obtener(seleccion[0])
             
             self.limpiar_formulario()
-            if len(valores) > 2:  # Asegurar que hay suficientes valores
-                self.entry_paciente.insert(0, valores[0])
-                self.entry_fecha.insert(0, valores[1])
-                # Limpiar placeholder antes de insertar hora real
-                self.entry_hora.delete(0, tk.END)
-                self.entry_hora.insert(0, valores[2])
-                self.entry_hora.config(fg='black')
-                if len(valores) > 3:
-                    self.entry_motivo.insert(0, valores[3])
+            # Versión que ve el usuario, para detectar cambios de otras estaciones
+            self.cita_seleccionada = cita
+            self.entry_paciente.insert(0, cita["Paciente"])
+            self.entry_fecha.insert(0, cita["Fecha"])
+            # Limpiar placeholder antes de insertar hora real
+            self.entry_hora.delete(0, tk.END)
+            self.entry_hora.insert(0, cita["Hora"])
+            self.entry_hora.config(fg='black')
+            if pd.notna(cita["Motivo"]):
+                self.entry_motivo.insert(0, cita["Motivo"])
+            self.combo_doctor.set(cita["Doctor"])
+            self.spin_duracion.delete(0, tk.END)
+            self.spin_duracion.insert(0, cita["Duracion"])
     
     def agendar_cita(self):
-        """Agregar nueva cita"""
-        paciente = self.entry_paciente.get().strip()
-        fecha = self.entry_fecha.get().strip()
+        """Agregar nueva cita (la métrica no incluye los diálogos)"""
         hora = self.entry_hora.get().strip()
-        motivo = self.entry_motivo.get().strip()
         
         # Verificar si el campo hora tiene el placeholder
         if hora == "Ej: 4:00 PM":
             hora = ""
         
-        if not paciente or not fecha or not hora:
-            messagebox.showerror("Error", "Complete todos los campos obligatorios (Paciente, Fecha, Hora)")
-            return
-        
-        # Validar formato de fecha
-        try:
-            datetime.strptime(fecha, "%Y-%m-%d")
-        except ValueError:
-            messagebox.showerror("Error", "Formato de fecha incorrecto. Use YYYY-MM-DD")
-            return
-        
-        # Validar formato de hora (acepta tanto 24h como AM/PM)
-        hora_valida = False
         try:
-            # Intentar formato 24 horas (HH:MM)
-            datetime.strptime(hora, "%H:%M")
-            hora_valida = True
-        except ValueError:
-            try:
-                # Intentar formato 12 horas con AM/PM
-                datetime.strptime(hora.upper(), "%I:%M %p")
-                hora_valida = True
-            except ValueError:
-                pass
-        
-        if not hora_valida:
-            messagebox.showerror("Error", "Formato de hora incorrecto. Use HH:MM o H:MM AM/PM\nEjemplos: 14:30, 2:30 PM, 4:00 AM")
+            with METRICAS.medir("ui.agendar"):
+                self.servicio.agendar(self.entry_paciente.get(), self.entry_fecha.get(), hora,
+                                      doctor=self.combo_doctor.get(),
+                                      duracion=self.spin_duracion.get(),
+                                      motivo=self.entry_motivo.get())
+                self.procesar_eventos()
+                self.limpiar_formulario()
+        except ErrorCita as error:
+            messagebox.showerror(error.titulo, str(error))
             return
-        
-        nueva_cita = {
-            "Paciente": paciente,
-            "Fecha": fecha,
-            "Hora": hora,
-            "Motivo": motivo if motivo else "Consulta general",
-            "Estado": "Agendada"
-        }
-        
-        self.df.loc[len(self.df)] = nueva_cita
-        self.guardar_citas()
-        self.actualizar_tabla()
-        self.limpiar_formulario()
         messagebox.showinfo("Éxito", "Cita agendada correctamente")
     
     def reprogramar_cita(self):
-        """Reprogramar cita seleccionada"""
-        seleccion = self.tabla.selection()
+        """Reprogramar cita seleccionada (la métrica no incluye los diálogos)"""
+        seleccion = self.tabla.seleccion()
         if not seleccion:
             messagebox.showwarning("Atención", "Seleccione una cita para reprogramar")
             return
         
-        fecha = self.entry_fecha.get().strip()
-        hora = self.entry_hora.get().strip()
-        motivo = self.entry_motivo.get().strip()
-        
-        if not fecha or not hora:
-            messagebox.showerror("Error", "Complete los campos de fecha y hora")
-            return
-        
-        # Validar formato de fecha
-        try:
-            datetime.strptime(fecha, "%Y-%m-%d")
-        except ValueError:
-            messagebox.showerror("Error", "Formato de fecha incorrecto. Use YYYY-MM-DD")
-            return
-        
-        # Validar formato de hora (acepta tanto 24h como AM/PM)
-        hora_valida = False
+        id_cita = seleccion[0]
         try:
-            # Intentar formato 24 horas (HH:MM)
-            datetime.strptime(hora, "%H:%M")
-            hora_valida = True
-        except ValueError:
-            try:
-                # Intentar formato 12 horas con AM/PM
-                datetime.strptime(hora.upper(), "%I:%M %p")
-                hora_valida = True
-            except ValueError:
-                pass
-        
-        if not hora_valida:
-            messagebox.showerror("Error", "Formato de hora incorrecto. Use HH:MM o H:MM AM/PM\nEjemplos: 14:30, 2:30 PM, 4:00 AM")
+            with METRICAS.medir("ui.reprogramar"):
+                self.servicio.reprogramar(id_cita, self.entry_fecha.get(), self.entry_hora.get(),
+                                          doctor=self.combo_doctor.get(),
+                                          duracion=self.spin_duracion.get(),
+                                          motivo=self.entry_motivo.get(),
+                                          vista=self.cita_vista(id_cita))
+                self.procesar_eventos()
+                self.limpiar_formulario()
+        except ErrorCita as error:
+            messagebox.showerror(error.titulo, str(error))
             return
-        
-        index = self.tabla.index(seleccion[0])
-        self.df.at[index, "Fecha"] = fecha
-        self.df.at[index, "Hora"] = hora
-        self.df.at[index, "Motivo"] = motivo if motivo else self.df.at[index, "Motivo"]
-        self.df.at[index, "Estado"] = "Reprogramada"
-        
-        self.guardar_citas()
-        self.actualizar_tabla()
-        self.limpiar_formulario()
         messagebox.showinfo("Éxito", "Cita reprogramada correctamente")
     
     def eliminar_cita(self):
-        """Eliminar cita seleccionada"""
-        seleccion = self.tabla.selection()
+        """Eliminar cita seleccionada (la métrica no incluye los diálogos)"""
+        seleccion = self.tabla.seleccion()
         if not seleccion:
             messagebox.showwarning("Atención", "Seleccione una cita para eliminar")
             return
         
         respuesta = messagebox.askyesno("Confirmar", "¿Está seguro de eliminar esta cita?")
         if respuesta:
-            index = self.tabla.index(seleccion[0])
-            self.df = self.df.drop(self.df.index[index]).reset_index(drop=True)
-            self.guardar_citas()
-            self.actualizar_tabla()
-            self.limpiar_formulario()
+            id_cita = seleccion[0]
+            try:
+                with METRICAS.medir("ui.eliminar"):
+                    self.servicio.eliminar(id_cita, vista=self.cita_vista(id_cita))
+                    self.procesar_eventos()
+                    self.limpiar_formulario()
+            except ErrorCita as error:
+                messagebox.showerror(error.titulo, str(error))
+                return
             messagebox.showinfo("Éxito", "Cita eliminada correctamente")
     
+    def registrar_asistencia(self, asistio):
+        """Marcar la cita seleccionada como atendida o como ausencia"""
+        seleccion = self.tabla.seleccion()
+        if not seleccion:
+            messagebox.showwarning("Atención", "Seleccione una cita para registrar la asistencia")
+            return
+        
+        id_cita = seleccion[0]
+        try:
+            self.servicio.registrar_asistencia(id_cita, asistio, vista=self.cita_vista(id_cita))
+        except ErrorCita as error:
+            messagebox.showerror(error.titulo, str(error))
+            return
+        self.procesar_eventos()
+    
+    def deshacer(self):
+        """Deshacer la última operación de este usuario (Ctrl+Z)"""
+        self.retroceder(self.servicio.deshacer)
+    
+    def rehacer(self):
+        """Rehacer la última operación deshecha (Ctrl+Y)"""
+        self.retroceder(self.servicio.rehacer)
+    
+    def retroceder(self, operacion):
+        """Ejecutar deshacer o rehacer mostrando el error si no se puede"""
+        if not self.servicio.cargado:
+            return
+        try:
+            operacion(self.usuario_actual)
+        except ErrorCita as error:
+            messagebox.showwarning(error.titulo, str(error))
+        self.procesar_eventos()
+        self.actualizar_botones_deshacer()
+    
+    def actualizar_botones_deshacer(self):
+        """Habilitar deshacer y rehacer según lo que haya en las pilas del usuario"""
+        deshacer, rehacer = self.servicio.operaciones_pendientes(self.usuario_actual)
+        self.btn_deshacer.config(state='normal' if deshacer else 'disabled')
+        self.btn_rehacer.config(state='normal' if rehacer else 'disabled')
+    
+    def cita_vista(self, id_cita):
+        """Cita tal como la vio el usuario al seleccionarla"""
+        if self.cita_seleccionada is not None and self.cita_seleccionada["ID"] == id_cita:
+            return self.cita_seleccionada
+        return None
+    
+    def mostrar_horarios_libres(self):
+        """Mostrar los próximos horarios libres y proponer el primero"""
+        fecha = self.entry_fecha.get().strip()
+        try:
+            libres = self.servicio.horarios_libres(self.combo_doctor.get(), fecha,
+                                                   self.spin_duracion.get())
+        except ErrorCita as error:
+            messagebox.showerror(error.titulo, str(error))
+            return
+        if not libres:
+            self.label_libres.config(text=f"Sin horarios libres el {fecha}")
+            return
+        
+        self.label_libres.config(text="Próximos libres: " + ", ".join(minutos_a_hora(m) for m in libres))
+        self.entry_hora.delete(0, tk.END)
+        self.entry_hora.insert(0, minutos_a_hora(libres[0]))
+        self.entry_hora.config(fg='black')
+    
+    def nombres_doctores(self):
+        """Nombres disponibles para el selector de doctor"""
+        nombres = {datos["nombre"] for datos in self.usuarios.leer().values()}
+        nombres.update(self.servicio.doctores())
+        return sorted(nombres)
+    
     def limpiar_formulario(self):
         """Limpiar campos del formulario"""
         self.entry_paciente.delete(0, tk.END)
@@ -451,29 +4753,306 @@ class SistemaCitasMedicas:
         # Restaurar placeholder en hora
         self.entry_hora.insert(0, "Ej: 4:00 PM")
         self.entry_hora.config(fg='gray')
+        # El doctor se conserva para agendar varias citas seguidas
+        self.spin_duracion.delete(0, tk.END)
+        self.spin_duracion.insert(0, DURACION_CITA)
+        self.label_libres.config(text="")
     
-    def guardar_citas(self):
-        """Guardar citas en archivo Excel"""
-        self.df.to_excel(self.archivo_citas, index=False)
+    def exportar_citas(self):
+        """Exportar todas las citas al archivo elegido por el usuario"""
+        destino = filedialog.asksaveasfilename(defaultextension=".xlsx",
+                                               filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"),
+                                                          ("JSON", "*.json"), ("JSON Lines", "*.jsonl")],
+                                               initialfile="citas_exportadas.xlsx")
+        if destino:
+            self.servicio.exportar(destino)
     
-    def actualizar_tabla(self):
-        """Actualizar tabla con datos actuales"""
-        for item in self.tabla.get_children():
-            self.tabla.delete(item)
+    def importar_citas(self):
+        """Importar citas desde un archivo elegido por el usuario"""
+        ruta = filedialog.askopenfilename(filetypes=[("Citas", "*.csv *.xlsx *.json *.jsonl"),
+                                                     ("Todos los archivos", "*.*")])
+        if not ruta:
+            return
+        try:
+            self.servicio.importar(ruta)
+        except ErrorCita as error:
+            messagebox.showwarning(error.titulo, str(error))
+    
+    def on_importado(self, resultado):
+        """Informar cuántas citas se importaron y dónde quedó el detalle de errores"""
+        mensaje = f"Se importaron {resultado['importadas']} citas."
+        if resultado["errores"]:
+            mensaje += (f"\n{resultado['errores']} filas no se importaron por errores."
+                        f"\nDetalle: {resultado['reporte']}")
+            messagebox.showwarning("Importación", mensaje)
+        else:
+            messagebox.showinfo("Importación", mensaje)
+    
+    def buscar_historial(self):
+        """Buscar en las citas archivadas con los filtros de la barra"""
+        estado = self.filtro_estado.get()
+        self.servicio.buscar_historial(paciente=self.filtro_paciente.get().strip(),
+                                       motivo=self.filtro_motivo.get().strip(),
+                                       estado=None if estado == "Todos" else estado,
+                                       desde=self.leer_fecha_filtro(self.filtro_desde),
+                                       hasta=self.leer_fecha_filtro(self.filtro_hasta))
+    
+    def mostrar_historial(self, citas):
+        """Ventana de solo lectura con las citas archivadas encontradas"""
+        self.citas_historial = {cita["ID"]: cita for cita in citas}
+        if self.ventana_historial is None or not self.ventana_historial.winfo_exists():
+            ventana = tk.Toplevel(self.root)
+            ventana.title("📚 Historial de citas")
+            ventana.geometry("1000x450")
+            ventana.configure(bg='white')
+            self.ventana_historial = ventana
+            
+            self.label_historial = tk.Label(ventana, text="", font=("Arial", 11, "bold"),
+                                            bg='white', fg='#2c3e50')
+            self.label_historial.pack(pady=(10, 5))
+            
+            tree_frame = tk.Frame(ventana, bg='white')
+            tree_frame.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+            self.tabla_historial = TablaVirtual(
+                tree_frame, COLUMNAS_TABLA,
+                lambda id_cita: [self.citas_historial[id_cita][columna] for columna in COLUMNAS_TABLA])
+            for col in COLUMNAS_TABLA:
+                self.tabla_historial.tree.heading(col, text=col)
+                self.tabla_historial.tree.column(col, width=200 if col == "Motivo" else 130, anchor='center')
+            self.tabla_historial.tree.pack(side='left', fill='both', expand=True)
+            self.tabla_historial.scrollbar.pack(side='right', fill='y')
+        
+        self.label_historial.config(text=f"📚 {len(citas)} citas archivadas (solo lectura)")
+        self.tabla_historial.cargar(self.citas_historial)
+        self.ventana_historial.lift()
+    
+    def mostrar_panel_rendimiento(self, event=None):
+        """Panel oculto de rendimiento (Ctrl+Shift+P, solo administradores)"""
+        if self.usuario_login not in USUARIOS_ADMIN:
+            return
+        if self.panel_rendimiento is not None and self.panel_rendimiento.winfo_exists():
+            self.panel_rendimiento.lift()
+            return
+        
+        panel = tk.Toplevel(self.root)
+        panel.title("⚙️ Rendimiento")
+        panel.geometry("760x480")
+        panel.configure(bg='white')
+        self.panel_rendimiento = panel
         
-        for _, row in self.df.iterrows():
-            # Agregar colores según el estado
-            values = list(row)
-            self.tabla.insert("", "end", values=values)
+        tk.Label(panel, text="⏱️ Tiempos recientes (últimas 1000 mediciones de cada una)",
+                font=("Arial", 11, "bold"), bg='white', fg='#2c3e50').pack(pady=(10, 5))
+        
+        columnas = ("Medición", "Total", "p50 ms", "p90 ms", "p99 ms", "Máx ms")
+        self.arbol_rendimiento = ttk.Treeview(panel, columns=columnas, show="headings", height=12)
+        for columna in columnas:
+            self.arbol_rendimiento.heading(columna, text=columna)
+            ancho, alineacion = (220, 'w') if columna == "Medición" else (90, 'e')
+            self.arbol_rendimiento.column(columna, width=ancho, anchor=alineacion)
+        self.arbol_rendimiento.pack(fill='both', expand=True, padx=10)
+        
+        self.label_contadores = tk.Label(panel, text="", font=("Arial", 9), bg='white',
+                                         fg='#34495e', justify='left', anchor='w', wraplength=720)
+        self.label_contadores.pack(fill='x', padx=10, pady=5)
+        
+        botones_frame = tk.Frame(panel, bg='white')
+        botones_frame.pack(pady=10)
+        
+        self.btn_perfil = tk.Button(botones_frame, text="", command=self.alternar_perfil,
+                                    bg='#8e44ad', fg='white', font=("Arial", 9, "bold"),
+                                    padx=10, relief='flat')
+        self.btn_perfil.pack(side='left', padx=5)
+        
+        tk.Button(botones_frame, text="💾 Exportar trazas", command=self.exportar_trazas,
+                 bg='#3498db', fg='white', font=("Arial", 9, "bold"),
+                 padx=10, relief='flat').pack(side='left', padx=5)
+        
+        tk.Button(botones_frame, text="🧹 Reiniciar", command=METRICAS.reiniciar,
+                 bg='#95a5a6', fg='white', font=("Arial", 9, "bold"),
+                 padx=10, relief='flat').pack(side='left', padx=5)
+        
+        self.refrescar_panel_rendimiento()
+    
+    def refrescar_panel_rendimiento(self):
+        """Actualizar el panel de rendimiento cada segundo mientras esté abierto"""
+        try:
+            if not self.panel_rendimiento.winfo_exists():
+                return
+        except tk.TclError:
+            return
+        resumen = METRICAS.resumen()
+        self.arbol_rendimiento.delete(*self.arbol_rendimiento.get_children())
+        for nombre, datos in resumen["mediciones"].items():
+            self.arbol_rendimiento.insert("", "end", values=(
+                nombre, datos["total"], *(f"{datos[clave]:.1f}" for clave in ("p50", "p90", "p99", "max"))))
+        contadores = "   ".join(f"{nombre}: {valor}" for nombre, valor in resumen["contadores"].items())
+        self.label_contadores.config(text=f"🔢 {contadores or 'Sin contadores todavía'}")
+        self.btn_perfil.config(text="⏹️ Detener perfil" if METRICAS.perfilando() else "⏺️ Perfil cProfile")
+        self.panel_rendimiento.after(1000, self.refrescar_panel_rendimiento)
+    
+    def alternar_perfil(self):
+        """Iniciar o detener el perfil de cProfile de la interfaz y guardarlo"""
+        if not METRICAS.perfilando():
+            METRICAS.iniciar_perfil()
+        else:
+            perfil = METRICAS.detener_perfil()
+            destino = filedialog.asksaveasfilename(parent=self.panel_rendimiento, defaultextension=".prof",
+                                                   filetypes=[("Perfil de cProfile", "*.prof")],
+                                                   initialfile="perfil_citas.prof")
+            if destino:
+                perfil.dump_stats(destino)
+        self.btn_perfil.config(text="⏹️ Detener perfil" if METRICAS.perfilando() else "⏺️ Perfil cProfile")
+    
+    def exportar_trazas(self):
+        """Guardar las trazas (formato de Chrome/Perfetto) con el resumen de tiempos"""
+        destino = filedialog.asksaveasfilename(parent=self.panel_rendimiento, defaultextension=".json",
+                                               filetypes=[("Trazas", "*.json")],
+                                               initialfile="trazas_citas.json")
+        if destino:
+            METRICAS.exportar_trazas(destino)
+            messagebox.showinfo("Éxito", f"Trazas exportadas a {destino}", parent=self.panel_rendimiento)
+    
+    @medido("tabla.actualizar")
+    def actualizar_tabla(self):
+        """Cargar en la tabla las citas actuales (respetando los filtros)"""
+        if self.filtros_activos():
+            self.aplicar_filtros()
+        else:
+            self.tabla.cargar(self.servicio.registro.ids())
+            self.label_resultados.config(text=f"{len(self.servicio.registro)} citas")
+    
+    @medido("tabla.reflejar")
+    def reflejar_cambios(self, ids):
+        """Actualizar la tabla tras cambios en algunas citas, fila por fila"""
+        if self.filtros_activos():
+            # Con filtros u orden la posición depende de la consulta
+            self.aplicar_filtros(conservar_posicion=True)
+            return
+        if len(ids) > 1000:
+            # Tras una importación es más barato recargar las claves de una vez
+            self.actualizar_tabla()
+            return
+        registro = self.servicio.registro
+        for id_cita in ids:
+            if id_cita in registro:
+                if self.tabla.contiene(id_cita):
+                    self.tabla.actualizar_fila(id_cita)
+                else:
+                    self.tabla.insertar_fila(id_cita)
+            elif self.tabla.contiene(id_cita):
+                self.tabla.eliminar_fila(id_cita)
+        self.label_resultados.config(text=f"{len(registro)} citas")
+    
+    def valores_fila(self, id_cita):
+        """Valores a mostrar para la cita con ese ID"""
+        cita = self.servicio.registro.obtener(id_cita)
+        return [cita[columna] for columna in COLUMNAS_TABLA]
     
     def logout(self):
         """Cerrar sesión"""
         respuesta = messagebox.askyesno("Confirmar", "¿Desea cerrar sesión?")
         if respuesta:
             self.root.destroy()
+            self.ventana_principal = False
+            self.cerrar_almacenamiento()
+            self.servicio.pilas.pop(self.usuario_actual, None)
+            self.servicio.usuario = None
             self.usuario_actual = None
+            self.usuario_login = None
             self.crear_ventana_login()
 
+    def cerrar_almacenamiento(self):
+        """Terminar las escrituras pendientes y cerrar el almacenamiento"""
+        self.servicio.cerrar()
+    
+    def cerrar_aplicacion(self):
+        """Cerrar la ventana principal sin perder guardados pendientes"""
+        self.root.destroy()
+        self.ventana_principal = False
+        if self.recordatorios is not None:
+            self.recordatorios.detener()
+        self.servicio.detener()
+
+
+def servir_api(archivo_citas="citas_medicas.xlsx", tipo_almacenamiento="diario", puerto=PUERTO_API,
+               archivo_usuarios="usuarios.json"):
+    """Atender solo la API, sin ventanas (kioscos, front-ends web, pruebas de carga).
+    
+    Las ventanas no abren la API: se sirve solo con --api y pide iniciar
+    sesión con los mismos usuarios del sistema.
+    """
+    usuarios = AlmacenUsuarios(archivo_usuarios)
+    if not usuarios.leer():
+        print(f"No hay usuarios en {archivo_usuarios}: nadie podrá iniciar sesión en la API")
+    servicio = ServicioCitas(ALMACENAMIENTOS[tipo_almacenamiento](archivo_citas))
+    recordatorios = iniciar_recordatorios(servicio)
+    servicio.cargar()
+    api = ServidorAPI(servicio, usuarios, puerto=puerto, atender=True, recordatorios=recordatorios)
+    api.iniciar()
+    print(f"API de citas en http://127.0.0.1:{api.puerto}")
+    try:
+        api.hilo.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.detener()
+        if recordatorios is not None:
+            recordatorios.detener()
+        servicio.detener()
+
+
+def transferir_citas(accion, ruta, archivo_citas="citas_medicas.xlsx", tipo_almacenamiento="diario"):
+    """Importar o exportar citas sin ventanas (migraciones y respaldos).
+    
+    "exportar" incluye el historial archivado; "exportar-vigentes" deja
+    solo la agenda de hoy en adelante.
+    """
+    servicio = ServicioCitas(ALMACENAMIENTOS[tipo_almacenamiento](archivo_citas))
+    fallos, exportadas = [], []
+    servicio.suscribir(lambda evento, datos: fallos.append(datos)
+                       if evento in ("error_carga", "error_guardado", "conflicto") else None)
+    servicio.suscribir(lambda evento, datos: exportadas.append(datos[1]) if evento == "exportado" else None)
+    try:
+        servicio.cargar()
+        servicio.esperar()
+        if fallos:
+            raise fallos[0]
+        if accion == "importar":
+            resultado = servicio.ejecutar_importacion(ruta)
+            servicio.esperar()
+            if fallos:
+                raise fallos[0]
+            print(f"Citas importadas: {resultado['importadas']}")
+            if resultado["errores"]:
+                print(f"Filas con errores: {resultado['errores']} (detalle en {resultado['reporte']})")
+        else:
+            solo_vigentes = accion == "exportar-vigentes"
+            servicio.exportar(ruta, solo_vigentes)
+            servicio.esperar()
+            if fallos:
+                raise fallos[0]
+            print(f"Citas exportadas a {ruta}: {exportadas[0]}"
+                  + (" (solo la agenda vigente, sin el historial)" if solo_vigentes else ""))
+    finally:
+        servicio.detener()
+
+
+def reconstruir_citas(destino, archivo_citas="citas_medicas.xlsx"):
+    """Reproducir la bitácora de auditoría y exportar las citas resultantes"""
+    try:
+        registro = reproducir_auditoria(BitacoraOperaciones(archivo_citas))
+    except ErrorCita as error:
+        raise SystemExit(f"No se reconstruyeron las citas: {error}")
+    exportar_por_partes(list(registro.citas.values()), destino)
+    print(f"Citas reconstruidas en {destino}: {len(registro)}")
+
 # Iniciar aplicación
 if __name__ == "__main__":
-    app = SistemaCitasMedicas()
\ No newline at end of file
+    if "--api" in sys.argv:
+        servir_api()
+    elif len(sys.argv) == 3 and sys.argv[1] in ("--importar", "--exportar", "--exportar-vigentes"):
+        transferir_citas(sys.argv[1][2:], sys.argv[2])
+    elif len(sys.argv) == 3 and sys.argv[1] == "--reconstruir":
+        reconstruir_citas(sys.argv[2])
+    else:
+        app = SistemaCitasMedicas()
\ No newline at end of file
@@ -0,0 +1,428 @@
+"""Mediciones de rendimiento del sistema de citas.
+
+Genera citas sintéticas (1k, 10k, 100k y 1M filas por defecto) y mide sin
+ventanas los caminos críticos: carga del libro, guardado por operación en
+cada almacenamiento, refresco de la tabla, validación, consultas, agenda,
+tablero y recordatorios.
+Cada medición informa mediana, mínimo y el pico de memoria (tracemalloc).
+Los resultados se guardan en JSON para compararlos entre commits:
+
+    python benchmark_citas.py --salida antes.json
+    python benchmark_citas.py --tamanos 1000 10000 --comparar antes.json
+
+Con --comparar el programa termina con código 1 si alguna medición empeoró
+más que el umbral, para usarlo antes de publicar una versión.
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+RUTA_SISTEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SISTEMA--MEDICO.py")
+
+TAMANOS = [1_000, 10_000, 100_000, 1_000_000]
+
+# Escribir y leer xlsx con openpyxl tarda minutos con un millón de filas:
+# por encima de este tamaño se omiten las mediciones que dependen del libro
+MAXIMO_EXCEL = 100_000
+
+# Cada medición se repite al menos este número de veces (salvo que agote el
+# presupuesto, en segundos); las muy rápidas se repiten hasta sumar TIEMPO_MINIMO
+REPETICIONES = 5
+PRESUPUESTO = 3.0
+TIEMPO_MINIMO = 0.25
+
+DOCTORES = [f"Dr. {apellido}" for apellido in
+            ("García", "López", "Martínez", "Rodríguez", "Pérez", "Gómez", "Díaz", "Torres")]
+MOTIVOS = ["Consulta general", "Control", "Vacunación", "Chequeo anual", "Dolor de cabeza",
+           "Resultados de laboratorio", "Seguimiento", "Receta"]
+
+
+def proximo_dia_habil(desde=None):
+    """Primer día de lunes a viernes posterior a `desde` (hoy), a las 00:00"""
+    dia = (desde or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    while dia.weekday() >= 5:
+        dia += timedelta(days=1)
+    return dia
+
+
+# Primer día de la agenda sintética (desde mañana, para que nada se archive)
+INICIO = proximo_dia_habil()
+
+
+def cargar_sistema():
+    """Importar SISTEMA--MEDICO.py como módulo (el nombre no es importable)"""
+    spec = importlib.util.spec_from_file_location("sistema_medico", RUTA_SISTEMA)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def generar_citas(sm, n, semilla=2024):
+    """DataFrame de n citas sintéticas reproducibles (cuatro años de agenda).
+    
+    Las fechas son futuras: al cargar se archivan las de días pasados y lo
+    que se mide es la agenda vigente de n citas.
+    """
+    np, pd = sm.np, sm.pd
+    azar = np.random.default_rng(semilla)
+    dias = azar.integers(0, 4 * 365, n)
+    fechas = pd.to_datetime(INICIO) + pd.to_timedelta(dias, unit="D")
+    minutos = 8 * 60 + 30 * azar.integers(0, 20, n)
+    ids = azar.bytes(16 * n).hex()
+    return pd.DataFrame({
+        "ID": [ids[i:i + 32] for i in range(0, 32 * n, 32)],
+        "Paciente": [f"Paciente {i}" for i in azar.integers(0, max(n // 3, 1), n)],
+        "Doctor": np.array(DOCTORES, dtype=object)[azar.integers(0, len(DOCTORES), n)],
+        "Fecha": fechas.strftime("%Y-%m-%d"),
+        "Hora": [f"{m // 60:02d}:{m % 60:02d}" for m in minutos],
+        "Duracion": sm.DURACION_CITA,
+        "Motivo": np.array(MOTIVOS, dtype=object)[azar.integers(0, len(MOTIVOS), n)],
+        "Estado": np.array(sm.ESTADOS_CITA, dtype=object)[azar.integers(0, len(sm.ESTADOS_CITA), n)],
+        "Version": 1,
+    }, columns=sm.COLUMNAS_CITAS)
+
+
+def cita_nueva(sm, i):
+    """Cita para las mediciones de guardado (un turno libre distinto para cada i)"""
+    fecha = (INICIO + timedelta(days=i // 20)).strftime("%Y-%m-%d")
+    return {"ID": sm.nuevo_id(), "Paciente": f"Benchmark {i}", "Doctor": "Dr. Benchmark",
+            "Fecha": fecha, "Hora": sm.minutos_a_hora(8 * 60 + i % 20 * 30),
+            "Duracion": sm.DURACION_CITA, "Motivo": "Consulta general", "Estado": "Agendada",
+            "Version": 1}
+
+
+class ArbolSimulado:
+    """Sustituto de ttk.Treeview para medir la tabla sin pantalla.
+    
+    Implementa solo lo que usa TablaVirtual; el costo de Tk por fila visible
+    es constante, lo que crece con la tabla es el trabajo en Python.
+    """
+    
+    def __init__(self):
+        self.items = {}
+        self.orden = []
+        self.seleccionados = ()
+    
+    def get_children(self, padre=""):
+        return tuple(self.orden)
+    
+    def exists(self, iid):
+        return iid in self.items
+    
+    def insert(self, padre, indice, iid=None, values=()):
+        self.items[iid] = list(values)
+        self.orden.insert(indice, iid)
+        return iid
+    
+    def move(self, iid, padre, indice):
+        self.orden.remove(iid)
+        self.orden.insert(indice, iid)
+    
+    def delete(self, *iids):
+        for iid in iids:
+            del self.items[iid]
+            self.orden.remove(iid)
+        self.seleccionados = tuple(iid for iid in self.seleccionados if iid in self.items)
+    
+    def item(self, iid, values=None):
+        if values is not None:
+            self.items[iid] = list(values)
+        return {"values": self.items[iid]}
+    
+    def selection(self):
+        return self.seleccionados
+    
+    def selection_set(self, *iids):
+        self.seleccionados = iids
+    
+    def focus(self, iid=None):
+        pass
+
+
+class BarraSimulada:
+    """Sustituto de ttk.Scrollbar"""
+    
+    def set(self, inicio, fin):
+        pass
+
+
+def crear_tabla(sm, obtener_valores, tk_real=None):
+    """TablaVirtual sobre un Treeview real (si hay pantalla) o simulado"""
+    if tk_real is not None:
+        return sm.TablaVirtual(tk_real, sm.COLUMNAS_TABLA, obtener_valores, height=25)
+    tabla = sm.TablaVirtual.__new__(sm.TablaVirtual)
+    tabla.obtener_valores = obtener_valores
+    tabla.claves = []
+    tabla.numeros = {}
+    tabla.eliminados = []
+    tabla.siguiente = 0
+    tabla.inicio = 0
+    tabla.filas = 25
+    tabla.tree = ArbolSimulado()
+    tabla.scrollbar = BarraSimulada()
+    return tabla
+
+
+def medir(funcion, preparar=None, repeticiones=REPETICIONES, memoria=True):
+    """Mediana y mínimo de varias corridas y pico de memoria de una más.
+    
+    `preparar` se llama antes de cada corrida, fuera de la medición, y lo
+    que devuelve se pasa a `funcion`.
+    """
+    tiempos = []
+    inicio_total = time.perf_counter()
+    while len(tiempos) < repeticiones or (
+            time.perf_counter() - inicio_total < TIEMPO_MINIMO and len(tiempos) < 200):
+        argumento = preparar() if preparar is not None else None
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion(argumento) if preparar is not None else funcion()
+        tiempos.append(time.perf_counter() - inicio)
+        if time.perf_counter() - inicio_total > PRESUPUESTO:
+            break
+    
+    resultado = {"mediana_s": statistics.median(tiempos), "minimo_s": min(tiempos),
+                 "repeticiones": len(tiempos)}
+    if memoria:
+        argumento = preparar() if preparar is not None else None
+        gc.collect()
+        tracemalloc.start()
+        funcion(argumento) if preparar is not None else funcion()
+        resultado["memoria_pico_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return resultado
+
+
+def medir_tamano(sm, n, carpeta, maximo_excel=MAXIMO_EXCEL, memoria=True, tk_real=None):
+    """Todas las mediciones para un tamaño de tabla"""
+    resultados = {}
+    
+    def anotar(nombre, resultado):
+        resultados[nombre] = resultado
+        if "omitido" in resultado:
+            print(f"  {nombre:<28} omitido ({resultado['omitido']})")
+        else:
+            pico = resultado.get("memoria_pico_mb")
+            print(f"  {nombre:<28} {resultado['mediana_s'] * 1000:10.2f} ms"
+                  + (f"  {pico:8.1f} MB" if pico is not None else ""))
+    
+    df = generar_citas(sm, n)
+    registro = sm.RegistroCitas(df)
+    
+    # Carga: libro Excel en frío, con la caché binaria, y base SQLite
+    libro = os.path.join(carpeta, f"citas_{n}.xlsx")
+    if n <= maximo_excel:
+        df.to_excel(libro, index=False)
+        almacenamiento = sm.AlmacenamientoExcel(libro)
+        
+        def sin_cache():
+            if os.path.exists(almacenamiento.cache.archivo_cache):
+                os.remove(almacenamiento.cache.archivo_cache)
+        anotar("carga_excel", medir(lambda _: almacenamiento.cargar(), sin_cache,
+                                    repeticiones=3, memoria=memoria))
+        anotar("carga_cache", medir(almacenamiento.cargar, memoria=memoria))
+    else:
+        anotar("carga_excel", {"omitido": f"más de {maximo_excel} filas"})
+        anotar("carga_cache", {"omitido": f"más de {maximo_excel} filas"})
+    
+    sqlite = sm.AlmacenamientoSQLite(libro, os.path.join(carpeta, f"citas_{n}.db"))
+    conexion = sqlite.conectar()
+    with conexion:
+        conexion.executemany(sqlite.sql_insertar(), df.itertuples(index=False, name=None))
+        conexion.execute("DELETE FROM cambios")
+    anotar("carga_sqlite", medir(sqlite.cargar, memoria=memoria))
+    
+    # Guardado de una operación en cada almacenamiento; el contador es común
+    # porque cada almacenamiento ve las citas que guardaron los anteriores
+    contador = iter(range(10 ** 9))
+    
+    def medir_guardado(almacenamiento, repeticiones):
+        def preparar():
+            cita = cita_nueva(sm, next(contador))
+            registro.agregar(cita)
+            return cita
+        
+        def guardar(cita):
+            almacenamiento.registrar(registro, "agregar", cita=cita)
+            almacenamiento.sincronizar()
+        return medir(guardar, preparar, repeticiones=repeticiones, memoria=memoria)
+    
+    if n <= maximo_excel:
+        anotar("guardado_excel", medir_guardado(sm.AlmacenamientoExcel(libro), 2))
+        diario = sm.AlmacenamientoDiario(libro, umbral_compactacion=10 ** 9)
+        diario.inicializar()
+        diario.cargar()
+        anotar("guardado_diario", medir_guardado(diario, 50))
+        diario.cerrar()
+    else:
+        anotar("guardado_excel", {"omitido": f"más de {maximo_excel} filas"})
+        anotar("guardado_diario", {"omitido": f"más de {maximo_excel} filas"})
+    anotar("guardado_sqlite", medir_guardado(sqlite, 50))
+    sqlite.cerrar()
+    
+    # Refresco de la tabla: carga completa de claves y un cambio suelto
+    registro = sm.RegistroCitas(df)
+    
+    def valores(id_cita):
+        cita = registro.obtener(id_cita)
+        return [cita[columna] for columna in sm.COLUMNAS_TABLA]
+    tabla = crear_tabla(sm, valores, tk_real)
+    anotar("refresco_tabla", medir(lambda: tabla.cargar(registro.ids()), memoria=memoria))
+    contador = iter(range(10 ** 9))
+    
+    def agregar_fila():
+        cita = cita_nueva(sm, next(contador))
+        registro.agregar(cita)
+        return cita["ID"]
+    anotar("refresco_un_cambio", medir(tabla.insertar_fila, agregar_fila,
+                                       repeticiones=50, memoria=memoria))
+    
+    # Validación: formulario (por cita, con entradas variadas) e importación (vectorizada)
+    servicio = sm.ServicioCitas(sm.AlmacenamientoExcel(libro))
+    muestra = df.sample(min(n, 1000), random_state=1)
+    horas = [hora if i % 2 else datetime.strptime(hora, "%H:%M").strftime("%I:%M %p").lstrip("0")
+             for i, hora in enumerate(muestra["Hora"])]
+    pares = list(zip(muestra["Fecha"], horas))
+    
+    def validar_formulario():
+        sm.hora_a_minutos.cache_clear()
+        for fecha, hora in pares:
+            servicio.validar_fecha_hora(fecha, hora)
+    anotar("validacion_formulario_1000", medir(validar_formulario, memoria=memoria))
+    texto = df.drop(columns=["ID", "Version"]).astype(str)
+    anotar("validacion_lote", medir(lambda: sm.validar_lote(texto, 2), memoria=memoria))
+    
+    # Consultas: armar el índice de búsqueda y filtrar como al escribir
+    anotar("indice_busqueda", medir(lambda: sm.IndiceBusqueda(registro), memoria=memoria))
+    indice = sm.IndiceBusqueda(registro)
+    hasta = INICIO + timedelta(days=3 * 365)
+    anotar("consulta_filtros", medir(lambda: indice.consultar(
+        paciente="paciente 12", estado="Agendada", desde=hasta - timedelta(days=365),
+        hasta=hasta, orden="Fecha"), memoria=memoria))
+    
+    # Agenda: construcción y búsqueda del próximo horario libre
+    agenda = sm.AgendaCitas()
+    anotar("agenda_carga", medir(lambda: agenda.cargar(registro.citas.values()), memoria=memoria))
+    dias = list(df["Fecha"].iloc[:1000])
+    
+    def buscar_libres():
+        for i, fecha in enumerate(dias):
+            agenda.siguientes_libres(DOCTORES[i % len(DOCTORES)], fecha, 5)
+    anotar("agenda_libres_1000", medir(buscar_libres, memoria=memoria))
+    
+    # Tablero: agregados al cargar y un cambio incremental
+    estadisticas = sm.EstadisticasCitas()
+    anotar("estadisticas_carga", medir(lambda: estadisticas.cargar(df), memoria=memoria))
+    cita = next(iter(registro.citas.values()))
+    anotar("estadisticas_un_cambio", medir(lambda: estadisticas.mover(cita, cita), memoria=memoria))
+    
+    # Recordatorios: montículo al cargar y reprogramar una cita (sin arrancar el hilo)
+    servicio.registro = registro
+    programador = sm.ProgramadorRecordatorios(servicio, [])
+    anotar("recordatorios_carga", medir(programador.reconstruir, memoria=memoria))
+    
+    def reprogramar_una():
+        registro.actualizar(cita["ID"], {**cita, "Version": next(contador)})
+        programador.programar(cita["ID"])
+    anotar("recordatorios_un_cambio", medir(reprogramar_una, repeticiones=50, memoria=memoria))
+    servicio.trabajador.detener()
+    return resultados
+
+
+def version_repo():
+    """Commit actual del repositorio (con + si hay cambios sin confirmar)"""
+    carpeta = os.path.dirname(RUTA_SISTEMA)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=carpeta,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        cambios = subprocess.run(["git", "status", "--porcelain", "--", RUTA_SISTEMA], cwd=carpeta,
+                                 capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if cambios else "")
+
+
+def comparar(actual, anterior, umbral, diferencia_minima=0.001):
+    """Imprimir la variación contra otra corrida; devuelve las regresiones.
+    
+    Se comparan los tiempos mínimos, que varían menos que la mediana con la
+    carga de la máquina, y se ignoran diferencias de menos de un milisegundo.
+    """
+    regresiones = []
+    print(f"\nComparación con {anterior.get('commit')} (umbral {umbral:.0%}):")
+    for tamano, pruebas in actual["resultados"].items():
+        previas = anterior.get("resultados", {}).get(tamano, {})
+        for nombre, resultado in pruebas.items():
+            previo = previas.get(nombre, {})
+            if "minimo_s" not in resultado or "minimo_s" not in previo:
+                continue
+            cambio = resultado["minimo_s"] / previo["minimo_s"] - 1
+            empeoro = cambio > umbral and resultado["minimo_s"] - previo["minimo_s"] > diferencia_minima
+            marca = "  <-- regresión" if empeoro else ""
+            print(f"  {tamano:>8} {nombre:<28} {cambio:+8.1%}{marca}")
+            if empeoro:
+                regresiones.append((tamano, nombre, cambio))
+    return regresiones
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Mediciones de rendimiento del sistema de citas")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS,
+                        help="cantidades de citas a generar")
+    parser.add_argument("--salida", help="archivo JSON de resultados "
+                                         "(por defecto benchmark-<commit>.json)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--umbral", type=float, default=0.20,
+                        help="empeoramiento tolerado al comparar (0.20 = 20%%)")
+    parser.add_argument("--maximo-excel", type=int, default=MAXIMO_EXCEL,
+                        help="tamaño máximo para las mediciones con libros xlsx")
+    parser.add_argument("--sin-memoria", action="store_true", help="no medir picos de memoria")
+    parser.add_argument("--tk", action="store_true",
+                        help="medir la tabla con un Treeview real (requiere pantalla)")
+    opciones = parser.parse_args(argumentos)
+    
+    sm = cargar_sistema()
+    tk_real = None
+    if opciones.tk:
+        tk_real = sm.tk.Tk()
+        tk_real.withdraw()
+    
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": version_repo(),
+        "python": platform.python_version(),
+        "pandas": sm.pd.__version__,
+        "plataforma": platform.platform(),
+        "resultados": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="benchmark-citas-") as carpeta:
+        for n in opciones.tamanos:
+            print(f"{n} citas")
+            resultado["resultados"][str(n)] = medir_tamano(
+                sm, n, carpeta, opciones.maximo_excel, not opciones.sin_memoria, tk_real)
+    
+    salida = opciones.salida or f"benchmark-{resultado['commit'] or 'local'}.json"
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {salida}")
+    
+    if opciones.comparar:
+        with open(opciones.comparar, 'r', encoding='utf-8') as f:
+            anterior = json.load(f)
+        if comparar(resultado, anterior, opciones.umbral):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
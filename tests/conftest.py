@@ -0,0 +1,41 @@
+import importlib.util
+import pathlib
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+RAIZ = pathlib.Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def sm():
+    """El módulo SISTEMA--MEDICO.py (su nombre no se puede importar directamente)"""
+    spec = importlib.util.spec_from_file_location("sistema_medico", RAIZ / "SISTEMA--MEDICO.py")
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules["sistema_medico"] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@pytest.fixture
+def manana():
+    """Una fecha futura, para que las citas no se archiven al cargar"""
+    return (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+@pytest.fixture
+def nueva_cita(sm, manana):
+    """Armar una cita completa como la que crea ServicioCitas.agendar"""
+    def armar(paciente="Ana", hora="15:00", doctor="Dr. Pérez", fecha=None, duracion=30):
+        return {"ID": sm.nuevo_id(), "Paciente": paciente, "Doctor": doctor, "Fecha": fecha or manana,
+                "Hora": hora, "Duracion": duracion, "Motivo": "Consulta general",
+                "Estado": "Agendada", "Version": 1}
+    return armar
+
+
+@pytest.fixture(autouse=True)
+def cache_local(monkeypatch, tmp_path):
+    """Las cachés de libros van a una carpeta temporal y no a la del usuario"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path / "cache"))
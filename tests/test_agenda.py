@@ -0,0 +1,44 @@
+"""Índice de horarios ocupados (AgendaCitas)."""
+import pytest
+
+DIA = "2030-01-07"
+
+
+@pytest.fixture
+def agenda(sm):
+    agenda = sm.AgendaCitas()
+    agenda.cargar([
+        {"ID": "larga", "Doctor": "Dr. Pérez", "Fecha": DIA, "Hora": "08:00", "Duracion": 180},
+        {"ID": "corta", "Doctor": "Dr. Pérez", "Fecha": DIA, "Hora": "08:30", "Duracion": 15},
+    ])
+    return agenda
+
+
+def test_choque_con_una_cita_larga(agenda):
+    # 10:00 queda después de la corta pero dentro de la larga (08:00-11:00)
+    assert agenda.conflicto("Dr. Pérez", DIA, 10 * 60, 30) == "larga"
+    assert agenda.conflicto("Dr. Pérez", DIA, 8 * 60 + 35, 10) in ("larga", "corta")
+    assert agenda.conflicto("Dr. Pérez", DIA, 11 * 60, 30) is None
+    assert agenda.conflicto("Dr. López", DIA, 10 * 60, 30) is None
+
+
+def test_ignorar_la_cita_larga(agenda):
+    assert agenda.conflicto("Dr. Pérez", DIA, 10 * 60, 30, ignorar="larga") is None
+    assert agenda.conflicto("Dr. Pérez", DIA, 8 * 60 + 30, 30, ignorar="larga") == "corta"
+
+
+def test_libres_despues_de_la_cita_larga(agenda):
+    assert agenda.siguientes_libres("Dr. Pérez", DIA, 3, 30, desde=9 * 60) == [660, 690, 720]
+    assert agenda.siguientes_libres("Dr. Pérez", DIA, 2, 30) == [660, 690]
+    assert agenda.siguientes_libres("Dr. Pérez", DIA, 2, 30, ignorar="larga") == [480, 525]
+
+
+def test_agregar_y_quitar_mantienen_el_orden(sm, agenda):
+    agenda.agregar({"ID": "tarde", "Doctor": "Dr. Pérez", "Fecha": DIA, "Hora": "11:00", "Duracion": 30})
+    assert agenda.siguientes_libres("Dr. Pérez", DIA, 1, 30, desde=9 * 60) == [690]
+    agenda.quitar("larga")
+    assert agenda.conflicto("Dr. Pérez", DIA, 10 * 60, 30) is None
+    assert agenda.siguientes_libres("Dr. Pérez", DIA, 1, 30, desde=9 * 60) == [540]
+    agenda.mover({"ID": "corta", "Doctor": "Dr. Pérez", "Fecha": DIA, "Hora": "09:00", "Duracion": 240})
+    assert agenda.conflicto("Dr. Pérez", DIA, 12 * 60, 30) == "corta"
+    assert agenda.siguientes_libres("Dr. Pérez", DIA, 1, 30, desde=9 * 60) == [13 * 60]
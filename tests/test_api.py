@@ -0,0 +1,92 @@
+"""API HTTP: sesiones y usuario de cada operación."""
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+
+@pytest.fixture
+def api(sm, tmp_path):
+    usuarios = sm.AlmacenUsuarios(str(tmp_path / "usuarios.json"), iteraciones=1000)
+    usuarios.inicializar({"admin": {"password": "clave-admin", "nombre": "Administrador"},
+                          "ana": {"password": "clave-ana", "nombre": "Ana"},
+                          "luis": {"password": "clave-luis", "nombre": "Luis"}})
+    servicio = sm.ServicioCitas(sm.AlmacenamientoDiario(str(tmp_path / "citas.xlsx")))
+    servicio.cargar()
+    servicio.esperar()
+    servidor = sm.ServidorAPI(servicio, usuarios, puerto=0, atender=True)
+    servidor.iniciar()
+    yield servidor
+    servidor.detener()
+    servicio.detener()
+
+
+def pedir(api, metodo, ruta, datos=None, token=None):
+    """(estado HTTP, respuesta JSON) de una petición"""
+    peticion = urllib.request.Request(f"http://127.0.0.1:{api.puerto}{ruta}", method=metodo,
+                                      data=None if datos is None else json.dumps(datos).encode())
+    if token:
+        peticion.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(peticion) as respuesta:
+            return respuesta.status, json.load(respuesta)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def sesion(api, usuario):
+    estado, respuesta = pedir(api, "POST", "/sesion", {"usuario": usuario, "password": f"clave-{usuario}"})
+    assert estado == 201
+    return respuesta["token"]
+
+
+def test_sin_sesion(api):
+    assert pedir(api, "GET", "/citas")[0] == 401
+    assert pedir(api, "GET", "/citas", token="inventado")[0] == 401
+    assert pedir(api, "POST", "/sesion", {"usuario": "ana", "password": "otra"})[0] == 401
+
+
+def test_usuario_de_la_sesion(api, manana):
+    ana, luis = sesion(api, "ana"), sesion(api, "luis")
+    # El usuario del cuerpo no cuenta: la operación queda a nombre de la sesión
+    estado, _ = pedir(api, "POST", "/citas", {"paciente": "Eva", "fecha": manana, "hora": "09:00",
+                                              "usuario": "luis"}, token=ana)
+    assert estado == 201
+    api.servicio.esperar()
+    assert [entrada["usuario"] for entrada in api.servicio.auditoria.ultimas()] == ["ana"]
+    # Luis no puede deshacer lo que hizo Ana
+    assert pedir(api, "POST", "/deshacer", {"usuario": "ana"}, token=luis)[0] == 400
+    assert pedir(api, "POST", "/deshacer", token=ana)[0] == 200
+
+
+def test_solo_admin(api):
+    ana, admin = sesion(api, "ana"), sesion(api, "admin")
+    assert pedir(api, "GET", "/auditoria", token=ana)[0] == 403
+    assert pedir(api, "GET", "/metricas", token=ana)[0] == 403
+    assert pedir(api, "GET", "/auditoria", token=admin)[0] == 200
+
+
+def test_cerrar_sesion(api):
+    ana = sesion(api, "ana")
+    assert pedir(api, "DELETE", "/sesion", token=ana)[0] == 200
+    assert pedir(api, "GET", "/citas", token=ana)[0] == 401
+
+
+def test_valores_si_no(api):
+    assert api.booleano({"asistio": "false"}, "asistio", True) is False
+    assert api.booleano({"asistio": "Sí"}, "asistio", False) is True
+    assert api.booleano({"asistio": False}, "asistio", True) is False
+    assert api.booleano({}, "asistio", True) is True
+    ana = sesion(api, "ana")
+    estado, respuesta = pedir(api, "POST", "/asistencia/1?asistio=quizas", token=ana)
+    assert estado == 400 and "asistio" in respuesta["error"]
+
+
+def test_informe_sin_fecha(api, manana):
+    ana = sesion(api, "ana")
+    assert pedir(api, "GET", "/informes/dia", token=ana) == (400, {"error": "fecha requerida (YYYY-MM-DD)"})
+    assert pedir(api, "GET", "/informes/dia?fecha=18/10", token=ana)[0] == 400
+    estado, respuesta = pedir(api, "GET", f"/informes/doctor?doctor=Dr.%20P%C3%A9rez&desde_fecha={manana}", token=ana)
+    assert (estado, respuesta) == (400, {"error": "hasta_fecha requerida (YYYY-MM-DD)"})
+    assert pedir(api, "GET", f"/informes/dia?fecha={manana}", token=ana)[0] == 200
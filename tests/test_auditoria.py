@@ -0,0 +1,61 @@
+"""Bitácora de auditoría: líneas cortadas y reconstrucción del estado."""
+import json
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def servicio(sm, tmp_path, nueva_cita):
+    archivo = str(tmp_path / "citas.xlsx")
+    # Citas que ya existían antes de que hubiera bitácora
+    pd.DataFrame([nueva_cita("Previa", hora="08:00")], columns=sm.COLUMNAS_CITAS).to_excel(archivo, index=False)
+    servicio = sm.ServicioCitas(sm.AlmacenamientoDiario(archivo))
+    servicio.usuario = "ana"
+    servicio.cargar()
+    servicio.esperar()
+    yield servicio
+    servicio.detener()
+
+
+def estado(registro):
+    return {id_cita: (cita["Paciente"], cita["Hora"]) for id_cita, cita in registro.citas.items()}
+
+
+def test_reconstruir_incluye_las_citas_previas(sm, servicio, manana):
+    cita = servicio.agendar("Eva", manana, "09:00", "Dr. Pérez")
+    servicio.reprogramar(cita["ID"], manana, "10:00")
+    servicio.esperar()
+    reconstruido = sm.reproducir_auditoria(servicio.auditoria)
+    assert estado(reconstruido) == estado(servicio.registro)
+    assert "Previa" in {paciente for paciente, _ in estado(reconstruido).values()}
+    # La base no aparece como operación
+    assert [entrada["tipo"] for entrada in servicio.auditoria.ultimas()] == ["reprogramar", "agendar"]
+
+
+def test_bitacora_sin_base(sm, servicio, manana):
+    servicio.agendar("Eva", manana, "09:00")
+    servicio.esperar()
+    with open(servicio.auditoria.ruta, "rb") as f:
+        lineas = f.readlines()
+    with open(servicio.auditoria.ruta, "wb") as f:
+        f.writelines(lineas[1:])
+    with pytest.raises(sm.ErrorCita):
+        sm.reproducir_auditoria(servicio.auditoria)
+
+
+def test_linea_cortada(sm, servicio, manana):
+    servicio.agendar("Eva", manana, "09:00")
+    servicio.esperar()
+    # Un cierre abrupto a mitad de una entrada (incluso de un carácter UTF-8)
+    with open(servicio.auditoria.ruta, "ab") as f:
+        f.write('{"op":"x","usuario":"ana","tipo":"agendar","despues":{"Paciente":"Ñ'.encode()[:-1])
+    assert [entrada["tipo"] for entrada in servicio.auditoria.ultimas()] == ["agendar"]
+    
+    servicio.agendar("Luis", manana, "10:00")
+    servicio.esperar()
+    assert [entrada["tipo"] for entrada in servicio.auditoria.ultimas()] == ["agendar", "agendar"]
+    assert estado(sm.reproducir_auditoria(servicio.auditoria)) == estado(servicio.registro)
+    # La entrada nueva quedó en su propia línea
+    with open(servicio.auditoria.ruta, "rb") as f:
+        assert json.loads(f.readlines()[-1])["despues"]["Paciente"] == "Luis"
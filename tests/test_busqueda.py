@@ -0,0 +1,46 @@
+"""Búsqueda vectorizada: filtros y orden de IndiceBusqueda."""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def indice(sm, nueva_cita):
+    citas = [
+        nueva_cita("Ana Gómez", hora="10:00", doctor="Dra. Ruiz", fecha="2030-01-08"),
+        nueva_cita("luis ANA", hora="09:00", doctor="Dr. Pérez", fecha="2030-01-08"),
+        nueva_cita("Eva", hora="2:30 PM", doctor="dr. alba", fecha="2030-01-07"),
+        nueva_cita("Juan", hora="08:00", doctor="Dr. Pérez", fecha="2030-01-09"),
+    ]
+    citas[1]["Motivo"], citas[3]["Estado"] = "Control de PRESIÓN", "Atendida"
+    return sm.IndiceBusqueda(sm.RegistroCitas(pd.DataFrame(citas, columns=sm.COLUMNAS_CITAS)))
+
+
+def pacientes(indice, **filtros):
+    return [indice.registro.obtener(id_cita)["Paciente"] for id_cita in indice.consultar(**filtros)]
+
+
+def test_filtros(indice):
+    # Texto: subcadena sin distinguir mayúsculas
+    assert pacientes(indice, paciente="ana") == ["Ana Gómez", "luis ANA"]
+    assert pacientes(indice, motivo="presión") == ["luis ANA"]
+    assert pacientes(indice, estado="Atendida") == ["Juan"]
+    assert pacientes(indice, desde=datetime(2030, 1, 8), hasta=datetime(2030, 1, 8)) == ["Ana Gómez", "luis ANA"]
+    assert pacientes(indice, paciente="a", desde=datetime(2030, 1, 9)) == ["Juan"]
+    assert pacientes(indice, paciente="nadie") == []
+
+
+def test_orden(indice):
+    assert pacientes(indice, orden="Fecha") == ["Eva", "luis ANA", "Ana Gómez", "Juan"]
+    assert pacientes(indice, orden="Hora") == ["Juan", "luis ANA", "Ana Gómez", "Eva"]
+    assert pacientes(indice, orden="Doctor") == ["Eva", "luis ANA", "Juan", "Ana Gómez"]
+    assert pacientes(indice, orden="Paciente", descendente=True) == ["luis ANA", "Juan", "Eva", "Ana Gómez"]
+    assert pacientes(indice, estado="Agendada", orden="Fecha", descendente=True) == ["Ana Gómez", "luis ANA", "Eva"]
+
+
+def test_vigente(sm, indice, nueva_cita):
+    registro = indice.registro
+    assert indice.vigente(registro)
+    registro.agregar(nueva_cita("Sara"))
+    assert not indice.vigente(registro)
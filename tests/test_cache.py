@@ -0,0 +1,16 @@
+"""Caché binaria de los libros Excel."""
+import os
+
+import pandas as pd
+
+
+def test_cache_fuera_de_la_carpeta_del_libro(sm, tmp_path):
+    libro = tmp_path / "compartida" / "citas.xlsx"
+    libro.parent.mkdir()
+    pd.DataFrame({"ID": ["a"], "Paciente": ["Ana"]}).to_excel(libro, index=False)
+    cache = sm.CacheLibro(str(libro))
+    assert cache.leer() is None
+    cache.leer_excel()
+    assert os.listdir(libro.parent) == ["citas.xlsx"]
+    assert os.path.dirname(cache.archivo_cache) == os.path.join(str(tmp_path / "cache"), "sistema_medico")
+    assert cache.leer()["Sheet1"]["Paciente"].tolist() == ["Ana"]
@@ -0,0 +1,92 @@
+"""Diario de operaciones: reproducción tras un cierre abrupto y compactación."""
+import os
+import threading
+
+
+def abrir(sm, archivo, **opciones):
+    almacenamiento = sm.AlmacenamientoDiario(archivo, **opciones)
+    almacenamiento.inicializar()
+    return almacenamiento
+
+
+def test_reproducir_diario(sm, tmp_path, nueva_cita):
+    archivo = str(tmp_path / "citas.xlsx")
+    a = abrir(sm, archivo)
+    a.cargar()
+    citas = [nueva_cita(f"Paciente {i}", hora=f"{8 + i}:00") for i in range(3)]
+    for cita in citas:
+        a.registrar(None, "agregar", cita=cita)
+    a.registrar(None, "eliminar", id=citas[1]["ID"])
+    a.registrar(None, "actualizar", id=citas[2]["ID"], cambios={"Motivo": "Control"})
+    a.cerrar()
+    
+    registro = abrir(sm, archivo).cargar()
+    assert set(registro.citas) == {citas[0]["ID"], citas[2]["ID"]}
+    assert registro.obtener(citas[2]["ID"])["Motivo"] == "Control"
+    assert registro.obtener(citas[2]["ID"])["Version"] == 2
+
+
+def test_linea_cortada_por_un_cierre_abrupto(sm, tmp_path, nueva_cita):
+    archivo = str(tmp_path / "citas.xlsx")
+    a = abrir(sm, archivo)
+    a.cargar()
+    guardada = nueva_cita("Ana", hora="09:00")
+    a.registrar(None, "agregar", cita=guardada)
+    # El proceso murió a mitad de escribir la siguiente línea
+    with open(a.archivo_diario, "ab") as diario:
+        diario.write(b'{"seq": 2, "op": "agregar", "datos": {"cita": {"ID": "x')
+    
+    b = abrir(sm, archivo)
+    assert set(b.cargar().citas) == {guardada["ID"]}
+    # La próxima línea no queda pegada al resto cortado
+    otra = nueva_cita("Luis", hora="10:00")
+    b.registrar(None, "agregar", cita=otra)
+    assert set(abrir(sm, archivo).cargar().citas) == {guardada["ID"], otra["ID"]}
+
+
+def test_compactacion_interrumpida(sm, tmp_path, nueva_cita):
+    archivo = str(tmp_path / "citas.xlsx")
+    a = abrir(sm, archivo)
+    a.cargar()
+    antes = nueva_cita("Ana", hora="09:00")
+    a.registrar(None, "agregar", cita=antes)
+    # Se rotó el diario pero la instantánea nueva no llegó a escribirse
+    os.replace(a.archivo_diario, a.archivo_rotado)
+    despues = nueva_cita("Luis", hora="10:00")
+    b = abrir(sm, archivo)
+    b.cargar()
+    b.registrar(None, "agregar", cita=despues)
+    
+    c = abrir(sm, archivo)
+    assert set(c.cargar().citas) == {antes["ID"], despues["ID"]}
+    # La compactación siguiente junta ambos diarios en la instantánea
+    c.compactar(esperar=True)
+    assert not os.path.exists(c.archivo_rotado)
+    assert set(abrir(sm, archivo).cargar().citas) == {antes["ID"], despues["ID"]}
+
+
+def test_compactacion_con_otra_estacion_anexando(sm, tmp_path, nueva_cita):
+    archivo = str(tmp_path / "citas.xlsx")
+    compacta = abrir(sm, archivo, umbral_compactacion=10 ** 9)
+    anexa = abrir(sm, archivo)
+    compacta.cargar()
+    anexa.cargar()
+    
+    citas = [nueva_cita(f"Paciente {i}", doctor=f"Doctor {i}") for i in range(30)]
+    
+    def anexar():
+        for cita in citas:
+            anexa.registrar(None, "agregar", cita=cita)
+    hilo = threading.Thread(target=anexar)
+    hilo.start()
+    while hilo.is_alive():
+        compacta.compactar(esperar=True)
+    hilo.join()
+    compacta.compactar(esperar=True)
+    
+    # Nada se pierde ni se repite: ni en la instantánea ni en lo que ve cada estación
+    esperadas = {cita["ID"] for cita in citas}
+    assert set(abrir(sm, archivo).cargar().citas) == esperadas
+    assert compacta.cambios_remotos() is not None
+    assert set(compacta.estado.citas) == esperadas
+    assert set(anexa.estado.citas) == esperadas
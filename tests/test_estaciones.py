@@ -0,0 +1,157 @@
+"""Dos estaciones sobre los mismos archivos: horarios ocupados entre estaciones."""
+import pytest
+
+TIPOS = ["diario", "sqlite"]
+
+
+@pytest.fixture(params=TIPOS)
+def estaciones(request, sm, tmp_path):
+    """Dos almacenamientos del mismo tipo abiertos sobre los mismos archivos"""
+    archivo = str(tmp_path / "citas.xlsx")
+    almacenamientos = [sm.ALMACENAMIENTOS[request.param](archivo) for _ in range(2)]
+    for almacenamiento in almacenamientos:
+        almacenamiento.inicializar()
+        almacenamiento.cargar()
+    yield almacenamientos
+    for almacenamiento in almacenamientos:
+        almacenamiento.cerrar()
+
+
+def test_mismo_horario_en_dos_estaciones(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    primera, segunda = nueva_cita("Ana"), nueva_cita("Luis")
+    a.registrar(None, "agregar", cita=primera)
+    with pytest.raises(sm.ConflictoCita) as error:
+        b.registrar(None, "agregar", cita=segunda)
+    # La estación rechazada recibe la cita ajena y descarta la suya
+    assert error.value.cambios[segunda["ID"]] is None
+    assert error.value.cambios[primera["ID"]]["Paciente"] == "Ana"
+
+
+def test_horario_que_se_cruza(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    a.registrar(None, "agregar", cita=nueva_cita("Ana", hora="15:00", duracion=60))
+    with pytest.raises(sm.ConflictoCita):
+        b.registrar(None, "agregar", cita=nueva_cita("Luis", hora="15:30"))
+    # Otro doctor o el horario siguiente no chocan
+    b.registrar(None, "agregar", cita=nueva_cita("Luis", hora="15:30", doctor="Dra. Gómez"))
+    b.registrar(None, "agregar", cita=nueva_cita("Eva", hora="16:00"))
+
+
+def test_horario_dentro_de_una_cita_larga(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    # Un día con citas encimadas: una larga y una corta dentro de ella
+    a.registrar(None, "importar", citas=[nueva_cita("Ana", hora="08:00", duracion=180),
+                                        nueva_cita("Luis", hora="08:30", duracion=15)],
+                verificar_horarios=False)
+    with pytest.raises(sm.ConflictoCita) as error:
+        b.registrar(None, "agregar", cita=nueva_cita("Eva", hora="10:00"))
+    assert "Ana" in str(error.value)
+    b.registrar(None, "agregar", cita=nueva_cita("Eva", hora="11:00"))
+    with pytest.raises(sm.ConflictoCita):
+        a.registrar(None, "agregar", cita=nueva_cita("Juan", hora="10:30", duracion=60))
+
+
+def test_reprogramar_a_horario_ocupado(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    cita = nueva_cita("Ana", hora="10:00")
+    a.registrar(None, "agregar", cita=cita)
+    b.registrar(None, "agregar", cita=nueva_cita("Luis", hora="11:00"))
+    with pytest.raises(sm.ConflictoCita):
+        a.registrar(None, "actualizar", id=cita["ID"], cambios={"Hora": "11:00"},
+                    version=1, base={"Hora": "10:00"})
+    # Mover la cita dentro de su propio horario no choca consigo misma
+    a.registrar(None, "actualizar", id=cita["ID"], cambios={"Hora": "10:15"},
+                version=1, base={"Hora": "10:00"})
+
+
+def test_importacion_con_horario_ocupado(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    a.registrar(None, "agregar", cita=nueva_cita("Ana", hora="09:00"))
+    lote = [nueva_cita("Luis", hora="08:00"), nueva_cita("Eva", hora="09:00")]
+    with pytest.raises(sm.ConflictoCita):
+        b.registrar(None, "importar", citas=lote)
+    # Sin verificar horarios (como pide la importación) el lote entra completo
+    b.registrar(None, "importar", citas=lote, verificar_horarios=False)
+
+
+def test_servicios_en_dos_estaciones(sm, tmp_path, manana):
+    """El caso completo: cada servicio vio el horario libre y solo uno queda"""
+    archivo = str(tmp_path / "citas.xlsx")
+    servicios = []
+    for _ in range(2):
+        servicio = sm.ServicioCitas(sm.ALMACENAMIENTOS["diario"](archivo))
+        servicio.almacenamiento.inicializar()
+        servicio.cargar()
+        servicio.esperar()
+        servicios.append(servicio)
+    conflictos = []
+    servicios[1].suscribir(lambda evento, datos: conflictos.append(datos) if evento == "conflicto" else None)
+    try:
+        servicios[0].agendar("Ana", manana, "15:00", "Dr. Pérez")
+        servicios[0].esperar()
+        rechazada = servicios[1].agendar("Luis", manana, "15:00", "Dr. Pérez")
+        servicios[1].esperar()
+        assert len(conflictos) == 1
+        assert rechazada["ID"] not in servicios[1].registro
+        assert [cita["Paciente"] for cita in servicios[1].registro.citas.values()] == ["Ana"]
+    finally:
+        for servicio in servicios:
+            servicio.detener()
+
+
+def reprogramar(almacenamiento, cita, **cambios):
+    """Registrar un cambio hecho sobre la cita tal como se vio al cargar"""
+    return almacenamiento.registrar(None, "actualizar", id=cita["ID"], cambios=cambios,
+                                    version=cita["Version"], base={campo: cita[campo] for campo in cambios})
+
+
+def test_fusion_de_campos_distintos(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    cita = nueva_cita("Ana", hora="10:00")
+    a.registrar(None, "agregar", cita=cita)
+    b.cambios_remotos()
+    # Las dos estaciones parten de la versión 1 y tocan campos distintos
+    reprogramar(a, cita, Motivo="Control")
+    cambios = reprogramar(b, cita, Hora="11:00")
+    vigente = cambios[cita["ID"]]
+    assert (vigente["Motivo"], vigente["Hora"], vigente["Version"]) == ("Control", "11:00", 3)
+
+
+def test_mismo_valor_no_es_conflicto(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    cita = nueva_cita("Ana", hora="10:00")
+    a.registrar(None, "agregar", cita=cita)
+    reprogramar(a, cita, Motivo="Control")
+    assert reprogramar(b, cita, Motivo="Control")[cita["ID"]]["Motivo"] == "Control"
+
+
+def test_mismo_campo_con_otro_valor(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    cita = nueva_cita("Ana", hora="10:00")
+    a.registrar(None, "agregar", cita=cita)
+    reprogramar(a, cita, Motivo="Control")
+    with pytest.raises(sm.ConflictoCita) as error:
+        reprogramar(b, cita, Motivo="Urgencia")
+    # La estación rechazada recibe la versión ganadora
+    assert error.value.cambios[cita["ID"]]["Motivo"] == "Control"
+
+
+def test_cambio_sobre_cita_eliminada(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    cita = nueva_cita("Ana", hora="10:00")
+    a.registrar(None, "agregar", cita=cita)
+    a.registrar(None, "eliminar", id=cita["ID"])
+    with pytest.raises(sm.ConflictoCita):
+        reprogramar(b, cita, Motivo="Control")
+    # Eliminarla otra vez no hace nada
+    assert b.registrar(None, "eliminar", id=cita["ID"])[cita["ID"]] is None
+
+
+def test_eliminar_cita_modificada(sm, estaciones, nueva_cita):
+    a, b = estaciones
+    cita = nueva_cita("Ana", hora="10:00")
+    a.registrar(None, "agregar", cita=cita)
+    reprogramar(a, cita, Motivo="Control")
+    with pytest.raises(sm.ConflictoCita):
+        b.registrar(None, "eliminar", id=cita["ID"], version=1)
@@ -0,0 +1,87 @@
+"""Agregados por día y doctor: lo incremental coincide con recalcular todo."""
+import pandas as pd
+import pytest
+
+
+def contadores(estadisticas):
+    """Agregados sin contadores en cero, para comparar"""
+    return {fecha: {doctor: {"estados": dict(+resumen["estados"]), "horas": dict(+resumen["horas"])}
+                    for doctor, resumen in doctores.items()}
+            for fecha, doctores in estadisticas.dias.items()}
+
+
+def recalcular(sm, citas):
+    estadisticas = sm.EstadisticasCitas()
+    estadisticas.cargar(pd.DataFrame(list(citas), columns=sm.COLUMNAS_CITAS))
+    return contadores(estadisticas)
+
+
+def test_incremental_igual_a_recalcular(sm, nueva_cita, manana):
+    citas = {cita["ID"]: cita for cita in [
+        nueva_cita("Ana", hora="08:30", duracion=90),
+        nueva_cita("Luis", hora="10:45", duracion=30, doctor="Dra. Ruiz"),
+        nueva_cita("Eva", hora="2:30 PM", doctor=""),
+        nueva_cita("Juan", hora="11:00", fecha="2030-01-07"),
+    ]}
+    estadisticas = sm.EstadisticasCitas()
+    for cita in citas.values():
+        estadisticas.agregar(cita)
+    assert contadores(estadisticas) == recalcular(sm, citas.values())
+    ana, luis, eva, juan = citas.values()
+    # 08:30-10:00 reparte 30 y 60 minutos; 10:45-11:15 cruza la hora
+    assert estadisticas.dia(manana)["Dr. Pérez"]["horas"] == {8: 30, 9: 60}
+    assert estadisticas.dia(manana)["Dra. Ruiz"]["horas"] == {10: 15, 11: 15}
+    
+    movida = {**ana, "Hora": "16:00", "Duracion": 45, "Estado": "Reprogramada"}
+    estadisticas.mover(ana, movida)
+    citas[ana["ID"]] = movida
+    atendida = {**luis, "Estado": "Atendida"}
+    estadisticas.mover(luis, atendida)
+    citas[luis["ID"]] = atendida
+    otro_dia = {**eva, "Fecha": "2030-01-07", "Doctor": "Dr. Pérez", "Hora": "09:00"}
+    estadisticas.mover(eva, otro_dia)
+    citas[eva["ID"]] = otro_dia
+    assert contadores(estadisticas) == recalcular(sm, citas.values())
+    
+    estadisticas.quitar(citas.pop(juan["ID"]))
+    estadisticas.quitar(citas.pop(luis["ID"]))
+    assert contadores(estadisticas) == recalcular(sm, citas.values())
+    # Los doctores y días sin citas desaparecen
+    assert "Dra. Ruiz" not in estadisticas.dia(manana) and "" not in estadisticas.dia(manana)
+    
+    estadisticas.quitar(citas.pop(ana["ID"]))
+    estadisticas.quitar(citas.pop(eva["ID"]))
+    assert estadisticas.dias == {}
+
+
+def test_indicadores(sm, nueva_cita):
+    citas = [nueva_cita("Ana", hora="08:00", duracion=60), nueva_cita("Luis", hora="09:00"),
+             nueva_cita("Eva", hora="09:30")]
+    citas[0]["Estado"], citas[1]["Estado"] = "Atendida", "No asistió"
+    estadisticas = sm.EstadisticasCitas()
+    for cita in citas:
+        estadisticas.agregar(cita)
+    indicadores = estadisticas.indicadores(estadisticas.dia(citas[0]["Fecha"])["Dr. Pérez"])
+    assert indicadores["total"] == 3 and indicadores["ausencias"] == 0.5
+    assert indicadores["ocupacion"][8] == 1 and indicadores["ocupacion"][9] == 1 and indicadores["ocupacion"][10] == 0
+    assert indicadores["ocupacion_dia"] == pytest.approx(120 / 600)
+
+
+@pytest.fixture
+def servicio(sm, tmp_path):
+    servicio = sm.ServicioCitas(sm.AlmacenamientoDiario(str(tmp_path / "citas.xlsx")))
+    servicio.cargar()
+    servicio.esperar()
+    yield servicio
+    servicio.detener()
+
+
+def test_servicio_mantiene_los_agregados(sm, servicio, manana):
+    ana = servicio.agendar("Ana", manana, "09:00", doctor="Dr. Pérez", duracion=60)
+    luis = servicio.agendar("Luis", manana, "2:00 PM", doctor="Dra. Ruiz")
+    servicio.agendar("Eva", manana, "11:00", doctor="Dr. Pérez", duracion=15)
+    servicio.reprogramar(ana["ID"], manana, "15:30", doctor="Dra. Ruiz", duracion=45)
+    servicio.eliminar(luis["ID"])
+    servicio.esperar()
+    assert contadores(servicio.estadisticas) == recalcular(sm, servicio.registro.citas.values())
+    assert contadores(servicio.estadisticas)[manana]["Dra. Ruiz"]["horas"] == {15: 30, 16: 15}
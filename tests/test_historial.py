@@ -0,0 +1,40 @@
+"""Historial archivado por mes: las exportaciones lo incluyen."""
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(params=["excel", "diario", "sqlite"])
+def servicio(request, sm, tmp_path, nueva_cita):
+    archivo = str(tmp_path / "citas.xlsx")
+    # Un libro anterior al archivo mensual: una cita pasada y una vigente
+    pd.DataFrame([nueva_cita("Pasada", fecha="2024-03-05"), nueva_cita("Vigente")],
+                 columns=sm.COLUMNAS_CITAS).to_excel(archivo, index=False)
+    servicio = sm.ServicioCitas(sm.ALMACENAMIENTOS[request.param](archivo))
+    servicio.cargar()
+    servicio.esperar()
+    yield servicio
+    servicio.detener()
+
+
+def exportar(servicio, destino, solo_vigentes=False):
+    exportadas = []
+    servicio.suscribir(lambda evento, datos: exportadas.append(datos) if evento == "exportado" else None)
+    servicio.exportar(str(destino), solo_vigentes)
+    servicio.esperar()
+    return exportadas[0][1], pd.read_csv(destino)
+
+
+def test_la_carga_archiva_lo_pasado(servicio):
+    assert [cita["Paciente"] for cita in servicio.registro.citas.values()] == ["Vigente"]
+
+
+def test_exportar_incluye_el_historial(servicio, tmp_path):
+    total, df = exportar(servicio, tmp_path / "respaldo.csv")
+    assert total == 2
+    assert df["Paciente"].tolist() == ["Pasada", "Vigente"]
+
+
+def test_exportar_solo_vigentes(servicio, tmp_path):
+    total, df = exportar(servicio, tmp_path / "agenda.csv", solo_vigentes=True)
+    assert total == 1
+    assert df["Paciente"].tolist() == ["Vigente"]
@@ -0,0 +1,37 @@
+"""Interpretación de horas: 24 horas, 12 horas con AM/PM y normalización a HH:MM."""
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("hora, minutos", [
+    ("14:30", 870), ("9:00", 540), (" 09:05 ", 545), ("14:30:00", 870),
+    ("2:30 PM", 870), ("2:30 pm", 870), ("12:00 AM", 0), ("12:15 PM", 735), ("11:59 PM", 1439),
+])
+def test_hora_a_minutos(sm, hora, minutos):
+    assert sm.hora_a_minutos(hora) == minutos
+
+
+@pytest.mark.parametrize("hora", ["25:00", "", "Ej: 4:00 PM", "14:30 PM", "mediodía"])
+def test_hora_no_reconocida(sm, hora):
+    assert sm.hora_a_minutos(hora) is None
+    assert sm.normalizar_hora(hora) == hora
+
+
+def test_normalizar_hora(sm):
+    assert sm.normalizar_hora("2:30 PM") == "14:30"
+    assert sm.normalizar_hora("9:00") == "09:00"
+    assert sm.normalizar_hora("12:00 AM") == "00:00"
+    # Lo que no es texto (NaN de pandas, None) se deja igual
+    assert sm.normalizar_hora(None) is None
+    assert sm.minutos_a_hora(sm.hora_a_minutos("7:05 AM")) == "07:05"
+
+
+def test_columna_minutos(sm):
+    assert sm.columna_minutos(pd.Series(["08:00", "8:00 AM", "x", "4:30 PM"])).tolist() == [480, 480, -1, 990]
+
+
+def test_normalizar_citas_migra_las_horas(sm, nueva_cita):
+    df = pd.DataFrame([nueva_cita(hora="2:30 PM"), nueva_cita(hora="09:00")], columns=sm.COLUMNAS_CITAS)
+    df, migrado = sm.normalizar_citas(df)
+    assert migrado and df["Hora"].tolist() == ["14:30", "09:00"]
+    assert not sm.normalizar_citas(df)[1]
@@ -0,0 +1,68 @@
+"""Importación: validación vectorizada por lotes e incorporación de una vez."""
+import pandas as pd
+import pytest
+
+
+def test_validar_lote(sm, manana):
+    lote = pd.DataFrame({
+        " paciente ": ["Ana", "", "Luis", "Eva", "Juan", "Sara"],
+        "Fecha": [manana, manana, "mañana", manana, manana, manana],
+        "Hora": ["2:30 PM", "09:00", "09:00", "25:00", "9:15", "10:00"],
+        "Médico": ["Dr. Pérez", "", "", "", "", ""],
+        "Duración": ["", "30", "30", "30", "45", "0"],
+        "Estado": ["", "", "", "", "Atendida", ""],
+    })
+    df, errores = sm.validar_lote(lote, 2)
+    assert errores == [(3, "Falta el paciente"), (4, "Fecha inválida (use YYYY-MM-DD)"),
+                       (5, "Hora inválida (use HH:MM o H:MM AM/PM)"), (7, "Duración inválida")]
+    assert df["_fila"].tolist() == [2, 6]
+    assert df["Hora"].tolist() == ["14:30", "09:15"]
+    assert df["Doctor"].tolist() == ["Dr. Pérez", ""]
+    assert df["Duracion"].tolist() == [30, 45]
+    assert df["Estado"].tolist() == ["Agendada", "Atendida"]
+    assert df["Motivo"].tolist() == ["Consulta general"] * 2
+    # Las filas sin ID reciben uno nuevo, distinto en cada una
+    assert df["ID"].str.len().tolist() == [32, 32] and df["ID"].nunique() == 2
+
+
+@pytest.fixture
+def servicio(sm, tmp_path):
+    servicio = sm.ServicioCitas(sm.AlmacenamientoDiario(str(tmp_path / "citas.xlsx")))
+    servicio.cargar()
+    servicio.esperar()
+    yield servicio
+    servicio.detener()
+
+
+def test_importar(sm, servicio, tmp_path, manana):
+    ruta = tmp_path / "nuevas.csv"
+    pd.DataFrame([
+        {"ID": "a1", "Paciente": "Ana", "Doctor": "Dr. Pérez", "Fecha": manana, "Hora": "09:00"},
+        {"ID": "a1", "Paciente": "Repetida", "Doctor": "Dr. Pérez", "Fecha": manana, "Hora": "12:00"},
+        {"ID": "", "Paciente": "Luis", "Doctor": "Dr. Pérez", "Fecha": manana, "Hora": "09:15"},
+        {"ID": "", "Paciente": "Eva", "Doctor": "", "Fecha": manana, "Hora": "10:00", "Duracion": "60"},
+        # Sin doctor también se compara con las demás filas sin doctor
+        {"ID": "", "Paciente": "Juan", "Doctor": "", "Fecha": manana, "Hora": "10:30"},
+        {"ID": "", "Paciente": "Sara", "Doctor": "", "Fecha": "31/12/2030", "Hora": "10:30"},
+    ]).to_csv(ruta, index=False)
+    resultado = servicio.ejecutar_importacion(str(ruta))
+    servicio.esperar()
+    
+    assert resultado["importadas"] == 2 and resultado["errores"] == 4
+    assert sorted(cita["Paciente"] for cita in servicio.registro.citas.values()) == ["Ana", "Eva"]
+    reporte = pd.read_csv(resultado["reporte"])
+    assert reporte["Fila"].tolist() == [3, 4, 6, 7]
+    assert reporte["Error"].tolist()[:3] == ["ID repetido", "Horario ocupado por Ana a las 09:00",
+                                             "Horario ocupado por Eva a las 10:00"]
+    # Una sola escritura para todo el lote, y la agenda ya conoce los horarios importados
+    assert [entrada["tipo"] for entrada in servicio.auditoria.ultimas()] == ["importar"]
+    assert len(servicio.almacenamiento.leer_diario(servicio.almacenamiento.archivo_diario)[0]) == 1
+    assert servicio.agenda.conflicto("", manana, 10 * 60 + 45, 30) is not None
+
+
+def test_importar_sin_verificar_horarios(servicio, tmp_path, manana):
+    ruta = tmp_path / "nuevas.json"
+    pd.DataFrame([{"Paciente": "Ana", "Fecha": manana, "Hora": "09:00"},
+                  {"Paciente": "Luis", "Fecha": manana, "Hora": "09:00"}]).to_json(ruta, orient="records")
+    resultado = servicio.ejecutar_importacion(str(ruta), verificar_horarios=False)
+    assert resultado == {"importadas": 2, "errores": 0, "reporte": None}
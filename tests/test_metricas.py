@@ -0,0 +1,96 @@
+"""Métricas: percentiles, contadores, trazas y qué cubren las mediciones de la interfaz."""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+
+def test_percentiles_y_resumen(sm):
+    metricas = sm.Metricas(ventana=100)
+    for milisegundos in range(1, 201):
+        metricas.registrar("guardado", 0.0, milisegundos / 1000)
+    metricas.contar("cache.aciertos")
+    metricas.contar("cache.aciertos", 2)
+    # Solo cuentan las últimas 100 duraciones para los percentiles; el total, todas
+    assert metricas.percentiles("guardado") == pytest.approx({"p50": 151, "p90": 191, "p99": 200, "max": 200})
+    assert metricas.resumen()["mediciones"]["guardado"]["total"] == 200
+    assert metricas.resumen()["contadores"] == {"cache.aciertos": 3}
+    assert metricas.percentiles("nada") == {}
+    metricas.reiniciar()
+    assert metricas.resumen() == {"mediciones": {}, "contadores": {}}
+
+
+def test_medir_con_error_y_trazas(sm, tmp_path):
+    metricas = sm.Metricas(maximo_eventos=2)
+    with pytest.raises(ValueError):
+        with metricas.medir("falla"):
+            raise ValueError
+    for _ in range(2):
+        with metricas.medir("bloque"):
+            pass
+    assert metricas.totales == {"falla": 1, "bloque": 2}
+    metricas.exportar_trazas(str(tmp_path / "trazas.json"))
+    with open(tmp_path / "trazas.json", encoding="utf-8") as f:
+        trazas = json.load(f)
+    # Los eventos están acotados; el resumen conserva los totales
+    assert [evento["name"] for evento in trazas["traceEvents"] if evento["ph"] == "X"] == ["bloque", "bloque"]
+    assert trazas["otherData"]["mediciones"]["falla"]["total"] == 1
+
+
+def test_medido(sm):
+    sm.METRICAS.reiniciar()
+    
+    @sm.medido("prueba.funcion")
+    def duplicar(valor):
+        """Doble de un valor"""
+        return valor * 2
+    assert duplicar(4) == 8 and duplicar.__doc__ == "Doble de un valor"
+    assert sm.METRICAS.totales["prueba.funcion"] == 1
+
+
+@pytest.fixture
+def ventana(sm, monkeypatch):
+    """Ventana sin Tk: campos y servicio simulados, diálogos que anotan lo medido al abrirse"""
+    sm.METRICAS.reiniciar()
+    dialogos = []
+    
+    def dialogo(tipo):
+        def abrir(*args):
+            dialogos.append((tipo, dict(sm.METRICAS.totales)))
+            return True
+        return abrir
+    for tipo in ("showinfo", "showerror", "showwarning", "askyesno"):
+        monkeypatch.setattr(sm.messagebox, tipo, dialogo(tipo))
+    
+    campo = SimpleNamespace(get=lambda: "")
+    ventana = sm.SistemaCitasMedicas.__new__(sm.SistemaCitasMedicas)
+    ventana.entry_paciente = ventana.entry_fecha = ventana.entry_hora = ventana.entry_motivo = campo
+    ventana.combo_doctor = ventana.spin_duracion = campo
+    ventana.tabla = SimpleNamespace(seleccion=lambda: ["c1"])
+    ventana.cita_seleccionada = None
+    ventana.procesar_eventos = ventana.limpiar_formulario = lambda: None
+    ventana.servicio = SimpleNamespace(agendar=lambda *a, **k: None, reprogramar=lambda *a, **k: None,
+                                       eliminar=lambda *a, **k: None)
+    ventana.dialogos = dialogos
+    return ventana
+
+
+@pytest.mark.parametrize("accion, medicion", [("agendar_cita", "ui.agendar"),
+                                              ("reprogramar_cita", "ui.reprogramar"),
+                                              ("eliminar_cita", "ui.eliminar")])
+def test_dialogos_fuera_de_la_medicion(sm, ventana, accion, medicion):
+    getattr(ventana, accion)()
+    # El aviso de éxito se abre con la medición ya cerrada
+    tipo, medido_al_abrir = ventana.dialogos[-1]
+    assert tipo == "showinfo" and medido_al_abrir.get(medicion) == 1
+    if accion == "eliminar_cita":
+        # La confirmación se pidió antes de empezar a medir
+        assert ventana.dialogos[0] == ("askyesno", {})
+
+
+def test_error_fuera_de_la_medicion(sm, ventana):
+    def rechazar(*args, **kwargs):
+        raise sm.ErrorCita("Horario ocupado")
+    ventana.servicio.agendar = rechazar
+    ventana.agendar_cita()
+    assert ventana.dialogos == [("showerror", {"ui.agendar": 1})]
@@ -0,0 +1,56 @@
+"""Recordatorios: avisos vencidos y registro compartido de envíos."""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def programador(sm, tmp_path):
+    archivo = str(tmp_path / "citas.xlsx")
+    servicio = sm.ServicioCitas(sm.AlmacenamientoDiario(archivo))
+    servicio.cargar()
+    servicio.esperar()
+    # Sin arrancar el hilo: las pruebas llaman a cada paso
+    programador = sm.ProgramadorRecordatorios(servicio, [sm.NotificadorBandeja(archivo)])
+    yield programador
+    servicio.detener()
+
+
+def bandeja(programador):
+    with open(programador.notificadores[0].ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f]
+
+
+def test_avisos_vencidos(sm, programador, manana):
+    servicio = programador.servicio
+    programador.anticipaciones = [("tres_dias_antes", 3 * 24 * 60)]
+    # Una cita de mañana ya pasó el momento de su aviso: sale enseguida
+    cita = servicio.agendar("Eva", manana, "09:00", "Dr. Pérez")
+    programador.programar(cita["ID"])
+    programador.enviar_vencidos()
+    assert [(aviso["paciente"], aviso["tipo"]) for aviso in bandeja(programador)] == [("Eva", "tres_dias_antes")]
+    
+    # Al reprogramar cambia la versión: el aviso viejo se descarta y queda el nuevo
+    fecha = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+    servicio.reprogramar(cita["ID"], fecha, "09:00")
+    programador.programar(cita["ID"])
+    programador.enviar_vencidos()
+    assert len(bandeja(programador)) == 1
+    assert [(tipo, aviso["Fecha"]) for _, tipo, aviso in programador.proximos()] == [("tres_dias_antes", fecha)]
+
+
+def test_enviados_con_linea_cortada(sm, programador, nueva_cita):
+    anterior = "otra|dia_anterior|2030-01-01|09:00"
+    # Un cierre abrupto dejó la última línea a medias
+    with open(programador.ruta_enviados, "wb") as f:
+        f.write(json.dumps({"clave": anterior}).encode() + b'\n{"clave": "cortada|hora_')
+    cita = nueva_cita("Eva")
+    programador.enviar(cita, "hora_anterior")
+    programador.enviar(cita, "hora_anterior")
+    assert len(bandeja(programador)) == 1
+    
+    # Otra estación (o un reinicio) lee todos los envíos sin fallar
+    otro = sm.ProgramadorRecordatorios(programador.servicio, [])
+    otro.leer_enviados()
+    assert otro.enviados == {anterior, f"{cita['ID']}|hora_anterior|{cita['Fecha']}|{cita['Hora']}"}
@@ -0,0 +1,35 @@
+"""Almacenamiento SQLite: ventana de carga y depuración de la tabla de cambios."""
+import pytest
+
+
+@pytest.fixture
+def sqlite(sm, tmp_path):
+    almacenamiento = sm.AlmacenamientoSQLite(str(tmp_path / "citas.xlsx"))
+    almacenamiento.inicializar()
+    almacenamiento.cargar()
+    yield almacenamiento
+    almacenamiento.cerrar()
+
+
+def lote(nueva_cita, cantidad):
+    return [nueva_cita(f"Paciente {i}") for i in range(cantidad)]
+
+
+def cambios(sqlite):
+    return sqlite.conexion.execute("SELECT COUNT(*) FROM cambios").fetchone()[0]
+
+
+def test_importaciones_depuran_los_cambios(sqlite, nueva_cita):
+    sqlite.CAMBIOS_CONSERVADOS, sqlite.CAMBIOS_ENTRE_PODAS = 50, 100
+    # Cada lote avanza la secuencia de a 70: nunca cae justo en un múltiplo de 100
+    for _ in range(5):
+        sqlite.registrar(None, "importar", citas=lote(nueva_cita, 70), verificar_horarios=False)
+    assert sqlite.ultimo_cambio == 350
+    assert cambios(sqlite) <= 50 + 100
+
+
+def test_carga_solo_desde_hoy(sm, sqlite, nueva_cita):
+    sqlite.registrar(None, "importar", citas=[nueva_cita("Vigente"), nueva_cita("Pasada", fecha="2024-03-05")],
+                     verificar_horarios=False)
+    assert [cita["Paciente"] for cita in sqlite.cargar().citas.values()] == ["Vigente"]
+    assert sqlite.leer_archivo("2024-03")["Paciente"].tolist() == ["Pasada"]
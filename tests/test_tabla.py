@@ -0,0 +1,50 @@
+"""Tabla virtual: ventana visible, cambios fila por fila y teclado."""
+import sys
+
+import pytest
+
+from conftest import RAIZ
+
+sys.path.insert(0, str(RAIZ))
+import benchmark_citas  # noqa: E402  (su Treeview simulado permite probar sin pantalla)
+
+
+@pytest.fixture
+def tabla(sm):
+    tabla = benchmark_citas.crear_tabla(sm, lambda clave: [clave])
+    tabla.filas = 5
+    tabla.cargar([f"c{i}" for i in range(20)])
+    return tabla
+
+
+def visibles(tabla):
+    return list(tabla.tree.get_children())
+
+
+def test_solo_se_materializa_la_ventana(tabla):
+    assert visibles(tabla) == ["c0", "c1", "c2", "c3", "c4"]
+    tabla.desplazar("scroll", 1, "pages")
+    assert visibles(tabla) == ["c5", "c6", "c7", "c8", "c9"]
+
+
+def test_eliminar_e_insertar(tabla):
+    for clave in ("c3", "c0", "c17", "c10"):
+        tabla.eliminar_fila(clave)
+    assert tabla.claves == [f"c{i}" for i in range(20) if i not in (0, 3, 10, 17)]
+    assert [tabla.posicion(clave) for clave in ("c1", "c4", "c11", "c19")] == [0, 2, 8, 15]
+    tabla.insertar_fila("nueva")
+    assert tabla.posicion("nueva") == 16 and visibles(tabla)[-1] == "nueva"
+    tabla.eliminar_fila("c18")
+    assert tabla.posicion("nueva") == 15 and not tabla.contiene("c18")
+
+
+def test_flechas_desplazan_la_ventana(tabla):
+    tabla.tree.selection_set("c4")
+    assert tabla.mover_seleccion(1) == "break"
+    assert tabla.seleccion() == ["c5"] and visibles(tabla)[0] == "c1"
+    tabla.mover_seleccion(tabla.filas)
+    assert tabla.seleccion() == ["c10"] and visibles(tabla)[-1] == "c10"
+    tabla.mover_seleccion(-tabla.filas * 4)
+    assert tabla.seleccion() == ["c0"] and visibles(tabla)[0] == "c0"
+    tabla.mover_seleccion(-1)
+    assert tabla.seleccion() == ["c0"]
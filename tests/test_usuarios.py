@@ -0,0 +1,68 @@
+"""Usuarios: contraseñas PBKDF2, actualización del hash al entrar y bloqueo por intentos."""
+import hashlib
+import json
+
+import pytest
+
+
+@pytest.fixture
+def usuarios(sm, tmp_path):
+    usuarios = sm.AlmacenUsuarios(str(tmp_path / "usuarios.json"), iteraciones=1000)
+    usuarios.inicializar({"ana": {"password": "clave-ana", "nombre": "Ana"}})
+    return usuarios
+
+
+def guardado(usuarios, usuario="ana"):
+    with open(usuarios.archivo, encoding="utf-8") as f:
+        return json.load(f)[usuario]["password"]
+
+
+def test_hash_con_sal(usuarios):
+    hash_ana = guardado(usuarios)
+    algoritmo, iteraciones, sal, _ = hash_ana.split("$")
+    assert (algoritmo, iteraciones, len(sal)) == ("pbkdf2_sha256", "1000", 32)
+    # La misma contraseña con otra sal da otro hash
+    assert usuarios.hash_password("clave-ana") != hash_ana
+    assert usuarios.verificar("ana", "clave-ana") == "Ana"
+    assert usuarios.verificar("ana", "otra") is None
+    assert usuarios.verificar("nadie", "clave-ana") is None
+
+
+def test_hash_antiguo_se_reemplaza_al_entrar(usuarios):
+    usuarios.guardar({"ana": {"password": hashlib.sha256(b"clave-ana").hexdigest(), "nombre": "Ana"}})
+    assert usuarios.verificar("ana", "otra") is None
+    assert not guardado(usuarios).startswith("pbkdf2_sha256$")
+    assert usuarios.verificar("ana", "clave-ana") == "Ana"
+    assert guardado(usuarios).startswith("pbkdf2_sha256$1000$")
+    assert usuarios.verificar("ana", "clave-ana") == "Ana"
+
+
+def test_mas_iteraciones_se_reemplaza_al_entrar(sm, usuarios):
+    mas = sm.AlmacenUsuarios(usuarios.archivo, iteraciones=2000)
+    assert mas.verificar("ana", "clave-ana") == "Ana"
+    assert guardado(usuarios).split("$")[1] == "2000"
+    # Otra estación con el valor anterior lo acepta y no lo rebaja
+    assert usuarios.verificar("ana", "clave-ana") == "Ana"
+    assert guardado(usuarios).split("$")[1] == "2000"
+
+
+def test_bloqueo_tras_varios_fallos(sm, usuarios, monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(sm.time, "monotonic", lambda: reloj[0])
+    for _ in range(sm.MAXIMO_INTENTOS - 1):
+        assert usuarios.verificar("ana", "otra") is None
+    # Un acierto antes del límite reinicia la cuenta
+    assert usuarios.verificar("ana", "clave-ana") == "Ana"
+    for _ in range(sm.MAXIMO_INTENTOS):
+        assert usuarios.verificar("ana", "otra") is None
+    with pytest.raises(sm.AccesoBloqueado) as error:
+        usuarios.verificar("ana", "clave-ana")
+    assert error.value.segundos == sm.ESPERA_BLOQUEO + 1
+    # Pasada la espera se puede entrar; cada fallo siguiente duplica la espera
+    reloj[0] += sm.ESPERA_BLOQUEO
+    assert usuarios.verificar("ana", "otra") is None
+    with pytest.raises(sm.AccesoBloqueado) as error:
+        usuarios.verificar("ana", "clave-ana")
+    assert error.value.segundos == 2 * sm.ESPERA_BLOQUEO + 1
+    # El bloqueo es por usuario
+    assert usuarios.verificar("nadie", "x") is None